@@ -0,0 +1,88 @@
+""" Cached data access for the Streamlit pages """
+import os
+import threading
+import streamlit as st
+import data.service_database as service_database
+import services.backend.utils as utils
+
+
+DATABASE = "data/demo.db"
+
+# A connection shared between the sessions, sqlite3 connections can't be used by two threads at the same time
+_connection_lock = threading.Lock()
+
+
+@st.cache_resource
+def migrate_application_database():
+    """
+    Migrate the schema of the demo database once per server process, before a page reads from it.
+    """
+
+    return service_database.migrate_demo_database(DATABASE)
+
+
+migrate_application_database()
+
+
+@st.cache_resource
+def get_connection(database=DATABASE):
+    """
+    Connection that is opened once per server process and reused by all sessions and reruns.
+    """
+
+    return service_database.connect_database(database, check_same_thread=False)
+
+
+def _database_modified(database):
+    # Catches writes by other processes to a database that the helpers of service_database don't write
+    return os.stat(database).st_mtime_ns
+
+
+@st.cache_data(show_spinner=False)
+def _load_table(table, columns, database, version):
+    with _connection_lock:
+        return service_database.load_datatable_from_db(table, columns, database, connection=get_connection(database))
+
+
+def load_table(table, columns='*', database=DATABASE):
+    """
+    Load a table of the database. Results are memoised per table version, every write through the helpers of
+    service_database (or invalidate_tables) makes the next call read the table again. Writes by other processes
+    aren't noticed, call invalidate_tables after them.
+
+    :return: dataframe containing the data, every call returns its own copy
+    """
+
+    if columns != '*':
+        columns = tuple(columns)
+
+    # Keyed on the version of the table only: the job, result and cache tables in the same database are written on
+    # every job update, which would invalidate all tables if the modification time of the file were part of the key
+    return _load_table(table, columns, database, service_database.table_version(table))
+
+
+@st.cache_data(show_spinner=False)
+def _load_demo_terminals(positions_modified):
+    return utils.get_demo_terminals()
+
+
+def load_demo_terminals():
+    """
+    Load the demo terminals, see utils.get_demo_terminals.
+
+    :return: dataframe with the demo terminals, list with the default selection, list with the sea terminals
+    """
+
+    return _load_demo_terminals(_database_modified(service_database.TERMINAL_POSITIONS_DATABASE))
+
+
+def invalidate_tables(*tables):
+    """
+    Make the next load_table call of the tables read from the database, use this after writing to a table without
+    the helpers of service_database.
+
+    :return: None
+    """
+
+    for table in tables:
+        service_database.bump_table_version(table)
@@ -1,15 +1,72 @@
-import json
-import random
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-import sqlite3
+from data.service_database import bulk_insert_to_db
 
 timestamp = datetime.now()
 next_midnight = (timestamp + timedelta(days=2)).replace(hour=0, minute=0, second=0, microsecond=0)
 previous_midnight = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
 
 
-def generate_container_data(proportions, total_teu, sea_terminals, inland_terminals):
+# Number of containers of a booking, the bookings get one of these sizes at random
+CONTAINER_GROUP_SIZES = [1, 2, 4, 5, 7, 8, 10, 15, 18, 30, 35, 40, 42, 50, 65, 73, 88, 91, 95, 100, 111, 133, 142, 150]
+
+# TEU of a container: container type and the weights it gets. A container gets the first weight or a random weight
+# between the bounds with equal probability, None means it always gets the first weight.
+CONTAINER_SIZES = {1: ('20TK', 2200, (3000, 4400)),
+                   2: ('40DV', 3870, (5000, 7500)),
+                   2.25: ('45HC', 5050, None)}
+
+CONTAINER_COLUMNS = ['bookingReference', 'bookingDateCreated', 'containerNumber', 'containerType', 'teu', 'weight',
+                     'reefer', 'dangerousGoods', 'loadTerminal', 'loadExternalId', 'loadTimeWindowStart',
+                     'loadTimeWindowEnd', 'dischargeTerminal', 'dischargeExternalId', 'dischargeTimeWindowStart',
+                     'dischargeTimeWindowEnd']
+
+
+def container_group_sizes(num_containers, rng):
+    """
+    Split the containers in bookings with the sizes of CONTAINER_GROUP_SIZES, the last booking is cut off at the
+    number of containers
+
+    :param num_containers: total number of containers
+    :param rng: numpy random generator
+    :return: array with the number of containers per booking
+    """
+
+    sizes = np.array(CONTAINER_GROUP_SIZES)
+    groups = np.empty(0, dtype=int)
+    while groups.sum() < num_containers:
+        missing = num_containers - groups.sum()
+        groups = np.concatenate([groups, rng.choice(sizes, size=int(missing / sizes.mean() * 1.2) + 1)])
+
+    totals = np.cumsum(groups)
+    last = int(np.searchsorted(totals, num_containers))
+    groups = groups[:last + 1]
+    groups[-1] -= totals[last] - num_containers
+
+    return groups[groups > 0]
+
+
+def generate_container_data(proportions, total_teu, sea_terminals, inland_terminals, seed=None,
+                            database="data/demo.db"):
+    """
+    Generate a random container dataset and replace the container_orders table with it. The containers are drawn as
+    arrays by a seeded numpy generator and written with one bulk insert, so millions of containers take seconds.
+
+    :param proportions: list with the share of the TEU in 20ft, 40ft and 45ft containers
+    :param total_teu: TEU of the dataset
+    :param sea_terminals: list with the names of the sea terminals
+    :param inland_terminals: list with the names of the inland terminals, at least two
+    :param seed: seed of the random generator, the same seed generates the same dataset on the same day
+    :param database: path of the database
+    :return: dataframe with the containers
+    """
+
+    if not sea_terminals or len(inland_terminals) < 2:
+        raise ValueError("Generating containers needs at least one sea terminal and two inland terminals")
+
+    rng = np.random.default_rng(seed)
+
     # Step 2: Generate the container information
     # Number of containers
     num_containers = {
@@ -18,109 +75,86 @@ def generate_container_data(proportions, total_teu, sea_terminals, inland_termin
         2.25: int(total_teu * proportions[2] / 2.25)
     }
 
-    # Adjust for any rounding issues to ensure total TEU is 5000
-    while sum([k * v for k, v in num_containers.items()]) <= total_teu:
-        num_containers[1] += 1
-
-    containers = []
-    for size, count in num_containers.items():
-        containers.extend([size] * count)
-    random.shuffle(containers)
-
-    # Step 3: Determine Pickup and Delivery Locations
-    container_data = []
-
-    # Helper function to generate grouped container attributes
-    def generate_container_group(container_group_sizes):
-        if random.random() < 0.8:  # 80% for sea terminals
-            if random.random() < 0.5:
-                pickup = random.choice(sea_terminals)
-                delivery = random.choice(inland_terminals)
-            else:
-                pickup = random.choice(inland_terminals)
-                delivery = random.choice(sea_terminals)
-        else:  # 20% for inland terminals
-            pickup = random.choice(inland_terminals)
-            delivery = random.choice([t for t in inland_terminals if t != pickup])
-
-        earliest_pickup = random.randint(0, 6)  # Earliest pickup time within the week
-        latest_delivery = random.randint(earliest_pickup + 3,
-                                         earliest_pickup + 7)  # Latest delivery time within the week
-
-        no_of_containers = random.choice(container_group_sizes)
-
-        booking_number = random.randint(120000, 130000)
-
-        return pickup, delivery, earliest_pickup, latest_delivery, no_of_containers, booking_number
-
-    container_group_sizes = [1, 2, 4, 5, 7, 8, 10, 15, 18, 30, 35, 40, 42, 50, 65, 73, 88, 91, 95, 100, 111, 133, 142,
-                             150]
-    diff = len(containers) - sum(container_group_sizes)
-    extra_size1 = int(0.175 * diff)
-    extra_size2 = int(0.33 * diff)
-    extra_size3 = diff - extra_size1 - extra_size2
-    container_group_sizes.append(extra_size1)
-    container_group_sizes.append(extra_size2)
-    container_group_sizes.append(extra_size3)
-    # Generate grouped containers
-    all_locations = sea_terminals + inland_terminals
-    externalIds = {}
-    k = 0
-    for location in all_locations:
-        k = k + 1
-        externalIds[location] = k
-    while len(containers) > 0:
-        pickup, delivery, earliest_pickup, latest_delivery, no_of_containers, booking_number = generate_container_group(
-            container_group_sizes)
-        container_group_sizes.remove(no_of_containers)
-        no_of_containers = min(no_of_containers, len(containers))
-        l = 1
-        for container in range(no_of_containers):
-            size = random.choice(containers)
-            containers.remove(size)
-            if size == 2:
-                container_type = '40DV'
-                weight = random.choice([3870, random.randint(5000, 7500)])
-            elif size == 2.25:
-                container_type = '45HC'
-                weight = 5050
-            else:
-                container_type = '20TK'
-                weight = random.choice([2200, random.randint(3000, 4400)])
-
-            latest_delivery = max(earliest_pickup + 1, latest_delivery)
-            earliest = (next_midnight + timedelta(days=earliest_pickup)).strftime('%Y-%m-%dT%H:%M:%SZ')
-            latest = (next_midnight + timedelta(days=latest_delivery)).strftime('%Y-%m-%dT%H:%M:%SZ')
-            container_data.append({
-                'bookingReference': str(booking_number) + '-' + str(l),
-                'bookingDateCreated': timestamp.strftime('%d %m %Y'),
-                'containerNumber': f'C{len(container_data) + 1:05}',
-                'containerType': container_type,
-                'teu': size,
-                'weight': weight,
-                'reefer': False,
-                'dangerousGoods': False,
-                'loadTerminal': pickup,
-                'loadExternalId': externalIds[pickup],
-                'loadTimeWindowStart': earliest,
-                'loadTimeWindowEnd': latest,
-                'dischargeTerminal': delivery,
-                'dischargeExternalId': externalIds[delivery],
-                'dischargeTimeWindowStart': earliest,
-                'dischargeTimeWindowEnd': latest
-            })
-            l = l + 1
-
-    container_df = pd.DataFrame(container_data)
-
-    # Connect to the database (or create it if it doesn't exist)
-    conn = sqlite3.connect(r"data\demo.db")
-
-    # Save the DataFrame to the 'users' table in the SQLite3 database
-    container_df.to_sql('container_orders', conn, if_exists='replace', index=False)
-
-    # Close the connection
-    conn.close()
+    # Adjust for any rounding issues: add 20ft containers until the TEU is more than total_teu
+    shortage = total_teu - sum([k * v for k, v in num_containers.items()])
+    if shortage >= 0:
+        num_containers[1] += int(np.floor(shortage)) + 1
+
+    sizes = rng.permutation(np.repeat(np.array(list(num_containers.keys()), dtype=float),
+                                      list(num_containers.values())))
+    count = len(sizes)
+
+    # Step 3: Determine Pickup and Delivery Locations per booking
+    groups = container_group_sizes(count, rng)
+    no_of_groups = len(groups)
+
+    sea = np.array(sea_terminals, dtype=object)
+    inland = np.array(inland_terminals, dtype=object)
+
+    # 80% of the bookings between a sea terminal and an inland terminal (half in each direction), 20% between two
+    # different inland terminals
+    sea_inland = rng.random(no_of_groups) < 0.8
+    from_sea = rng.random(no_of_groups) < 0.5
+    sea_choice = sea[rng.integers(len(sea), size=no_of_groups)]
+    inland_choice = inland[rng.integers(len(inland), size=no_of_groups)]
+    other_inland = rng.integers(len(inland) - 1, size=no_of_groups)
+    inland_pickup = rng.integers(len(inland), size=no_of_groups)
+    other_inland += other_inland >= inland_pickup
+
+    pickup = np.where(sea_inland, np.where(from_sea, sea_choice, inland_choice), inland[inland_pickup])
+    delivery = np.where(sea_inland, np.where(from_sea, inland_choice, sea_choice), inland[other_inland])
+
+    earliest_pickup = rng.integers(0, 7, size=no_of_groups)  # Earliest pickup time within the week
+    latest_delivery = earliest_pickup + rng.integers(3, 8, size=no_of_groups)  # Latest delivery time within the week
+    booking_number = rng.integers(120000, 130001, size=no_of_groups)
+
+    # Step 4: Spread the bookings over the containers
+    group = np.repeat(np.arange(no_of_groups), groups)
+    position = np.arange(count) - np.repeat(np.cumsum(groups) - groups, groups) + 1
+
+    container_type = np.empty(count, dtype=object)
+    weight = np.empty(count, dtype=np.int64)
+    for size, (size_type, fixed_weight, random_weights) in CONTAINER_SIZES.items():
+        is_size = sizes == size
+        container_type[is_size] = size_type
+        weight[is_size] = fixed_weight
+        if random_weights is not None:
+            random_weight = is_size & (rng.random(count) < 0.5)
+            weight[random_weight] = rng.integers(random_weights[0], random_weights[1] + 1,
+                                                 size=int(random_weight.sum()))
+
+    # The time windows are whole days after next midnight, the strings are formatted once per day
+    days = np.array([(next_midnight + timedelta(days=day)).strftime('%Y-%m-%dT%H:%M:%SZ')
+                     for day in range(int(latest_delivery.max(initial=0)) + 1)], dtype=object)
+    earliest = days[earliest_pickup][group]
+    latest = days[latest_delivery][group]
+
+    external_ids = {location: k for k, location in enumerate(sea_terminals + inland_terminals, start=1)}
+
+    container_df = pd.DataFrame({
+        'bookingReference': pd.Series(booking_number[group]).astype(str) + '-' + pd.Series(position).astype(str),
+        'bookingDateCreated': timestamp.strftime('%d %m %Y'),
+        'containerNumber': 'C' + pd.Series(np.arange(1, count + 1)).astype(str).str.zfill(5),
+        'containerType': container_type,
+        'teu': sizes,
+        'weight': weight,
+        'reefer': False,
+        'dangerousGoods': False,
+        'loadTerminal': pickup[group],
+        'loadExternalId': pd.Series(pickup[group]).map(external_ids).to_numpy(),
+        'loadTimeWindowStart': earliest,
+        'loadTimeWindowEnd': latest,
+        'dischargeTerminal': delivery[group],
+        'dischargeExternalId': pd.Series(delivery[group]).map(external_ids).to_numpy(),
+        'dischargeTimeWindowStart': earliest,
+        'dischargeTimeWindowEnd': latest
+    }, columns=CONTAINER_COLUMNS)
+
+    # Replace the 'container_orders' table in one transaction
+    rows = zip(*[container_df[column].tolist() for column in CONTAINER_COLUMNS])
+    bulk_insert_to_db('container_orders', CONTAINER_COLUMNS, rows, database=database, replace=True)
+
+    return container_df
 
 # Step 5: Define the Barge Fleet
 # barges = []
@@ -0,0 +1,235 @@
+""" Versioned schema migrations for the demo database """
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+
+def _table_exists(connection, table):
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (table,)).fetchone() is not None
+
+
+def _column_exists(connection, table, column):
+    return any(row[1] == column for row in connection.execute(f'PRAGMA table_xinfo("{table}")'))
+
+
+def _retype_columns(connection, table, column_types):
+    """
+    SQLite can't change the type of a column, so the table is rebuilt with the new declared types and the values are
+    cast on copy.
+
+    :param table: name of the table
+    :param column_types: dictionary {column_name: declared_type}
+    :return: None
+    """
+
+    if not _table_exists(connection, table):
+        return
+
+    columns = [(row[1], row[2]) for row in connection.execute(f'PRAGMA table_info("{table}")')]
+    definitions = ', '.join(f'"{name}" {column_types.get(name, declared_type)}' for name, declared_type in columns)
+    values = ', '.join(f'CAST("{name}" AS {column_types[name]})' if name in column_types else f'"{name}"'
+                       for name, _ in columns)
+
+    connection.execute(f'CREATE TABLE "{table}_retyped" ({definitions})')
+    connection.execute(f'INSERT INTO "{table}_retyped" SELECT {values} FROM "{table}"')
+    connection.execute(f'DROP TABLE "{table}"')
+    connection.execute(f'ALTER TABLE "{table}_retyped" RENAME TO "{table}"')
+
+
+def migration_typed_columns(connection):
+    """
+    Identifiers were stored with REAL affinity (or without values at all), which makes pandas return them as float
+    or object columns. Declare them as INTEGER.
+    """
+
+    _retype_columns(connection, 'barges', {'mmsi': 'INTEGER', 'eni': 'INTEGER'})
+    _retype_columns(connection, 'daily_costs', {'barge_id': 'INTEGER'})
+    _retype_columns(connection, 'forbidden_terminals', {'barge_id': 'INTEGER', 'terminal_id': 'INTEGER'})
+    _retype_columns(connection, 'operating_times', {'barge_id': 'INTEGER', 'terminal_id': 'INTEGER'})
+    _retype_columns(connection, 'terminal_references', {'source_id': 'INTEGER'})
+
+
+def migration_terminal_code(connection):
+    """
+    The terminal code (unlocode || terminal_code) is used to match terminals everywhere, store it as a generated
+    column so it can be indexed.
+    """
+
+    if _table_exists(connection, 'terminals') and not _column_exists(connection, 'terminals', 'code'):
+        connection.execute("ALTER TABLE terminals "
+                           "ADD COLUMN code TEXT GENERATED ALWAYS AS (unlocode || terminal_code) VIRTUAL")
+
+
+# Covering indexes for the lookups of the application, {table: [(index_name, columns)]}
+INDEXES = {
+    'terminals': [('ix_terminals_code', 'code, id, latitude, longitude'),
+                  ('ix_terminals_terminal_code', 'terminal_code, latitude, longitude')],
+    'barges': [('ix_barges_call_sign', 'call_sign, barge_id, name'),
+               ('ix_barges_barge_id', 'barge_id, name')],
+    'container_types': [('ix_container_types_iso_type_code', 'iso_type_code'),
+                        ('ix_container_types_iso_type_code_1984', 'iso_type_code_1984'),
+                        ('ix_container_types_display_code', 'display_code')],
+    'column_references': [('ix_column_references_source', 'col_ref_source')],
+    'operating_times': [('ix_operating_times_barge_id', 'barge_id, week_day'),
+                        ('ix_operating_times_terminal_id', 'terminal_id, week_day')],
+    'daily_costs': [('ix_daily_costs_barge_id', 'barge_id, daily_cost_type, week_day')],
+    'terminal_references': [('ix_terminal_references_terminal_id', 'terminal_id')],
+}
+
+
+def migration_indexes(connection):
+    """
+    Create the indexes on the columns the application filters on.
+    """
+
+    for table, indexes in INDEXES.items():
+        if not _table_exists(connection, table):
+            continue
+        for index_name, columns in indexes:
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON "{table}" ({columns})')
+
+    connection.execute('ANALYZE')
+
+
+# Unit ids of the barges in Dave, (call_sign, source, source_id)
+BARGE_REFERENCES = [('TN10', 'DAVE', 61), ('SW17', 'DAVE', 59), ('SP07', 'DAVE', 58)]
+
+
+def migration_barge_references(connection):
+    """
+    The ids of the barges in other systems (e.g. the unit id in Dave) were a literal in the code, store them like the
+    terminal references.
+    """
+
+    connection.execute("CREATE TABLE IF NOT EXISTS barge_references ("
+                       "barge_ref_id INTEGER PRIMARY KEY, call_sign TEXT NOT NULL, source TEXT NOT NULL, "
+                       "source_id INTEGER NOT NULL)")
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_barge_references_source_call_sign "
+                       "ON barge_references (source, call_sign)")
+    connection.executemany("INSERT OR IGNORE INTO barge_references (call_sign, source, source_id) VALUES (?, ?, ?)",
+                           BARGE_REFERENCES)
+
+
+# The version of a database is stored in PRAGMA user_version, migrations above that version are applied in order
+MIGRATIONS = [
+    (1, migration_typed_columns),
+    (2, migration_terminal_code),
+    (3, migration_indexes),
+    (4, migration_barge_references),
+]
+
+
+def migrate_database(database="data/demo.db"):
+    """
+    Apply the migrations the database doesn't have yet. Every migration runs in its own transaction together with
+    the version update, so an interrupted migration is applied again on the next run.
+
+    :param database: path of the database
+    :return: tuple with the version before and after migrating
+    """
+
+    connection = sqlite3.connect(database, isolation_level=None)
+
+    try:
+        start_version = connection.execute('PRAGMA user_version').fetchone()[0]
+        version = start_version
+
+        for migration_version, migration in MIGRATIONS:
+            if migration_version <= version:
+                continue
+
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                # Another process could have migrated while we were waiting for the lock
+                if connection.execute('PRAGMA user_version').fetchone()[0] >= migration_version:
+                    connection.execute('ROLLBACK')
+                    continue
+
+                migration(connection)
+                connection.execute(f'PRAGMA user_version = {migration_version}')
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+            print(f"Applied migration {migration_version} ({migration.__name__}) to {database}")
+            version = migration_version
+    finally:
+        connection.close()
+
+    return start_version, version
+
+
+# Lookups of the application, (description, query, parameters) or (description, query before migrating, parameters,
+# query after migrating) when the migrations add a column the lookup uses
+BENCHMARK_QUERIES = [
+    ("barge id by call sign", "SELECT barge_id FROM barges WHERE call_sign = ?", ("Albatross",)),
+    ("barge names by id", "SELECT barge_id, name FROM barges WHERE barge_id IN (?, ?, ?)", (1, 2, 3)),
+    ("terminal by code", "SELECT id, latitude, longitude FROM terminals WHERE unlocode || terminal_code = ?",
+     ("BEANR00115",), "SELECT id, latitude, longitude FROM terminals WHERE code = ?"),
+    ("terminal coordinates", "SELECT terminal_code, latitude, longitude FROM terminals WHERE terminal_code IN (?, ?)",
+     ("00115", "00117")),
+    ("container type", "SELECT * FROM container_types "
+                       "WHERE iso_type_code = ? OR iso_type_code_1984 = ? OR display_code = ?", ("45G1",) * 3),
+    ("column references", "SELECT * FROM column_references WHERE col_ref_source = ?", ("MSC",)),
+    ("barge operating times", "SELECT * FROM operating_times WHERE barge_id = ?", (1,)),
+    ("terminal operating times", "SELECT * FROM operating_times WHERE terminal_id = ?", (1,)),
+]
+
+
+def _time_queries(database, repeat, migrated=False):
+    connection = sqlite3.connect(database)
+    timings = {}
+    for description, query, params, *migrated_query in BENCHMARK_QUERIES:
+        if migrated and migrated_query:
+            query = migrated_query[0]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            connection.execute(query, params).fetchall()
+        timings[description] = (time.perf_counter() - start) / repeat * 1e6
+    connection.close()
+
+    return timings
+
+
+def benchmark_migrations(database="data/demo.db", repeat=2000):
+    """
+    Measure the latency of the application lookups on a copy of the database before and after migrating it.
+
+    :param database: path of the database, it is not changed
+    :param repeat: number of executions per query
+    :return: dictionary {description: (microseconds before, microseconds after)}
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        copy = os.path.join(directory, 'benchmark.db')
+        shutil.copyfile(database, copy)
+
+        connection = sqlite3.connect(copy)
+        connection.execute('PRAGMA user_version = 0')
+        connection.close()
+
+        before = _time_queries(copy, repeat)
+        migrate_database(copy)
+        after = _time_queries(copy, repeat, migrated=True)
+
+    results = {description: (before[description], after[description]) for description in before}
+
+    print(f"{'query':<28}{'before (us)':>14}{'after (us)':>14}")
+    for description, (before_us, after_us) in results.items():
+        print(f"{description:<28}{before_us:>14.1f}{after_us:>14.1f}")
+
+    return results
+
+
+if __name__ == "__main__":
+    # python -m data.migrations migrates the demo database, add benchmark to compare the lookups instead
+    import sys
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark_migrations()
+    else:
+        migrate_database()
@@ -1,25 +1,228 @@
+import os
+import re
 import sqlite3
+import threading
+from collections import OrderedDict, defaultdict
 import pandas as pd
 import json
+from data.migrations import migrate_database
+
+
+class QueryCache:
+    """
+    Memoise query results keyed by the normalised SQL and its parameters. Every entry remembers the version of the
+    tables it read, the write helpers in this module bump those versions so a stale result is never returned.
+    Entries are evicted least recently used first.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.table_versions = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached dataframe for the key, or None when it is missing or one of its tables has changed.
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                table_versions, table = entry
+                if all(self.table_versions[name] == version for name, version in table_versions.items()):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return table.copy()
+
+                del self.entries[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, tables, table):
+        """
+        Store a copy of the dataframe together with the current versions of the tables it was read from.
+        """
+
+        with self.lock:
+            self.entries[key] = ({name: self.table_versions[name] for name in tables}, table.copy())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def bump(self, table):
+        """
+        Invalidate every cached result that was read from the table.
+        """
+
+        with self.lock:
+            self.table_versions[table.lower()] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def metrics(self):
+        """
+        :return: dictionary with the hits, misses, evictions, hit ratio and number of cached entries
+        """
+
+        with self.lock:
+            requests = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_ratio": round(self.hits / requests, 4) if requests else 0.0,
+                    "entries": len(self.entries)}
+
+
+query_cache = QueryCache()
+
+# Table names are plain identifiers or quoted like "Query result" / [Query result], optionally prefixed by a schema
+_TABLE_NAME = r'(?:\w+\.)?(?:"([^"]+)"|\[([^\]]+)\]|`([^`]+)`|(\w+))'
+_READ_TABLES = re.compile(r'\b(?:FROM|JOIN)\s+' + _TABLE_NAME, re.IGNORECASE)
+_WRITE_TABLE = re.compile(r'^\s*(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+'
+                          + _TABLE_NAME, re.IGNORECASE)
+
+
+def normalise_query(query):
+    """
+    Collapse the whitespace of a query so formatting differences share one cache entry.
+    """
+
+    return re.sub(r'\s+', ' ', query).strip().rstrip(';').strip()
+
+
+def query_tables(query):
+    """
+    Retrieve the (lower case) names of the tables a query reads from.
+    """
+
+    return {next(name for name in match if name).lower() for match in _READ_TABLES.findall(query)}
+
+
+def bump_table_version(table):
+    """
+    Mark a table as changed, cached query results that read from it are no longer served.
+    :return: None
+    """
+
+    query_cache.bump(table)
+
+
+def table_version(table):
+    """
+    :return: the number of times the table has been written by the helpers in this module
+    """
+
+    return query_cache.table_versions.get(table.lower(), 0)
+
+
+def query_cache_metrics():
+    """
+    :return: dictionary with the hit/miss metrics of the query cache
+    """
+
+    return query_cache.metrics()
+
+
+def clear_query_cache():
+    """
+    Drop all cached query results
+    :return: None
+    """
+
+    query_cache.clear()
+
+
+TERMINAL_POSITIONS_DATABASE = "data/terminal_positions.db"
+
+
+def migrate_demo_database(database="data/demo.db"):
+    """
+    Apply the schema migrations (see data.migrations) to the demo database. Connections don't migrate, this is called
+    once at the start of the application.
+
+    :param database: path of the database
+    :return: schema version of the database
+    """
+
+    start_version, version = migrate_database(database)
+    if version != start_version:
+        clear_query_cache()
+
+    return version
+
+
+def connect_database(database="data/demo.db", attach_positions=False, check_same_thread=True):
+    """
+    Open a connection to the database. The schema isn't migrated, see migrate_demo_database.
+
+    :param database: path of the database
+    :param attach_positions: attach the terminal positions database as schema "positions"
+    :param check_same_thread: set to False for a connection that is shared between threads
+    :return: sqlite3 connection
+    """
+
+    connection = sqlite3.connect(database, check_same_thread=check_same_thread)
+
+    if attach_positions:
+        if not os.path.exists(TERMINAL_POSITIONS_DATABASE):
+            connection.close()
+            raise ValueError(f"Terminal positions database {TERMINAL_POSITIONS_DATABASE} does not exist")
+        connection.execute("ATTACH DATABASE ? AS positions", (TERMINAL_POSITIONS_DATABASE,))
+
+    return connection
+
+
+# pandas dtype of the declared column types, used for the columns read_sql returns as object (e.g. all NULL)
+DECLARED_DTYPES = {'INTEGER': 'Int64', 'REAL': 'float64'}
+
+
+def _apply_declared_types(connection, table, df):
+    """
+    Convert object columns to the dtype of their declared type, columns with values that don't fit are kept as is.
+    """
+
+    declared_types = {row[1]: row[2].upper() for row in connection.execute(f'PRAGMA table_xinfo("{table}")')}
+
+    for column in df.columns[df.dtypes == object]:
+        dtype = DECLARED_DTYPES.get(declared_types.get(column))
+        if dtype is None:
+            continue
+        try:
+            df[column] = pd.to_numeric(df[column]).astype(dtype)
+        except (ValueError, TypeError):
+            pass
+
+    return df
 
 
 # Load data from the database
-def load_datatable_from_db(table, columns='*', database="data/demo.db"):
+def load_datatable_from_db(table, columns='*', database="data/demo.db", connection=None):
     """
     Load data from the database
+    :param connection: open connection to read with, it is left open. By default a new connection is opened.
     :return: dataframe containing the data
     """
 
     if columns != '*':
         columns = ', '.join(columns)
 
-    connection = sqlite3.connect(database)
+    close_connection = connection is None
+    if close_connection:
+        connection = connect_database(database)
 
     query = f"SELECT {columns} FROM {table}"
-    table = pd.read_sql(query, connection)
+    table = _apply_declared_types(connection, table, pd.read_sql(query, connection))
 
-    pd.read_sql(query, connection)
-    connection.close()
+    if close_connection:
+        connection.close()
 
     return table
 
@@ -31,31 +234,134 @@ def load_datatable_from_terminal_db():
     :return: dataframe containing the data
     """
 
-    import pandas as pd
-    import sqlite3
-
-    # Connect to the database
-    conn = sqlite3.connect('data/terminal_positions.db')
+    connection = connect_database(attach_positions=True)
 
     # Query with proper table name handling
-    query = 'SELECT * FROM "Query result"'  # Use double quotes or square brackets around table name
-    terminals_df = pd.read_sql(query, conn)
+    query = 'SELECT * FROM positions."Query result"'  # Use double quotes or square brackets around table name
+    terminals_df = pd.read_sql(query, connection)
 
-    conn.close()
+    connection.close()
     return terminals_df
 
 
-def load_query_from_db(query):
+# Aggregate over the terminal positions that changes whenever a terminal is added, removed or edited
+_POSITIONS_SIGNATURE = """
+    SELECT count(*), max(id), max(updatedOn), total(entityVersion), total(latitude), total(longitude),
+           total(length(code)), total(length(description)), total(minCallSize), group_concat(DISTINCT town)
+    FROM positions."Query result"
+"""
+
+# Terminals of the demo towns with the longest description per code, and a valid position
+_DEMO_TERMINALS = """
+    WITH ranked AS (
+        SELECT code, description, latitude, longitude, town, coalesce(minCallSize, 0) AS minimum_call_size,
+               ROW_NUMBER() OVER (PARTITION BY code ORDER BY length(description) DESC, rowid) AS description_rank
+        FROM positions."Query result"
+        WHERE town IN ('Rotterdam', 'Antwerpen') AND code IS NOT NULL
+    )
+    SELECT code, description, latitude, longitude, town, minimum_call_size AS "minimum call size"
+    FROM ranked
+    WHERE description_rank = 1 AND latitude IS NOT 0 AND longitude IS NOT 0
+    ORDER BY code
+"""
+
+
+def refresh_demo_terminals(sea_terminals, inland_terminals, database="data/demo.db"):
     """
-    Load data from the database
+    Materialise the demo terminals of the terminal positions database into the demo_terminals table. The table is
+    only rebuilt when the terminal positions or the terminal categories have changed since the last refresh.
+
+    Terminals with a code ending in digits are described as K + the digits of their code (e.g. K1700), the others by
+    their description. Terminals in sea_terminals / inland_terminals get category 'sea' / 'inland'.
+
+    :param sea_terminals: list with the (alternative) descriptions of the sea terminals
+    :param inland_terminals: list with the (alternative) descriptions of the inland terminals
+    :param database: path of the database
+    :return: True when the table was rebuilt
+    """
+
+    connection = connect_database(database, attach_positions=True)
+
+    try:
+        connection.execute("CREATE TABLE IF NOT EXISTS materialised_tables "
+                           "(name TEXT PRIMARY KEY, signature TEXT, refreshed_on TEXT)")
+
+        source = connection.execute(_POSITIONS_SIGNATURE).fetchone()
+        signature = json.dumps([list(source), list(sea_terminals), list(inland_terminals)])
+
+        current = connection.execute("SELECT signature FROM materialised_tables WHERE name = 'demo_terminals'").fetchone()
+        table_exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'demo_terminals'"
+                                          ).fetchone() is not None
+        if table_exists and current is not None and current[0] == signature:
+            return False
+
+        demo_terminals = pd.read_sql(_DEMO_TERMINALS, connection)
+
+        codes = demo_terminals['code'].fillna('')
+        digits = codes.str.replace(r'\D', '', regex=True)
+        numbered = codes.str[-3:].str.isdigit() & (digits != '')
+        demo_terminals['alternative description'] = demo_terminals['description'].where(
+            ~numbered, 'K' + digits.where(numbered, '0').astype('int64').astype(str))
+
+        demo_terminals['category'] = None
+        demo_terminals.loc[demo_terminals['alternative description'].isin(inland_terminals), 'category'] = 'inland'
+        demo_terminals.loc[demo_terminals['alternative description'].isin(sea_terminals), 'category'] = 'sea'
+
+        with connection:
+            demo_terminals.to_sql('demo_terminals', connection, if_exists='replace', index=False)
+            connection.execute("CREATE UNIQUE INDEX ux_demo_terminals_code ON demo_terminals (code)")
+            connection.execute("INSERT OR REPLACE INTO materialised_tables (name, signature, refreshed_on) "
+                               "VALUES ('demo_terminals', ?, datetime('now'))", (signature,))
+    finally:
+        connection.close()
+
+    bump_table_version('demo_terminals')
+    print(f"Refreshed demo_terminals with {len(demo_terminals)} terminals")
+
+    return True
+
+
+def load_demo_terminals(sea_terminals, inland_terminals, database="data/demo.db"):
+    """
+    Load the materialised demo terminals, refreshing them first when the terminal positions have changed.
+
+    :return: dataframe containing the demo terminals ordered by code
+    """
+
+    refresh_demo_terminals(sea_terminals, inland_terminals, database)
+
+    return load_query_from_db("SELECT * FROM demo_terminals ORDER BY code", database=database)
+
+
+def load_query_from_db(query, params=None, database="data/demo.db", use_cache=True):
+    """
+    Load data from the database. Results are memoised per normalised query and parameters until one of the tables
+    the query reads from is written by one of the helpers in this module.
+
+    :param query: SQL query, use ? placeholders for values
+    :param params: sequence with the values of the placeholders
+    :param database: path of the database
+    :param use_cache: set to False to always read from the database
     :return: dataframe containing the data
     """
-    connection = sqlite3.connect("data/demo.db")
 
-    table = pd.read_sql(query, connection)
+    params = tuple(params) if params is not None else ()
+    key = (database, normalise_query(query), params)
+
+    if use_cache:
+        table = query_cache.get(key)
+        if table is not None:
+            return table
+
+    connection = connect_database(database)
+
+    table = pd.read_sql(query, connection, params=params)
 
     connection.close()
 
+    if use_cache:
+        query_cache.put(key, query_tables(query), table)
+
     return table
 
 
@@ -64,11 +370,129 @@ def store_dataframe_to_db(df, table):
     Store the dataframe to the database
     :return: None
     """
-    connection = sqlite3.connect("data/demo.db")
+    connection = connect_database()
 
     df.to_sql(table, connection, if_exists='replace', index=False)
 
     connection.close()
+    bump_table_version(table)
+
+
+# Natural keys of the tables that are synchronised with upsert_dataframe_to_db
+NATURAL_KEYS = {'container_orders': ['containerNumber', 'bookingReference']}
+
+
+def _dataframe_rows(df):
+    """
+    Convert a dataframe to tuples sqlite can bind: missing values become None and timestamps are written in the same
+    format as DataFrame.to_sql.
+    """
+
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')
+
+    df = df.astype(object).where(df.notna(), None)
+
+    return df.itertuples(index=False, name=None)
+
+
+def upsert_dataframe_to_db(df, table, key_columns=None, batch_size=5000, delete_missing=False,
+                           database="data/demo.db"):
+    """
+    Insert new rows and update changed rows of a table, keyed on the natural key of the table. The dataframe is
+    written in batches to a temporary staging table and merged with one INSERT ... ON CONFLICT DO UPDATE, rows that
+    are identical to the stored row are not rewritten.
+
+    :param df: dataframe with (a subset of) the columns of the table, columns that aren't in the table are left out
+    :param table: name of the table
+    :param key_columns: list of columns that identify a row, defaults to NATURAL_KEYS[table], they can't be empty
+    :param batch_size: number of rows per executemany batch
+    :param delete_missing: delete the rows of the table whose key is not in the dataframe
+    :param database: path of the database
+    :return: number of inserted, updated and deleted rows
+    """
+
+    if key_columns is None:
+        key_columns = NATURAL_KEYS[table]
+
+    missing_keys = [column for column in key_columns if column not in df.columns]
+    if missing_keys:
+        raise ValueError(f"The data for {table} has no column {', '.join(missing_keys)}")
+
+    # Empty keys never match a stored row, these rows would be inserted again on every upsert
+    empty_keys = df[key_columns].isna().any(axis=1)
+    if empty_keys.any():
+        raise ValueError(f"{int(empty_keys.sum())} row(s) of the data for {table} have an empty value in the key "
+                         f"{key_columns}")
+
+    connection = connect_database(database)
+
+    table_exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                      (table,)).fetchone()
+    if not table_exists:
+        df.to_sql(table, connection, index=False)
+        connection.close()
+        bump_table_version(table)
+        return len(df)
+
+    table_columns = [row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')]
+    unknown_columns = [column for column in df.columns if column not in table_columns]
+    if unknown_columns:
+        print(f"Columns that aren't in the table {table} are left out: {', '.join(map(str, unknown_columns))}")
+        df = df[[column for column in df.columns if column in table_columns]]
+
+    columns = list(df.columns)
+    value_columns = [column for column in columns if column not in key_columns]
+    column_names = ', '.join(f'"{column}"' for column in columns)
+    key_names = ', '.join(f'"{column}"' for column in key_columns)
+
+    if value_columns:
+        assignments = ', '.join(f'"{column}" = excluded."{column}"' for column in value_columns)
+        current_values = ', '.join(f'"{table}"."{column}"' for column in value_columns)
+        new_values = ', '.join(f'excluded."{column}"' for column in value_columns)
+        on_conflict = f"DO UPDATE SET {assignments} WHERE ({current_values}) IS NOT ({new_values})"
+    else:
+        on_conflict = "DO NOTHING"
+
+    try:
+        with connection:
+            try:
+                connection.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{table}_{"_".join(key_columns)}" '
+                                   f'ON "{table}" ({key_names})')
+            except sqlite3.IntegrityError:
+                raise ValueError(f"The table {table} contains duplicate values for the key {key_columns}")
+
+            connection.execute('DROP TABLE IF EXISTS temp.upsert_staging')
+            connection.execute(f'CREATE TEMP TABLE upsert_staging AS SELECT {column_names} FROM "{table}" WHERE 0')
+
+            insert_staging = f"INSERT INTO temp.upsert_staging ({column_names}) VALUES ({', '.join('?' * len(columns))})"
+            for start in range(0, len(df), batch_size):
+                connection.executemany(insert_staging, _dataframe_rows(df.iloc[start:start + batch_size]))
+
+            changes_before = connection.total_changes
+
+            # WHERE true is needed to parse the ON CONFLICT clause after a SELECT
+            connection.execute(f'INSERT INTO "{table}" ({column_names}) '
+                               f'SELECT {column_names} FROM temp.upsert_staging WHERE true '
+                               f'ON CONFLICT ({key_names}) {on_conflict}')
+
+            if delete_missing:
+                connection.execute(f'CREATE INDEX temp.upsert_staging_keys ON upsert_staging ({key_names})')
+                key_match = ' AND '.join(f's."{column}" = "{table}"."{column}"' for column in key_columns)
+                connection.execute(f'DELETE FROM "{table}" '
+                                   f'WHERE NOT EXISTS (SELECT 1 FROM temp.upsert_staging s WHERE {key_match})')
+
+            changed_rows = connection.total_changes - changes_before
+            connection.execute('DROP TABLE temp.upsert_staging')
+    finally:
+        connection.close()
+
+    if changed_rows:
+        bump_table_version(table)
+
+    return changed_rows
 
 
 def empty_database_table(table):
@@ -77,7 +501,7 @@ def empty_database_table(table):
     :return: None
     """
 
-    connection = sqlite3.connect("data/demo.db")
+    connection = connect_database()
 
     query = f"DELETE FROM {table}"
 
@@ -86,6 +510,7 @@ def empty_database_table(table):
     connection.commit()
 
     connection.close()
+    bump_table_version(table)
 
 
 def input_data_to_db(query):
@@ -94,7 +519,7 @@ def input_data_to_db(query):
     :return: None
     """
 
-    connection = sqlite3.connect("data/demo.db")
+    connection = connect_database()
 
     connection.execute(query)
     # Commit the transaction
@@ -102,108 +527,164 @@ def input_data_to_db(query):
 
     connection.close()
 
+    written_table = _WRITE_TABLE.match(query)
+    if written_table:
+        bump_table_version(next(name for name in written_table.groups() if name))
+    else:
+        # Unknown statement, we can't tell which table changed
+        clear_query_cache()
+
     return "Data inserted successfully"
 
 
-def fill_daily_costs_table():
-    """
-    Daily costs can be standardized, This would mean:
-    Per barge_id the daily (MONDAY, TUESDAY, WEDNESDAY, THURSDAY, FRIDAY, SATURDAY, SUNDAY) operating_cost are 1500
-    Per barge_id the daily (MONDAY, TUESDAY, WEDNESDAY, THURSDAY, FRIDAY, SATURDAY, SUNDAY) terminal_call_cost are 35
+WEEKDAYS = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
 
-    :return: None
+
+def bulk_insert_to_db(table, columns, rows, database="data/demo.db", replace=False):
+    """
+    Insert many rows with one executemany inside a single transaction
+
+    :param table: name of the table
+    :param columns: list of column names
+    :param rows: iterable of tuples with the values in the order of the columns
+    :param database: path of the database
+    :param replace: delete the rows of the table in the same transaction, readers never see an empty table
+    :return: number of inserted rows
     """
-    weekdays = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
-    cost_types = ['operating_cost', 'terminal_call_cost']
-
-    connection = sqlite3.connect("data/demo.db")
-    cursor = connection.cursor()
-    # retrieve the barge_id from the barge table
-    query = """ SELECT b.barge_id, d.barge_id FROM barges b
-                LEFT JOIN daily_costs d ON b.barge_id = d.barge_id """
-    cursor.execute(query)
-    matches = cursor.fetchall()
-
-    # get the unique barge_ids that are not in the daily_costs table
-    unique_ids_with_none = set(id for id, match in matches if match is None)
-
-    # insert the daily costs for the unique barge_ids
-    for barge_id in unique_ids_with_none:
-        for cost_type in cost_types:
-            if cost_type == 'terminal_call_cost':
-                cost = 35
-            else:
-                cost = 1500
-            for weekday in weekdays:
-                print(f"Inserting {cost_type} for barge_id {barge_id} on {weekday} with cost {cost}")
-                query = f""" INSERT INTO daily_costs (daily_cost_type, barge_id, week_day, day_cost) 
-                             VALUES ('{cost_type}', {barge_id}, '{weekday}', {cost}) """
-                cursor.execute(query)
-                connection.commit()
 
-    connection.close()
-    # if there are no matches, insert the daily costs
-    return "successfully filled the daily_costs table"
+    column_names = ', '.join(f'"{column}"' for column in columns)
+    placeholders = ', '.join('?' * len(columns))
+    query = f'INSERT INTO "{table}" ({column_names}) VALUES ({placeholders})'
+
+    connection = connect_database(database)
+    try:
+        with connection:
+            if replace:
+                connection.execute(f'DELETE FROM "{table}"')
+            inserted = connection.executemany(query, rows).rowcount
+    finally:
+        connection.close()
 
+    bump_table_version(table)
+
+    return inserted
+
+
+def _values_table(name, columns, rows):
+    """
+    Create a parameterised VALUES common table expression, e.g. week_days(day_no, week_day) AS (VALUES (?, ?), (?, ?))
 
-def fill_operating_times_table():
+    :return: tuple of the sql string and the flat list of parameters
     """
 
+    placeholders = ', '.join(['(' + ', '.join('?' * len(columns)) + ')'] * len(rows))
+    params = [value for row in rows for value in row]
+
+    return f"{name}({', '.join(columns)}) AS (VALUES {placeholders})", params
+
+
+def fill_daily_costs_table(daily_costs=None, database="data/demo.db"):
     """
-    weekdays = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
-    operating_times = ['00:00:00', '23:59:59']
+    Daily costs can be standardized, This would mean:
+    Per barge_id the daily (MONDAY, TUESDAY, WEDNESDAY, THURSDAY, FRIDAY, SATURDAY, SUNDAY) operating_cost are 1500
+    Per barge_id the daily (MONDAY, TUESDAY, WEDNESDAY, THURSDAY, FRIDAY, SATURDAY, SUNDAY) terminal_call_cost are 35
 
-    connection = sqlite3.connect("data/demo.db")
-    cursor = connection.cursor()
+    The rows are created with one INSERT ... SELECT over the barges x cost types x weekdays cross join, only the
+    combinations that are missing are inserted. Running it twice doesn't change the table.
 
-    # retrieve the barge_id from the barge table
-    query = """ SELECT b.barge_id, o.barge_id FROM barges b
-                LEFT JOIN operating_times o ON b.barge_id = o.barge_id """
+    :param daily_costs: dictionary {cost_type: cost}, defaults to the standard costs above
+    :return: None
+    """
 
-    cursor.execute(query)
-    barge_matches = cursor.fetchall()
+    if daily_costs is None:
+        daily_costs = {'operating_cost': 1500, 'terminal_call_cost': 35}
+
+    week_days, week_day_params = _values_table('week_days', ['day_no', 'week_day'], list(enumerate(WEEKDAYS)))
+    cost_types, cost_type_params = _values_table('cost_types', ['daily_cost_type', 'day_cost'],
+                                                 list(daily_costs.items()))
+
+    query = f"""WITH {week_days}, {cost_types}
+                INSERT INTO daily_costs (daily_cost_id, daily_cost_type, barge_id, week_day, day_cost)
+                SELECT (SELECT COALESCE(MAX(daily_cost_id), 0) FROM daily_costs)
+                           + ROW_NUMBER() OVER (ORDER BY b.barge_id, c.daily_cost_type, w.day_no),
+                       c.daily_cost_type, b.barge_id, w.week_day, c.day_cost
+                FROM barges b
+                    CROSS JOIN cost_types c
+                    CROSS JOIN week_days w
+                WHERE NOT EXISTS (SELECT 1 FROM daily_costs d
+                                  WHERE d.barge_id = b.barge_id
+                                    AND d.daily_cost_type = c.daily_cost_type
+                                    AND d.week_day = w.week_day) """
+
+    connection = connect_database(database)
+    try:
+        with connection:
+            connection.execute(query, week_day_params + cost_type_params)
+        inserted = connection.total_changes
+    finally:
+        connection.close()
 
-    # get the unique barge_ids that are not in the operating_times table
-    barge_unique_ids_with_none = set(id for id, match in barge_matches if match is None)
+    bump_table_version('daily_costs')
+    print(f"Inserted {inserted} daily costs")
 
-    # insert the operating times for the unique barge_ids
-    for barge_id in barge_unique_ids_with_none:
-        for weekday in weekdays:
-            print(f"Inserting operating times for barge_id {barge_id} on {weekday} with times {operating_times}")
-            query = f""" INSERT INTO operating_times (barge_id, week_day, start_time, end_time) 
-                         VALUES ({barge_id}, '{weekday}', '{operating_times[0]}', '{operating_times[1]}') """
-            # cursor.execute(query)
-            # connection.commit()
+    return "successfully filled the daily_costs table"
 
-    # retrieve the barge_id from the barge table
-    query = """ SELECT o.terminal_id, t.id FROM terminals t
-                LEFT JOIN operating_times o ON t.id = o.barge_id """
 
-    cursor.execute(query)
-    terminal_matches = cursor.fetchall()
+def fill_operating_times_table(operating_times=('00:00:00', '23:59:59'), include_barges=False,
+                               database="data/demo.db"):
+    """
+    Fill the operating times of the terminals (and optionally the barges) that don't have operating times for a
+    weekday yet. All rows are created with one INSERT ... SELECT per entity type inside a single transaction, so
+    running it twice doesn't change the table.
 
-    # get the unique barge_ids that are not in the operating_times table
-    terminal_unique_ids_with_none = set(id for id, match in terminal_matches if match is None)
+    :param operating_times: tuple with the start and end time of every weekday
+    :param include_barges: barges get their active times from the operator, only fill them when asked for
+    :return: None
+    """
 
-    for terminal_id in terminal_unique_ids_with_none:
-        for weekday in weekdays:
-            print(f"Inserting operating times for terminal_id {terminal_id} on {weekday} with times {operating_times}")
-            query = f""" INSERT INTO operating_times 
-                        (terminal_id, week_day, start_time, end_time, flex_start_time, flex_end_time) 
-                         VALUES ({terminal_id}, '{weekday}', 
-                         '{operating_times[0]}', '{operating_times[1]}', 
-                         '{operating_times[0]}', '{operating_times[1]}') """
-            cursor.execute(query)
-            connection.commit()
+    week_days, week_day_params = _values_table('week_days', ['day_no', 'week_day'], list(enumerate(WEEKDAYS)))
+    start_time, end_time = operating_times
+
+    barge_query = f"""WITH {week_days}
+                      INSERT INTO operating_times ("index", barge_id, week_day, start_time, end_time)
+                      SELECT (SELECT COALESCE(MAX("index"), 0) FROM operating_times)
+                                 + ROW_NUMBER() OVER (ORDER BY b.barge_id, w.day_no),
+                             b.barge_id, w.week_day, ?, ?
+                      FROM barges b
+                          CROSS JOIN week_days w
+                      WHERE NOT EXISTS (SELECT 1 FROM operating_times o
+                                        WHERE o.barge_id = b.barge_id AND o.week_day = w.week_day) """
+
+    terminal_query = f"""WITH {week_days}
+                         INSERT INTO operating_times
+                             ("index", terminal_id, week_day, start_time, end_time, flex_start_time, flex_end_time)
+                         SELECT (SELECT COALESCE(MAX("index"), 0) FROM operating_times)
+                                    + ROW_NUMBER() OVER (ORDER BY t.id, w.day_no),
+                                t.id, w.week_day, ?, ?, ?, ?
+                         FROM terminals t
+                             CROSS JOIN week_days w
+                         WHERE NOT EXISTS (SELECT 1 FROM operating_times o
+                                           WHERE o.terminal_id = t.id AND o.week_day = w.week_day) """
+
+    connection = connect_database(database)
+    try:
+        with connection:
+            if include_barges:
+                connection.execute(barge_query, week_day_params + [start_time, end_time])
+            connection.execute(terminal_query, week_day_params + [start_time, end_time, start_time, end_time])
+        inserted = connection.total_changes
+    finally:
+        connection.close()
 
-    connection.close()
+    bump_table_version('operating_times')
+    print(f"Inserted {inserted} operating times")
 
     return "successfully filled the operating_times table"
 
 
 def vacuum_database():
     try:
-        connection = sqlite3.connect("data/demo.db")
+        connection = connect_database()
         cursor = connection.cursor()
         cursor.execute("VACUUM")
         connection.commit()
@@ -223,16 +704,13 @@ def retrieve_container_type(type):
     :return:
     """
 
-    # Connection to database
-    connection = sqlite3.Connection("data/demo.db")
     # query to get container on isoType
-    sql_query = f"SELECT * " \
-                f"FROM container_types " \
-                f"WHERE iso_type_code = '{type}' OR iso_type_code_1984 = '{type}' OR display_code = '{type}' "
+    sql_query = "SELECT * " \
+                "FROM container_types " \
+                "WHERE iso_type_code = ? OR iso_type_code_1984 = ? OR display_code = ? "
 
     # retrieve_container_type
-    container_type = pd.read_sql_query(sql_query, connection)
-    connection.close()
+    container_type = load_query_from_db(sql_query, params=(type, type, type))
 
     # return container_type
     return container_type
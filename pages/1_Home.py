@@ -1,5 +1,6 @@
 import streamlit as st
 from dotenv import load_dotenv
+import data.data_access
 import data.service_database
 import data.generate_dataset as gen
 
@@ -2,36 +2,20 @@ import datetime
 
 import streamlit as st
 from dotenv import load_dotenv
-import data.service_database
-import requests
+import data.data_access
 import pandas as pd
-import json
+import plotly.express as px
+import uuid
 from services.backend.visualisation_creation import VisualizationPlanning, VisualizationContainerOrders
-from services.backend.extract_planning import ExtractPmaPlanning
-from services.backend.transform_orders import TransformToPMA
+import services.backend.planning_diff as planning_diff
+import services.backend.planning_jobs as planning_jobs
+from services.backend.extract_planning import stream_planning_json
+import services.backend.planning_sweep as planning_sweep
 import services.backend.utils as utils
 import data.generate_dataset as gen
 
 load_dotenv()
 
-pma_user_name = st.secrets["PMA_USER_NAME"]
-pma_password = st.secrets["PMA_PASSWORD"]
-basic_auth = (pma_user_name, pma_password)
-
-
-def push_pma_request(payload):
-    """This function will push the request to the PMA API"""
-
-    url = "https://pma-acc.cofanoapps.com/api/planning"
-    response = requests.post(url=url, json=payload, auth=basic_auth)
-
-    if response.status_code != 200:
-        return response.status_code
-    else:
-        respons_id = response.json()
-        return respons_id
-
-
 st.header('Planning')
 st.markdown("""
        This is where the :rainbow[magic] happens.
@@ -74,9 +58,19 @@ with (st.sidebar):
     pma_restrictions = {"penalize_distance": penalize_distance, "penalize_unplanned": penalize_unplanned,
                         "number_of_iterations": number_of_iterations}
 
+    st.divider()
+
+    reuse_plannings = st.checkbox("Reuse earlier plannings", value=True,
+                                  help="Show the planning of an identical earlier request instead of planning again")
+
+    sweep = st.toggle("Compare penalties",
+                      help="Plan every combination of the selected penalties at once and rank the results")
+    if sweep:
+        sweep_penalize_unplanned = st.multiselect("Penalties per unplanned container", [0, 1, 2], [0, 1, 2])
+
 
 # Barges
-df_barges = data.service_database.load_datatable_from_db('barges')
+df_barges = data.data_access.load_table('barges')
 df_barges_copy = df_barges.copy()
 df_barges_copy.drop(columns=['country_name', 'gross_tonnage', 'deadweight', 'year_built', 'barge_id', 'operator_id'],
                     inplace=True)
@@ -86,10 +80,10 @@ df_barges_copy.drop(
     inplace=True)
 
 # Terminals
-df_terminals = data.service_database.load_datatable_from_db('terminals')
+df_terminals = data.data_access.load_table('terminals')
 df_terminals_copy = df_terminals.copy()
 df_terminals_copy.drop(
-    columns=['id', 'unlocode', 'terminal_code', 'port_id', 'latitude', 'longitude', 'operating_times_index'],
+    columns=['id', 'unlocode', 'terminal_code', 'code', 'port_id', 'latitude', 'longitude', 'operating_times_index'],
     inplace=True)
 df_terminals_copy.drop(
     columns=['place', 'call_cost', 'flex_moves', 'call_size_fine'],
@@ -100,10 +94,9 @@ df_terminals_copy.rename(columns={'base_stop_time': 'waiting_time'}, inplace=Tru
 st.info("In the tabs below, you can select **terminals and barges, and configure their features.")
 config_tab_1, config_tab_2 = st.tabs(["Terminal config", "Barge config"])
 
-terminals_df = data.service_database.load_datatable_from_terminal_db()
-terminals_df_filtered, selected_terminals, sea_terminals = utils.get_demo_terminals(terminals_df)
+terminals_df_filtered, selected_terminals, sea_terminals = data.data_access.load_demo_terminals()
 
-terminals = data.service_database.load_datatable_from_db('terminals')
+terminals = data.data_access.load_table('terminals')
 with config_tab_1:
     col1, col2 = st.columns(2)
     with col1:
@@ -157,7 +150,7 @@ with config_tab_2:
 total_teu = st.number_input(
         "How many TEU worth of containers would you like to generate?",
         min_value=0,
-        max_value=20000,
+        max_value=2000000,
         value=10000,
     )
 generate = st.button("Generate new container dataset")
@@ -165,9 +158,10 @@ if generate:
     terminals_sea = df_terminals_edited[df_terminals_edited['name'].isin(sea_terminals)]['name'].tolist()
     terminals_inland = df_terminals_edited[~df_terminals_edited['name'].isin(sea_terminals)]['name'].tolist()
     gen.generate_container_data([0.475, 0.475, 0.05], total_teu, terminals_sea, terminals_inland)
+    data.data_access.invalidate_tables('container_orders')
     st.info("You can view the container dataset on the \"Orders\" page")
 
-df_orders = data.service_database.load_datatable_from_db('container_orders')
+df_orders = data.data_access.load_table('container_orders')
 
 email_address = st.text_input("Enter email_address", value="")
 run_algorithm = st.button("Run algorithm")
@@ -176,7 +170,7 @@ if run_algorithm:
 
     # This list provides information on when planners plan (planning_date) and for which period.
     # For example, if the period is 24 hours, they plan for tomorrow and the following days.
-    pln_trnsfrm = TransformToPMA(
+    transform_arguments = dict(
         mailhook_emailaddress=email_address,
         webhook_url="",
         webhook_token="",
@@ -190,26 +184,86 @@ if run_algorithm:
         barge_speeds=barges_speeds,
         barge_minimum_call_sizes=barges_minimum_call_sizes,
         terminal_operating_times=terminal_restrictions,
-        restrictions=pma_restrictions,
-
     )
 
-    pln_trnsfrm.execute_create_json()
+    if sweep:
+        # The distance penalty has no field in the payload, the scenarios only differ in the unplanned penalty
+        scenarios = planning_sweep.sweep_scenarios([penalize_distance], sweep_penalize_unplanned,
+                                                   [number_of_iterations])
+        if scenarios:
+            st.session_state['planning_job_id'] = planning_jobs.submit_sweep_job(transform_arguments, scenarios,
+                                                                                 use_cache=reuse_plannings)
+            st.session_state['planning_job_running'] = True
+        else:
+            st.error("Please select at least one penalty per unplanned container to compare")
+    else:
+        # Replanning in the same session reports the changes since the previous request
+        session_id = st.session_state.setdefault('planning_session_id', uuid.uuid4().hex)
+        st.session_state['planning_job_id'] = planning_jobs.submit_planning_job(
+            dict(transform_arguments, restrictions=pma_restrictions), use_cache=reuse_plannings,
+            session_id=session_id)
+        st.session_state['planning_job_running'] = True
+
+
+def show_analysis(job_id):
+    # Only called when the user analyses a planning or a planning job completes. The planning that was shown before
+    # is kept to compare the new planning with, unless its analysis never completed.
+    shown_job_id = st.session_state.get('analysis_job_id')
+    shown_job = planning_jobs.get_job(shown_job_id) if shown_job_id is not None else None
+    if shown_job_id != job_id and shown_job is not None and shown_job['status'] == 'completed':
+        st.session_state['previous_analysis_job_id'] = shown_job_id
+    st.session_state['analysis_job_id'] = job_id
+
+
+def job_active(session_key):
+    job_id = st.session_state.get(session_key)
+    if job_id is None:
+        return False
+    job = planning_jobs.get_job(job_id)
+    return job is not None and job['status'] in ('queued', 'running')
+
+
+# The fragment only polls while the job runs, it reruns the page once the job has finished
+@st.fragment(run_every=2 if job_active('planning_job_id') else None)
+def planning_job_status():
+    job_id = st.session_state.get('planning_job_id')
+    if job_id is None:
+        return
+    job = planning_jobs.get_job(job_id)
+    if job is None:
+        return
+
+    if job['status'] in ('queued', 'running'):
+        st.progress(job['progress'], text=job['stage'])
+        st.session_state['planning_job_running'] = True
+    elif job['status'] == 'failed':
+        st.error(job['error'])
+    elif job['job_type'] == 'sweep':
+        st.success("**The scenarios are planned**. They are ranked on fleet utilisation, unplanned containers and "
+                   "distance, rank 1 are the scenarios no other scenario beats on all three.")
+        ranking = planning_jobs.get_job_result(job_id)
+        st.plotly_chart(px.scatter(ranking, x='unplanned_containers', y='fleet_utilisation',
+                                   color=ranking['pareto_rank'].astype(str),
+                                   hover_data=['distance_km', 'penalize_distance', 'penalize_unplanned', 'pma_key'],
+                                   labels={'color': 'Pareto rank'}),
+                        use_container_width=True)
+        st.dataframe(ranking, hide_index=True)
+    elif job['stage'] == planning_jobs.REUSED_STAGE:
+        # The request wasn't shared again, so the PMA API doesn't send an email
+        st.success(f"**The planning of an identical request is reused**. \n\nThe unique code of the planning: "
+                   f"{job['pma_key']}\n\nThe planning is shown below, no email is sent for a reused planning.")
+    else:
+        st.success(f"**The planning is shared successfully**. \n\nThe unique code of the planning: {job['pma_key']}"
+                   f"\n\nThe planning is shown below, it is also sent to the email address.")
 
-    with open('data/payload_output.json', 'w') as f:
-        f.write(pln_trnsfrm.json)
-    json_payload = json.loads(pln_trnsfrm.json)
-    pma_planning = push_pma_request(json_payload)
+    # The planning is shown once, when the job finishes. Later reruns keep the planning the user analysed since.
+    if job['status'] not in ('queued', 'running') and st.session_state.pop('planning_job_running', False):
+        if job['status'] == 'completed' and job['job_type'] == 'planning':
+            show_analysis(job_id)
+        st.rerun()
 
-    if type(pma_planning) == int:
-        st.info("The algorithm service needs to start up. Please try again after 5 minutes")
-    else:
-        st.success(f"**The planning is shared successfully**. \n\nThe unique code of the planning: {pma_planning}"
-                   f"\n\nIf the planning isn't sent to the email address after 15 minutes please contact us.")
-        planned_container_file_name = pma_planning + "_planned_containers"
-        # csv_download_link(user_planning_settings.order_list,
-        #                   planned_container_file_name,
-        #                   "Download the containers you're planning as CSV")
+
+planning_job_status()
 
 st.divider()
 st.header("Upload the planning")
@@ -217,38 +271,55 @@ data_retrieval_method = st.selectbox("Select the data source for the planning",
                                                                                  "Upload Json file",
                                                                                  "Retrieve planning from microservice"])
 
+input_file = None
+input_key = None
 if data_retrieval_method == "Upload Json file":
-    json_file = st.file_uploader("Upload json file", type=["json"])
-    if json_file:
-        input_data = json.load(json_file)
-        input_key = None
+    input_file = st.file_uploader("Upload json file", type=["json"])
+elif data_retrieval_method == "Retrieve planning from microservice":
+    input_key = st.text_input("Enter the unique code of the planning", value="") or None
 
 st.divider()
 st.header("Analyse the planning")
 plan = st.button("Analyse")
-pma_planning = None
-if not plan:
-    st.info("Please upload the planning to analyse the data")
 
 if plan:
-    pma_planning = ExtractPmaPlanning(key=input_key, json=input_data)
-    pma_planning.extract_calls()
-    # pma_planning.add_voyage_numbers()
-    pma_planning.extract_containers()
+    if input_file is None and input_key is None:
+        st.error("Please upload the planning or enter its code first")
+    else:
+        # Large plannings are parsed incrementally, only the parts the analysis uses are kept
+        input_data = stream_planning_json(input_file) if input_file is not None else None
+        show_analysis(planning_jobs.submit_analysis_job(planning_json=input_data, pma_key=input_key))
 
-    calls = pd.DataFrame.from_dict(pma_planning.calls)
 
-    # calls = drop_columns(calls)
+@st.fragment(run_every=2 if job_active('analysis_job_id') else None)
+def analysis_job_status():
+    job_id = st.session_state.get('analysis_job_id')
+    job = planning_jobs.get_job(job_id) if job_id is not None else None
 
-    if calls is None:
-        st.error("The columns 'voyage_number_import' and 'voyage_number_export' are not in the dataframe")
-        st.stop()
+    if job is None:
+        st.info("Please upload the planning to analyse the data")
+    elif job['status'] in ('queued', 'running'):
+        st.progress(job['progress'], text=job['stage'])
+        st.session_state['analysis_job_running'] = True
+    elif job['status'] == 'failed':
+        st.error(job['error'])
 
-    transit = pd.DataFrame.from_dict(pma_planning.transport_events)
+    if job is not None and job['status'] not in ('queued', 'running') and \
+            st.session_state.pop('analysis_job_running', False):
+        st.rerun()
 
-    calls['teu_loaded'] = calls['load_20'] + 2 * calls['load_40'] + 2.25 * calls['load_45']
-    calls['teu_discharged'] = calls['discharge_20'] + 2 * calls['discharge_40'] + 2.25 * calls['discharge_45']
-    viz_plan = VisualizationPlanning(calls, transit, pma_planning.occupancy_timeline)
+
+analysis_job_status()
+
+analysis_job_id = st.session_state.get('analysis_job_id')
+analysis = planning_jobs.get_job_result(analysis_job_id) if analysis_job_id is not None else None
+
+if analysis is not None:
+    pma_planning = analysis['planning']
+    calls = analysis['calls']
+    transit = analysis['transit']
+
+    viz_plan = VisualizationPlanning(calls.copy(), transit, pma_planning.occupancy_timeline)
     viz_plan.add_barge_names()
 
     utilisation_col, planned_col = st.columns(2)
@@ -269,7 +340,10 @@ if plan:
         st.title(f"{percentage_planned_containers * 100}%")
         st.subheader("", divider='violet')
 
-    tab_1, tab_2 = st.tabs(["Calls", "Containers"])
+    previous_job_id = st.session_state.get('previous_analysis_job_id')
+    previous_analysis = planning_jobs.get_job_result(previous_job_id) if previous_job_id is not None else None
+
+    tab_1, tab_2, tab_3 = st.tabs(["Calls", "Containers", "Changes"])
 
     with tab_1:
         st.plotly_chart(viz_plan.calls_gantt_chart(),
@@ -287,3 +361,23 @@ if plan:
         st.plotly_chart(viz_plan.stack_teu_occupancy(),
                         use_container_width=True)
         st.dataframe(pma_planning.containers)
+
+    with tab_3:
+        if previous_analysis is None:
+            st.info("Analyse another planning to compare it with this one")
+        else:
+            planning_changes = planning_diff.diff_plannings(previous_analysis['planning'], pma_planning)
+            st.caption("Compared with the planning that was analysed before")
+            st.dataframe(planning_changes['kpis'], hide_index=True)
+
+            containers_col, calls_col = st.columns(2)
+            with containers_col:
+                st.dataframe(planning_changes['containers']['change'].value_counts().rename('containers'))
+            with calls_col:
+                st.dataframe(planning_changes['calls']['change'].value_counts().rename('calls'))
+
+            st.subheader("Changed call sequences")
+            st.dataframe(planning_changes['sequences'][planning_changes['sequences']['changed']], hide_index=True)
+            st.subheader("Changed containers")
+            st.dataframe(planning_changes['containers'][planning_changes['containers']['change'] != 'unchanged'],
+                         hide_index=True)
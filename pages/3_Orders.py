@@ -1,6 +1,6 @@
 import streamlit as st
 from dotenv import load_dotenv
-import data.service_database
+import data.data_access
 
 load_dotenv()
 
@@ -9,5 +9,5 @@ st.markdown("""
        This page provides an overview of the containers in this demo environment.
        """)
 
-df_orders = data.service_database.load_datatable_from_db('container_orders')
+df_orders = data.data_access.load_table('container_orders')
 st.dataframe(df_orders)
\ No newline at end of file
@@ -1,6 +1,6 @@
 import streamlit as st
 from dotenv import load_dotenv
-import data.service_database
+import data.data_access
 
 load_dotenv()
 
@@ -9,7 +9,7 @@ st.markdown("""
        This page provides an overview of the barges in this demo environment.
        """)
 
-df_barges = data.service_database.load_datatable_from_db('barges')
+df_barges = data.data_access.load_table('barges')
 df_barges.drop(columns=['country_name', 'gross_tonnage', 'deadweight', 'year_built', 'barge_id', 'operator_id'], inplace=True)
 df_barges.rename(columns={'breadth': 'width'}, inplace=True)
 st.dataframe(df_barges)
\ No newline at end of file
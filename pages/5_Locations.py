@@ -1,6 +1,6 @@
 import streamlit as st
 from dotenv import load_dotenv
-import data.service_database
+import data.data_access
 
 load_dotenv()
 
@@ -9,6 +9,7 @@ st.markdown("""
        This page provides an overview of the locations in this demo environment.
        """)
 
-df_terminals = data.service_database.load_datatable_from_db('terminals')
-df_terminals.drop(columns=['id', 'unlocode', 'terminal_code', 'port_id', 'latitude', 'longitude', 'operating_times_index'], inplace=True)
+df_terminals = data.data_access.load_table('terminals')
+df_terminals.drop(columns=['id', 'unlocode', 'terminal_code', 'code', 'port_id', 'latitude', 'longitude',
+                           'operating_times_index'], inplace=True)
 st.dataframe(df_terminals)
\ No newline at end of file
@@ -9,10 +9,12 @@ pma_user_name = st.secrets["PMA_USER_NAME"]
 pma_password = st.secrets["PMA_PASSWORD"]
 basic_auth = (pma_user_name, pma_password)
 
+PMA_URL = "https://pma-acc.cofanoapps.com"
+
 def push_pma_request(payload):
     """This function will push the request to the PMA API"""
 
-    url = "https://pma-acc.cofanoapps.com/api/planning"
+    url = f"{PMA_URL}/api/planning"
     response = requests.post(url=url, json=payload, auth=basic_auth)
 
     if response.status_code != 200:
@@ -24,7 +26,7 @@ def push_pma_request(payload):
 def get_pma_result(result_id, result_type="output"):
     """This function will push the request to the PMA API"""
 
-    url = f"https://pma-acc.cofanoapps.com/api/log/{result_id}/{result_type}"
+    url = f"{PMA_URL}/api/log/{result_id}/{result_type}"
     response = requests.get(url=url, auth=basic_auth)
 
     if response.status_code == 500:
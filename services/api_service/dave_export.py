@@ -0,0 +1,274 @@
+"""
+Batched export of containers and voyages to Dave, resumable from the last acknowledged batch.
+
+This is a library module, none of the pages export to Dave yet. It is an alternative to push_cargo and push_voyages
+of api_dave, which post a whole payload in one request.
+"""
+import datetime as dt
+import gzip
+import hashlib
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from data.service_database import connect_database
+import services.api_service.api_dave as api_dave
+
+
+EXPORT_DATABASE = "data/demo.db"
+
+CARGO_ENDPOINT = 'api/danser/orders'
+VOYAGE_ENDPOINT = 'api/danser/voyages'
+
+# Fields of a record that change every export, they are left out of the hash of a batch
+VOLATILE_FIELDS = ('ts',)
+
+_table_lock = threading.Lock()
+_tables_ready = set()
+
+
+def _connect():
+    connection = connect_database(EXPORT_DATABASE, check_same_thread=False)
+
+    with _table_lock:
+        if EXPORT_DATABASE not in _tables_ready:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS dave_export_batches ("
+                                   "export_id TEXT, endpoint TEXT, batch INTEGER, batch_hash TEXT, records INTEGER, "
+                                   "status_code INTEGER, acknowledged_on TEXT, PRIMARY KEY (export_id, endpoint, batch))")
+                connection.execute("CREATE TABLE IF NOT EXISTS dave_exports (export_id TEXT PRIMARY KEY, seed INTEGER, "
+                                   "time_shift INTEGER, created_on TEXT)")
+            _tables_ready.add(EXPORT_DATABASE)
+
+    return connection
+
+
+def batch_hash(records):
+    """
+    :param records: list of dictionaries
+    :return: sha256 hex digest of the records without the volatile fields
+    """
+
+    canonical = [{key: value for key, value in record.items() if key not in VOLATILE_FIELDS} for record in records]
+    data = json.dumps(canonical, sort_keys=True, separators=(',', ':'), default=str)
+
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def acknowledged_batches(export_id, endpoint):
+    """
+    :return: dictionary {batch: batch_hash} of the batches of an export that Dave acknowledged
+    """
+
+    connection = _connect()
+    rows = connection.execute("SELECT batch, batch_hash FROM dave_export_batches WHERE export_id = ? AND endpoint = ?",
+                              (export_id, endpoint)).fetchall()
+    connection.close()
+
+    return dict(rows)
+
+
+def _acknowledge(export_id, endpoint, batch, hash_, records, status_code):
+    connection = _connect()
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO dave_export_batches (export_id, endpoint, batch, batch_hash, records, "
+                           "status_code, acknowledged_on) VALUES (?, ?, ?, ?, ?, ?, datetime('now'))",
+                           (export_id, endpoint, batch, hash_, records, status_code))
+    connection.close()
+
+
+def export_parameters(export_id):
+    """
+    :return: tuple with the seed and the time shift in seconds of an export, None when the export wasn't started
+    """
+
+    connection = _connect()
+    row = connection.execute("SELECT seed, time_shift FROM dave_exports WHERE export_id = ?", (export_id,)).fetchone()
+    connection.close()
+
+    return row
+
+
+def _store_export_parameters(export_id, seed, time_shift):
+    connection = _connect()
+    with connection:
+        connection.execute("INSERT OR IGNORE INTO dave_exports (export_id, seed, time_shift, created_on) "
+                           "VALUES (?, ?, ?, datetime('now'))", (export_id, seed, time_shift))
+    connection.close()
+
+
+def batched(records, batch_size):
+    """
+    Split an iterable in lists of batch_size records, the records are only taken from the iterable when the batch is
+    requested
+
+    :return: generator of lists
+    """
+
+    iterator = iter(records)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class DaveExporter:
+    """
+    Post records to Dave in batches of batch_size records with a gzip compressed body. At most max_in_flight batches
+    are posted at the same time, and the records are only generated when a batch is sent, so the export doesn't have
+    to hold all records in memory. A batch that fails is retried with an increasing delay.
+
+    Acknowledged batches are stored in the dave_export_batches table. When an export fails it can be started again
+    with the same export_id: the batches that Dave acknowledged with the same records are skipped.
+
+    :param base_url: url of Dave
+    :param auth: tuple with the user and password
+    :param batch_size: number of records per request
+    :param max_in_flight: maximum number of requests at the same time
+    :param retries: attempts per batch after the first one
+    :param retry_delay: seconds before the first retry, doubles after every retry
+    """
+
+    def __init__(self, base_url=None, auth=None, batch_size=500, max_in_flight=4, retries=3, retry_delay=1,
+                 request_timeout=60, compression_level=6):
+        self.base_url = base_url or api_dave.basic_url
+        self.auth = auth or api_dave.authentication
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.request_timeout = request_timeout
+        self.compression_level = compression_level
+
+    def _post(self, endpoint, body):
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        return requests.post(self.base_url + endpoint, auth=self.auth, data=body, headers=headers,
+                             timeout=self.request_timeout)
+
+    def send_batch(self, export_id, endpoint, batch, records, hash_=None):
+        """
+        Post a batch and store it as acknowledged when Dave answers with a 2xx status
+
+        :return: dictionary with batch, records, size and compressed_size of the body and the number of attempts
+        """
+
+        data = json.dumps(records, separators=(',', ':'), default=str).encode()
+        body = gzip.compress(data, self.compression_level)
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._post(endpoint, body)
+                if 200 <= response.status_code < 300:
+                    _acknowledge(export_id, endpoint, batch, hash_ or batch_hash(records), len(records),
+                                 response.status_code)
+                    return {'batch': batch, 'records': len(records), 'size': len(data),
+                            'compressed_size': len(body), 'attempts': attempt + 1}
+                error = f"Dave answered batch {batch} of {endpoint} with status {response.status_code}: " \
+                        f"{response.text[:200]}"
+                # Requests that are refused (other than for the rate limit) won't succeed when they are retried
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    break
+            except requests.RequestException as e:
+                error = f"Batch {batch} of {endpoint} failed: {e}"
+
+            if attempt < self.retries:
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+        raise RuntimeError(error)
+
+    def export(self, export_id, endpoint, records, progress=None):
+        """
+        Post records in batches, the batches that were acknowledged in an earlier run of the export are skipped.
+        After a failed batch no new batches are started.
+
+        :param export_id: id of the export, the same id resumes the export
+        :param endpoint: endpoint of Dave, e.g. CARGO_ENDPOINT
+        :param records: iterable of dictionaries
+        :param progress: optional function that is called with the number of finished batches
+        :return: dictionary with the number of records, sent and skipped batches, the size and compressed size of the
+                 sent bodies and the errors of the failed batches
+        """
+
+        acknowledged = acknowledged_batches(export_id, endpoint)
+        summary = {'records': 0, 'sent': 0, 'skipped': 0, 'size': 0, 'compressed_size': 0, 'errors': []}
+
+        def finish(futures):
+            for future in futures:
+                try:
+                    result = future.result()
+                    summary['sent'] += 1
+                    summary['size'] += result['size']
+                    summary['compressed_size'] += result['compressed_size']
+                except Exception as e:
+                    summary['errors'].append(str(e))
+                if progress is not None:
+                    progress(summary['sent'] + summary['skipped'])
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='dave_export') as pool:
+            in_flight = set()
+            for batch, batch_records in enumerate(batched(records, self.batch_size)):
+                summary['records'] += len(batch_records)
+                hash_ = batch_hash(batch_records)
+                if acknowledged.get(batch) == hash_:
+                    summary['skipped'] += 1
+                    continue
+
+                if len(in_flight) >= self.max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    finish(done)
+                if summary['errors']:
+                    break
+
+                in_flight.add(pool.submit(self.send_batch, export_id, endpoint, batch, batch_records, hash_))
+
+            finish(wait(in_flight).done)
+
+        if summary['errors']:
+            print(f"Export {export_id} to {endpoint} stopped after {len(summary['errors'])} failed batch(es), "
+                  f"start it again to resume: {summary['errors'][0]}")
+
+        return summary
+
+    def export_planning(self, export_id, transform):
+        """
+        Export the containers and then the voyages of a planning. The voyages aren't exported when containers failed,
+        because the voyages refer to the ids of the containers.
+
+        The seed of the transform and the time shift of the calls are stored with the export at the first run. A run
+        with the same export_id has to use the same seed and gets the stored time shift, so it generates the same
+        records and the acknowledged batches are skipped.
+
+        :param export_id: id of the export, the same id resumes the export
+        :param transform: new TransformToDave object with a seed
+        :return: dictionary with the summary of export per endpoint, the summaries have timestamp_errors with the
+                 (field, row, value) of the timestamps that were exported as None because they have no valid format
+        """
+
+        if transform.seed is None:
+            raise ValueError(f"Export {export_id} needs a TransformToDave with a seed, otherwise it can't be resumed")
+
+        parameters = export_parameters(export_id)
+        if parameters is None:
+            time_shift = transform.call_time_shift() if transform.pmaCalls is not None else dt.timedelta(0)
+            _store_export_parameters(export_id, transform.seed, int(time_shift.total_seconds()))
+        else:
+            seed, time_shift = parameters
+            if seed != transform.seed:
+                raise ValueError(f"Export {export_id} was started with seed {seed}, not {transform.seed}")
+            transform.time_shift = dt.timedelta(seconds=time_shift)
+
+        summaries = {CARGO_ENDPOINT: self.export(export_id, CARGO_ENDPOINT, transform.dave_containers())}
+        summaries[CARGO_ENDPOINT]['timestamp_errors'] = list(transform.timestampErrors)
+        if summaries[CARGO_ENDPOINT]['errors']:
+            return summaries
+
+        voyages = transform.dave_route_voyages() if transform.pmaCalls is None else transform.dave_call_voyages()
+        summaries[VOYAGE_ENDPOINT] = self.export(export_id, VOYAGE_ENDPOINT, voyages)
+        summaries[VOYAGE_ENDPOINT]['timestamp_errors'] = \
+            transform.timestampErrors[len(summaries[CARGO_ENDPOINT]['timestamp_errors']):]
+
+        return summaries
+
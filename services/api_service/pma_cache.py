@@ -0,0 +1,125 @@
+""" Content addressed cache of PMA planning requests """
+import hashlib
+import json
+import threading
+import time
+import services.api_service.pma_poller as pma_poller
+from services.api_service.api_pma import push_pma_request
+
+
+# Fields of the payload that don't change the planning
+VOLATILE_FIELDS = ('timestamp', 'mailhook', 'webhook')
+
+CACHE_TTL = 7 * 24 * 3600
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+_cache_lock = threading.Lock()
+cache_metrics = {'hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0}
+
+
+def payload_hash(payload):
+    """
+    Hash of the canonical payload: the keys sorted and the volatile fields left out.
+
+    :param payload: dictionary or json string of the payload
+    :return: sha256 hex digest
+    """
+
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+
+    canonical = {key: value for key, value in payload.items() if key not in VOLATILE_FIELDS}
+    data = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _connect():
+    connection = pma_poller._connect()
+    connection.execute("CREATE TABLE IF NOT EXISTS pma_payload_cache ("
+                       "payload_hash TEXT PRIMARY KEY, planning_id TEXT, created_on REAL, last_used REAL)")
+
+    return connection
+
+
+def evict_pma_cache(ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+    """
+    Remove the cache entries older than ttl, and the least recently used entries until the stored results of the
+    cache take at most max_bytes. The stored results of removed entries are deleted as well, a planning job that
+    refers to one downloads it again from the PMA API (see planning_jobs.get_job_result).
+
+    :return: number of removed entries
+    """
+
+    connection = _connect()
+    with connection:
+        expired = [row[0] for row in connection.execute(
+            "SELECT planning_id FROM pma_payload_cache WHERE created_on < ?", (time.time() - ttl,))]
+
+        entries = connection.execute(
+            "SELECT c.planning_id, coalesce(r.compressed_size, 0) FROM pma_payload_cache c "
+            "LEFT JOIN pma_results r ON r.planning_id = c.planning_id "
+            "WHERE c.created_on >= ? ORDER BY c.last_used DESC", (time.time() - ttl,)).fetchall()
+        total_bytes = 0
+        for planning_id, size in entries:
+            total_bytes += size
+            if total_bytes > max_bytes:
+                expired.append(planning_id)
+
+        connection.executemany("DELETE FROM pma_payload_cache WHERE planning_id = ?", [(key,) for key in expired])
+
+        connection.executemany("DELETE FROM pma_results WHERE planning_id = ?", [(key,) for key in expired])
+    connection.close()
+
+    with _cache_lock:
+        cache_metrics['evictions'] += len(expired)
+
+    return len(expired)
+
+
+def cached_push_pma_request(payload, bypass=False, ttl=CACHE_TTL):
+    """
+    Push a planning request to the PMA API, unless an identical request (see payload_hash) was pushed before. The
+    planning of that request is returned instead, pma_poller returns its stored result without a request.
+
+    :param payload: dictionary with the payload
+    :param bypass: always push the request, the new planning replaces the cached one
+    :param ttl: seconds a cached planning is reused
+    :return: tuple with the planning id (or the status code when the request failed) and whether it was cached
+    """
+
+    key = payload_hash(payload)
+
+    if not bypass:
+        connection = _connect()
+        row = connection.execute("SELECT planning_id FROM pma_payload_cache WHERE payload_hash = ? AND created_on >= ?",
+                                 (key, time.time() - ttl)).fetchone()
+
+        # Plannings the poller gave up on are requested again
+        state = pma_poller.pma_poller.status(row[0]) if row is not None else None
+        if row is not None and (state is None or state['status'] != 'failed'):
+            with connection:
+                connection.execute("UPDATE pma_payload_cache SET last_used = ? WHERE payload_hash = ?",
+                                   (time.time(), key))
+            connection.close()
+            with _cache_lock:
+                cache_metrics['hits'] += 1
+            return row[0], True
+        connection.close()
+
+    with _cache_lock:
+        cache_metrics['bypassed' if bypass else 'misses'] += 1
+
+    planning_id = push_pma_request(payload)
+    if type(planning_id) == int:
+        return planning_id, False
+
+    connection = _connect()
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO pma_payload_cache (payload_hash, planning_id, created_on, last_used) "
+                           "VALUES (?, ?, ?, ?)", (key, planning_id, time.time(), time.time()))
+    connection.close()
+
+    evict_pma_cache(ttl)
+
+    return planning_id, False
@@ -0,0 +1,232 @@
+""" Asynchronous poller for the results of the PMA API with a local result store """
+import asyncio
+import json
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+import requests
+from data.service_database import connect_database
+import services.api_service.api_pma as api_pma
+
+
+RESULTS_DATABASE = "data/demo.db"
+
+_table_lock = threading.Lock()
+_tables_ready = set()
+
+
+def _connect():
+    connection = connect_database(RESULTS_DATABASE)
+
+    with _table_lock:
+        if RESULTS_DATABASE not in _tables_ready:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS pma_results ("
+                                   "planning_id TEXT PRIMARY KEY, output BLOB, size INTEGER, compressed_size INTEGER, "
+                                   "retrieved_on TEXT)")
+            _tables_ready.add(RESULTS_DATABASE)
+
+    return connection
+
+
+def store_pma_result(planning_id, output):
+    """
+    Store the output of a planning compressed in the pma_results table
+
+    :param planning_id: id of the planning
+    :param output: dictionary with the output of the PMA API
+    :return: None
+    """
+
+    data = json.dumps(output, separators=(',', ':')).encode()
+    compressed = zlib.compress(data, 6)
+
+    connection = _connect()
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO pma_results (planning_id, output, size, compressed_size, retrieved_on) "
+                           "VALUES (?, ?, ?, ?, datetime('now'))", (planning_id, compressed, len(data), len(compressed)))
+    connection.close()
+
+
+def load_pma_result(planning_id):
+    """
+    Load the output of a planning from the pma_results table
+
+    :param planning_id: id of the planning
+    :return: dictionary with the output of the PMA API, None when the planning isn't stored
+    """
+
+    connection = _connect()
+    row = connection.execute("SELECT output FROM pma_results WHERE planning_id = ?", (planning_id,)).fetchone()
+    connection.close()
+
+    if row is None:
+        return None
+
+    return json.loads(zlib.decompress(row[0]))
+
+
+def _planning_output(response):
+    # PMA answers 200 with the output once the planning is finished
+    if response.status_code != 200:
+        return None
+    try:
+        output = response.json()
+    except ValueError:
+        return None
+
+    return output if isinstance(output, dict) and "routes" in output else None
+
+
+class PmaPoller:
+    """
+    Poll the output of submitted plannings until they are finished. Every planning id is polled in its own task, the
+    delay between requests doubles after every attempt (up to max_delay) and is randomised between half and the full
+    delay, so many plannings don't hit the API at the same moment. Finished outputs are stored with
+    store_pma_result.
+
+    The poller runs an event loop in a background thread, track() can be called from any thread.
+
+    :param base_url: url of the PMA API
+    :param initial_delay: seconds before the second request
+    :param max_delay: maximum seconds between two requests
+    :param timeout: seconds after which a planning is given up
+    """
+
+    def __init__(self, base_url=None, initial_delay=5, max_delay=120, timeout=30 * 60, request_timeout=60):
+        self.base_url = base_url or api_pma.PMA_URL
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        self.plannings = {}
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+
+    def _start(self):
+        if self.thread is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name='pma_poller', daemon=True)
+            self.thread.start()
+
+    def _get_output(self, planning_id):
+        url = f"{self.base_url}/api/log/{planning_id}/output"
+        return requests.get(url=url, auth=api_pma.basic_auth, timeout=self.request_timeout)
+
+    def delay(self, attempt):
+        """
+        :return: seconds to wait after the given (0 based) attempt
+        """
+
+        delay = min(self.max_delay, self.initial_delay * 2 ** attempt)
+
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def poll(self, planning_id):
+        """
+        Poll a planning until it is finished, 500 and 429 responses and connection errors are retried as well. Other
+        4xx responses won't change when they are retried, the planning fails at once.
+
+        :return: dictionary with the output of the PMA API
+        """
+
+        state = self.plannings[planning_id]
+        started = time.monotonic()
+        attempt = 0
+
+        while True:
+            state['attempts'] = attempt + 1
+            try:
+                response = await asyncio.to_thread(self._get_output, planning_id)
+                output = _planning_output(response)
+                if response.status_code >= 500:
+                    state['server_errors'] += 1
+                elif 400 <= response.status_code < 500 and response.status_code != 429:
+                    state['status'] = 'failed'
+                    state['error'] = f"PMA answered planning {planning_id} with status {response.status_code}: " \
+                                     f"{response.text[:200]}"
+                    raise RuntimeError(state['error'])
+            except requests.RequestException as e:
+                output = None
+                state['error'] = str(e)
+
+            if output is not None:
+                await asyncio.to_thread(store_pma_result, planning_id, output)
+                state['status'] = 'completed'
+                state['error'] = None
+                return output
+
+            if time.monotonic() - started > self.timeout:
+                state['status'] = 'failed'
+                state['error'] = f"The planning wasn't finished after {round(self.timeout / 60)} minutes"
+                raise TimeoutError(state['error'])
+
+            await asyncio.sleep(self.delay(attempt))
+            attempt += 1
+
+    def track(self, planning_id):
+        """
+        Start polling a planning, plannings that are stored or already being polled aren't requested again.
+
+        :param planning_id: id returned by push_pma_request
+        :return: concurrent.futures.Future with the output of the planning
+        """
+
+        with self.lock:
+            future = self.futures.get(planning_id)
+            # Plannings that were given up are polled again
+            if future is not None and not (future.done() and (future.cancelled() or future.exception() is not None)):
+                return future
+
+            self.plannings[planning_id] = {'status': 'pending', 'attempts': 0, 'server_errors': 0, 'error': None}
+
+            output = load_pma_result(planning_id)
+            if output is not None:
+                self.plannings[planning_id]['status'] = 'completed'
+                future = _completed_future(output)
+            else:
+                self._start()
+                future = asyncio.run_coroutine_threadsafe(self.poll(planning_id), self.loop)
+
+            self.futures[planning_id] = future
+
+        return future
+
+    def status(self, planning_id=None):
+        """
+        :return: dictionary with status (pending, completed or failed), attempts, server_errors and error of a
+                 planning, or of all plannings when no planning_id is given
+        """
+
+        with self.lock:
+            if planning_id is None:
+                return {key: dict(value) for key, value in self.plannings.items()}
+            return dict(self.plannings[planning_id]) if planning_id in self.plannings else None
+
+
+def _completed_future(result):
+    future = Future()
+    future.set_result(result)
+
+    return future
+
+
+# Poller of the application
+pma_poller = PmaPoller()
+
+
+def retrieve_pma_result(planning_id, timeout=None):
+    """
+    Retrieve the output of a planning, from the local store when it has been downloaded before.
+
+    :param planning_id: id of the planning
+    :param timeout: seconds to wait for the planning, None waits until the poller gives up
+    :return: dictionary with the output of the PMA API
+    """
+
+    return pma_poller.track(planning_id).result(timeout)
+
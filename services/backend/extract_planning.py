@@ -1,5 +1,9 @@
 from data.service_database import load_query_from_db
+from services.api_service.pma_poller import load_pma_result, store_pma_result
+from services.backend.utils import HUB_TERMINALS
 import json
+import ijson
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from collections import defaultdict
@@ -22,105 +26,146 @@ def get_pma_result(result_id, result_type="output"):
     else:
         return response
 
-def create_occupancy_timeline(transit_events):
+def haversine_km(latitudes_from, longitudes_from, latitudes_to, longitudes_to):
+    """
+    Great circle distance in kilometers between arrays of positions in radians.
     """
-    Transit events is a dictionary with the depart and arrival times of barges. This function will:
-    1. Filter the events per barge
-    2. Sort the events per barge on time
-    3. Find the occupancy of the barge at each hour
 
+    a = np.sin((latitudes_to - latitudes_from) / 2) ** 2 + \
+        np.cos(latitudes_from) * np.cos(latitudes_to) * np.sin((longitudes_to - longitudes_from) / 2) ** 2
 
-    :param transit_events:
-    :return:
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+def create_occupancy_timeline(transit_events):
     """
+    Transit events are the depart and arrival times of barges. This function will:
+    1. Filter the departures per barge
+    2. Sort the departures per barge on time
+    3. Find the occupancy of the barge at each hour between two departures, the hours get the occupancy of the
+       later departure
 
-    departures = [event for event in transit_events if event['transit_type'] == 'DEPART']
 
-    # create a pandas dataframe of the events with 'transit_date_time as index, stransit_occupancy_teu, transit_availability_teu and barge_id as values
-    df = pd.DataFrame.from_dict(departures)
+    :param transit_events: dataframe or list of dictionaries with the transit events of extract_calls
+    :return: dataframe with barge_id, date_time, occupancy_teu, availability_teu and capacity_teu
+    """
 
-    # convert the transit_date_time to datetime
-    df['transit_date_time'] = pd.to_datetime(df['transit_date_time'])
+    events = pd.DataFrame(transit_events)
+    columns = ['barge_id', 'date_time', 'occupancy_teu', 'availability_teu', 'capacity_teu']
+    if events.empty:
+        return pd.DataFrame(columns=columns)
 
-    # sort the dataframe on transit_date_time
+    df = events.loc[events['transit_type'] == 'DEPART',
+                    ['barge_id', 'transit_date_time', 'transit_occupancy_teu', 'transit_availability_teu']].copy()
+    df['transit_date_time'] = pd.to_datetime(df['transit_date_time'])
     df.sort_values(['barge_id', 'transit_date_time'], inplace=True)
-
-    # reindex the dataframe
     df.reset_index(drop=True, inplace=True)
 
-    for label, row in df.iterrows():
-        if label == 1:
-            continue
-        prev_time = df.iloc[label - 1]['transit_date_time']
-        current_time = pd.to_datetime(row['transit_date_time'])
-
-        # create a list of hours between the previous and current time with datetime
-        hours = pd.date_range(prev_time, current_time, freq='h')
-        df_append = []
-        for hour in hours[1:]:
-            df_append.append({'transit_date_time': hour,
-                            'barge_id': row['barge_id'],
-                            'transit_occupancy_teu': row['transit_occupancy_teu'],
-                            'transit_availability_teu': row['transit_availability_teu']})
-
-        # create a dataframe of the appended list
-        df_append = pd.DataFrame(df_append)
-        df = pd.concat([df,df_append])
-
-    # sort the dataframe on transit_date_time
+    # Every whole hour after the previous departure of the barge, up to and including the departure
+    previous_time = df.groupby('barge_id')['transit_date_time'].shift()
+    hours = ((df['transit_date_time'] - previous_time) // pd.Timedelta(hours=1)).fillna(0).clip(lower=0).astype(int)
+    rows = np.repeat(df.index.to_numpy(), hours.to_numpy())
+    steps = np.arange(len(rows)) - np.repeat(np.cumsum(hours.to_numpy()) - hours.to_numpy(), hours.to_numpy()) + 1
+
+    hourly = df.loc[rows].reset_index(drop=True)
+    hourly['transit_date_time'] = previous_time.loc[rows].to_numpy() + pd.to_timedelta(steps, unit='h')
+
+    df = pd.concat([df, hourly], ignore_index=True)
     df.rename(columns={'transit_date_time': 'date_time',
                        'transit_occupancy_teu': 'occupancy_teu',
                        'transit_availability_teu': 'availability_teu'}, inplace=True)
     df['capacity_teu'] = df['availability_teu'] + df['occupancy_teu']
-    df = df[['barge_id', 'date_time', 'occupancy_teu', 'availability_teu', 'capacity_teu']]
+    df = df[columns]
 
-    # reindex the dataframe
-    df.sort_values(['barge_id', 'date_time'], inplace=True)
+    df.sort_values(['barge_id', 'date_time'], inplace=True, kind='stable')
     df.reset_index(drop=True, inplace=True)
 
     return df
 
-def pma_call_dict(pma_call_dict, barge_id, barge_call_sign):
+# Columns of a call, from the fields of a stop in the PMA output
+PMA_CALL_COLUMNS = {'terminalId': 'terminal_id',
+                    'startTime': 'start_date_time',
+                    'departureTime': 'end_date_time',
+                    'reefersOnBoardAfterStop': 'reefer_on_board',
+                    'dangerousGoodsOnBoardAfterStop': 'dangerous_goods_on_board',
+                    'loadOrders': 'load_orders',
+                    'loading20': 'load_20',
+                    'loading40': 'load_40',
+                    'loading45': 'load_45',
+                    'dischargeOrders': 'discharge_orders',
+                    'discharging20': 'discharge_20',
+                    'discharging40': 'discharge_40',
+                    'discharging45': 'discharge_45',
+                    'fixedStop': 'fixed_stop',
+                    'fixedAppointment': 'fixedAppointment'}
+
+CALL_COLUMNS = ['terminal_id', 'barge_id', 'barge_call_sign', 'time_status', 'start_date_time', 'end_date_time',
+                'reefer_on_board', 'dangerous_goods_on_board', 'load_orders', 'load_20', 'load_40', 'load_45',
+                'discharge_orders', 'discharge_20', 'discharge_40', 'discharge_45', 'fixed_stop', 'fixedAppointment',
+                'teu_on_board', 'occupancy']
+
+TRANSIT_COLUMNS = ['transit_type', 'transit_location_id', 'transit_occupancy_teu', 'transit_availability_teu',
+                   'barge_id', 'transit_date_time']
+
+def stream_planning_json(file):
+    """
+    Parse a planning of the PMA API incrementally and keep only what the analysis of ExtractPmaPlanning uses. The
+    routes are built one at a time and reduced to their stops with the fields of PMA_CALL_COLUMNS, only the order
+    ids and container numbers of the orders are kept. json.load would build every field of the planning at once.
+
+    :param file: seekable binary file object with the planning json, e.g. an uploaded file
+    :return: dictionary with the routes, orders and unplannedOrders of the planning, in the format of the PMA API
+    """
+
+    routes = []
+    file.seek(0)
+    for route in ijson.items(file, 'routes.item', use_float=True):
+        routes.append({"vessel": route["vessel"],
+                       "capacityTEU": route["capacityTEU"],
+                       "stops": [{field: stop[field] for field in PMA_CALL_COLUMNS if field in stop}
+                                 for stop in route["stops"]]})
+
+    file.seek(0)
+    orders = [{"orderId": order["orderId"], "containerNumber": order.get("containerNumber")}
+              for order in ijson.items(file, 'orders.item', use_float=True)]
+
+    file.seek(0)
+    # Every unplanned order counts, also the ones without an orderId
+    unplanned_orders = [{"orderId": order.get("orderId")}
+                        for order in ijson.items(file, 'unplannedOrders.item', use_float=True)]
+
+    return {"routes": routes, "orders": orders, "unplannedOrders": unplanned_orders}
+
+def dataframe_records(df):
     """
-    Create a dictionary with the calls from the PMA API.
+    Faster DataFrame.to_dict(orient='records') for plain columns, the values are python types.
     """
 
-    # if pma_call_dict['startTime'] '%Y-%m-%dT%H:%M' then add :00 to the end of the string
-    if len(pma_call_dict['startTime']) == 16:
-        pma_call_dict['startTime'] = pma_call_dict['startTime'] + ':00'
-    if len(pma_call_dict['departureTime']) == 16:
-        pma_call_dict['departureTime'] = pma_call_dict['departureTime'] + ':00'
-
-    barge_call = {
-        "terminal_id": pma_call_dict['terminalId'],
-        "barge_id": barge_id,
-        "barge_call_sign": barge_call_sign,
-        "time_status": "PLANNED",
-        "start_date_time": pma_call_dict['startTime'],
-        "end_date_time": pma_call_dict['departureTime'],
-        "reefer_on_board": pma_call_dict['reefersOnBoardAfterStop'],
-        "dangerous_goods_on_board": pma_call_dict['dangerousGoodsOnBoardAfterStop'],
-        "load_orders": pma_call_dict['loadOrders'],
-        "load_20": pma_call_dict['loading20'],
-        "load_40": pma_call_dict['loading40'],
-        "load_45": pma_call_dict['loading45'],
-        "discharge_orders": pma_call_dict['dischargeOrders'],
-        "discharge_20": pma_call_dict['discharging20'],
-        "discharge_40": pma_call_dict['discharging40'],
-        "discharge_45": pma_call_dict['discharging45'],
-        "fixed_stop": pma_call_dict['fixedStop'],
-        "fixedAppointment" : pma_call_dict['fixedAppointment']}
-
-    return barge_call
-
-def retrieve_barge_id(barge_call_sign):
+    columns = df.columns.tolist()
+
+    return [dict(zip(columns, row)) for row in zip(*(df[column].tolist() for column in columns))]
+
+def retrieve_barge_ids(barge_call_signs):
     """
-    Retrieve the barge id from the barge call sign.
+    Retrieve the barge ids of barge call signs with one query.
+
+    :param barge_call_signs: iterable with call signs
+    :return: dictionary {call_sign: barge_id}
     """
 
-    barge_id = load_query_from_db(f"""SELECT barge_id FROM barges WHERE call_sign = '{barge_call_sign}'""")
+    barge_call_signs = sorted(set(barge_call_signs))
+    if not barge_call_signs:
+        return {}
+
+    placeholders = ', '.join('?' * len(barge_call_signs))
+    barges = load_query_from_db(f"SELECT call_sign, barge_id FROM barges WHERE call_sign IN ({placeholders})",
+                                params=barge_call_signs)
+    barge_ids = dict(zip(barges['call_sign'], barges['barge_id']))
+
+    missing = [call_sign for call_sign in barge_call_signs if call_sign not in barge_ids]
+    if missing:
+        raise ValueError(f"Unknown barges in the planning: {', '.join(missing)}")
 
-    return barge_id.values[0][0]
+    return barge_ids
 
 class ExtractPmaPlanning():
     """
@@ -137,84 +182,131 @@ class ExtractPmaPlanning():
 
         self.calls = []
         self.transport_events = []
+        self.dataframe_calls = None
+        self.dataframe_transit = None
         self.occupancy_timeline = []
         self.containers = {}
         self.no_unplanned_cargo = len(self.json["unplannedOrders"])
         self.no_planned_cargo  = len(self.json["orders"]) - self.no_unplanned_cargo
         self.occupancy_per_voyage = self.calculate_occupancy_per_voyage()
 
+    @property
+    def calls(self):
+        """
+        The calls as a list of dictionaries, created from dataframe_calls when they are first used.
+        """
+
+        if self._calls is None:
+            self._calls = dataframe_records(self.dataframe_calls)
+
+        return self._calls
+
+    @calls.setter
+    def calls(self, calls):
+        self._calls = calls
+
+    @property
+    def transport_events(self):
+        """
+        The transit events as a list of dictionaries, created from dataframe_transit when they are first used.
+        """
+
+        if self._transport_events is None:
+            self._transport_events = dataframe_records(self.dataframe_transit)
+
+        return self._transport_events
+
+    @transport_events.setter
+    def transport_events(self, transport_events):
+        self._transport_events = transport_events
+
     def get_planning_json(self):
         """
-        Get the planning json from the PMA API.
+        Get the planning json, from the local result store when it has been downloaded before or else from the PMA API.
         """
 
-        returned_object = get_pma_result(self.key, result_type="output")
-        json_object = returned_object.json()
+        json_object = load_pma_result(self.key)
+        if json_object is None:
+            returned_object = get_pma_result(self.key, result_type="output")
+            json_object = returned_object.json()
+            if isinstance(json_object, dict) and "routes" in json_object:
+                store_pma_result(self.key, json_object)
 
         return json_object
 
     def extract_calls(self):
         """
-        Extract the calls from the planning json.
+        Extract the calls and transit events from the planning json. The stops of all routes are flattened in one
+        pass, the first stop of a route is where the barge starts and isn't a call. The TEU on board is the running
+        total of the loaded minus the discharged TEU per route. A call has an ARRIVE event at its start (with the
+        occupancy before the call) and a DEPART event at its end (with the occupancy after the call).
+
+        The results are stored as dataframes (dataframe_calls, dataframe_transit), calls and transport_events give
+        them as lists of dictionaries.
+
+        :return: dataframe with the calls
         """
 
-        for barge_plan in self.json["routes"]:
-            barge_call_sign = barge_plan["vessel"]
-            barge_id = retrieve_barge_id(barge_call_sign)
-            transit_occupancy = prev_transit_occupancy = 0.0
-            transit_availability =  prev_transit_availability = barge_plan["capacityTEU"]
-            transit_end_date_time = None
-            transit_start_date_time = None
-            transit_arrive = None
-            transit_depart = None
-            transit_events = []
-
-            for i, call in enumerate(barge_plan["stops"]):
-                if i > 0:
-                    barge_call = pma_call_dict(call, barge_id, barge_call_sign)
-                    transit_end_date_time = call["startTime"]
-
-                    transit_start_date_time = call["departureTime"]
-                    transit_occupancy += (call["loading20"] * 1 + call["loading40"] * 2 + call["loading45"] * 2.25 )
-                    transit_occupancy -= (call["discharging20"] * 1 + call["discharging40"] * 2 + call["discharging45"] * 2.25)
-                    transit_availability = barge_plan["capacityTEU"] - transit_occupancy
-                    barge_call["teu_on_board"] = transit_occupancy
-                    barge_call["occupancy"] = round(transit_occupancy / barge_plan["capacityTEU"],2)
-                    self.calls.append(barge_call)
-
-                    if transit_end_date_time is not None:
-                        transit_depart = {"transit_type": "DEPART",
-                                          "transit_location_id": barge_call["terminal_id"],
-                                          "transit_occupancy_teu": transit_occupancy,
-                                          "transit_availability_teu": transit_availability,
-                                          "barge_id": barge_id,
-                                          "transit_date_time": transit_start_date_time
-                                          }
-
-                    if transit_start_date_time is not None:
-                        transit_arrive = {"transit_type": "ARRIVE",
-                                          "transit_location_id": barge_call["terminal_id"],
-                                          "transit_occupancy_teu": prev_transit_occupancy,
-                                          "transit_availability_teu": prev_transit_availability,
-                                          "barge_id": barge_id,
-                                          "transit_date_time": transit_end_date_time
-                                            }
-
-                    self.transport_events.append(transit_arrive)
-                    self.transport_events.append(transit_depart)
-
-                    prev_transit_occupancy = transit_occupancy
-                    prev_transit_availability = transit_availability
-
-                    transit_end_date_time = None
-                    transit_start_date_time = None
-
-                    transit_arrive = None
-                    transit_depart = None
-
-        self.occupancy_timeline = create_occupancy_timeline(self.transport_events)
-
-        return self.calls
+        routes = self.json["routes"]
+        # One column per field over the stops of all routes, without the first stop of every route
+        call_stops = [stop for route in routes for stop in route["stops"][1:]]
+
+        if not call_stops:
+            self.dataframe_calls = pd.DataFrame(columns=CALL_COLUMNS)
+            self.dataframe_transit = pd.DataFrame(columns=TRANSIT_COLUMNS)
+        else:
+            calls = pd.DataFrame({column: [stop[field] for stop in call_stops]
+                                  for field, column in PMA_CALL_COLUMNS.items()})
+            calls_per_route = [max(len(route["stops"]) - 1, 0) for route in routes]
+            calls['route'] = np.repeat(np.arange(len(routes)), calls_per_route)
+            calls['barge_call_sign'] = np.repeat([route["vessel"] for route in routes], calls_per_route)
+            calls['capacityTEU'] = np.repeat([route["capacityTEU"] for route in routes], calls_per_route)
+
+            barge_ids = retrieve_barge_ids(calls['barge_call_sign'])
+            calls['barge_id'] = calls['barge_call_sign'].map(barge_ids)
+            calls['time_status'] = "PLANNED"
+
+            # Times without seconds ('%Y-%m-%dT%H:%M') get ':00' added
+            for column in ['start_date_time', 'end_date_time']:
+                calls[column] = calls[column].where(calls[column].str.len() != 16, calls[column] + ':00')
+
+            capacity = calls['capacityTEU'].astype(float)
+            teu_change = (calls['load_20'] * 1 + calls['load_40'] * 2 + calls['load_45'] * 2.25) - \
+                         (calls['discharge_20'] * 1 + calls['discharge_40'] * 2 + calls['discharge_45'] * 2.25)
+            calls['teu_on_board'] = (0.0 + teu_change).groupby(calls['route']).cumsum()
+            # round() of python, numpy rounds e.g. 0.075 up
+            calls['occupancy'] = [round(occupancy, 2) for occupancy in (calls['teu_on_board'] / capacity).tolist()]
+
+            teu_before = calls.groupby('route')['teu_on_board'].shift(fill_value=0.0)
+
+            # An ARRIVE and a DEPART event per call, in that order
+            transit = {'transit_type': ['ARRIVE', 'DEPART'],
+                       'transit_location_id': [calls['terminal_id'], calls['terminal_id']],
+                       'transit_occupancy_teu': [teu_before, calls['teu_on_board']],
+                       'transit_availability_teu': [capacity - teu_before, capacity - calls['teu_on_board']],
+                       'barge_id': [calls['barge_id'], calls['barge_id']],
+                       'transit_date_time': [calls['start_date_time'], calls['end_date_time']]}
+            self.dataframe_transit = pd.DataFrame(
+                {column: np.column_stack([np.broadcast_to(values, len(calls)) if isinstance(values, str)
+                                          else np.asarray(values) for values in arrive_depart]).ravel()
+                 for column, arrive_depart in transit.items()})
+
+            self.dataframe_calls = calls[CALL_COLUMNS]
+
+        self.dataframe_calls = self.dataframe_calls.astype(
+            {'barge_id': 'int64', 'reefer_on_board': 'int64', 'dangerous_goods_on_board': 'int64',
+             'load_20': 'int64', 'load_40': 'int64', 'load_45': 'int64', 'discharge_20': 'int64',
+             'discharge_40': 'int64', 'discharge_45': 'int64', 'fixed_stop': 'bool', 'fixedAppointment': 'bool',
+             'teu_on_board': 'float64', 'occupancy': 'float64'})
+        self.dataframe_transit = self.dataframe_transit.astype(
+            {'transit_occupancy_teu': 'float64', 'transit_availability_teu': 'float64', 'barge_id': 'int64'})
+
+        # The lists of dictionaries are created when they are used
+        self._calls = None
+        self._transport_events = None
+        self.occupancy_timeline = create_occupancy_timeline(self.dataframe_transit)
+
+        return self.dataframe_calls
 
     def extract_containers(self):
         """
@@ -253,78 +345,91 @@ class ExtractPmaPlanning():
         return self.containers
 
 
-    def add_voyage_numbers(self):
+    def add_voyage_numbers(self, hub_terminals=None):
         """
-        Add the voyage number to the calls. The call has should be sorted by start_date_time. It should be filtered on
-        barge_id. After every terminal_id "VNVUTDGML" the voyage number should change.
+        Add the voyage number to the calls. The calls are numbered in their order, which is per barge on
+        start_date_time. After every hub terminal the voyage number should change.
 
-        The voyage number is DIRECTIONYYWW_# where YY is the year and WW is the week number and # is the voyage number that week.
-        (1,2,3,4) and the direction (IMP,EXP) should be added to the voyage number.
+        The voyage number is DIRECTION-CALLSIGN-YYYYWW-# where YYYY is the year, WW is the ISO week number and # is the
+        voyage number that week. The direction is IMP or EXP.
 
-        - If the terminal_id is "VNVUTDGML" and the call has load container:
-        --> The import_voyage_number should be YYWW_1_IMP
-        --> Following calls that don't have discharge container and is not equal to "VNVUTDGML" should have the same
-        voyage number.
-        --> Following calls that have load container should have the same voyage number. with EXPYYWW_1
+        - If the terminal is a hub and the call has load containers:
+        --> The call gets the import voyage number of the hub visit
+        --> Following calls that discharge containers get the same import voyage number
+        --> Following calls that load containers get the export voyage number
 
-        - If the terminal_id is "VNVUTDGML" and the call has discharge container:
-        --> The import_voyage_number should be YYWW_1_EXP
+        - If the terminal is a hub and the call has discharge containers:
+        --> The call gets the export voyage number of the calls before it
 
-        :return:
+        The counters run over the hub visits: a hub visit that is the first call of a barge resets them, a hub visit
+        in another week than the previous call restarts them at 1 and otherwise they increase by 1.
+
+        :param hub_terminals: list with the hub terminals, by default HUB_TERMINALS
+        :return: None
         """
 
-        calls = self.calls
-        imp_voyage_iteration = 0
-        exp_voyage_iteration = 1
-        prev_week = None
-        prev_b_id = None
-        exp_prev_week = False
-
-        for i, call in enumerate(calls):
-            # Get week from dt object string "2022-01-01T00:00:00"
-            date_time_st = datetime.strptime(call['start_date_time'], "%Y-%m-%dT%H:%M:%S")
-            b_id = call["barge_id"]
-            week = date_time_st.isocalendar()[1]
-            year = date_time_st.year
-
-            exp_vo_no = "EXP" + "-" + call["barge_call_sign"] + "-" + str(year) + str(week) + "-" + str(exp_voyage_iteration)
-            exp_prev_week_no = "EXP" + "-" + call["barge_call_sign"] + "-" + str(year) + str(prev_week) + "-" + str(exp_voyage_iteration)
-
-            if call['terminal_id'] == "VNVUTDGML":
-                # Export number
-                if prev_b_id != b_id:
-                    imp_voyage_iteration = 0
-                    exp_voyage_iteration = 1
-                elif prev_week != week:
-                    exp_prev_week = True
-                    imp_voyage_iteration = 1
-                    exp_voyage_iteration = 1
-                else:
-                    imp_voyage_iteration += 1
-                    exp_voyage_iteration += 1
-
-                imp_vo_no = "IMP" + "-" + call["barge_call_sign"] + "-" + str(year) + str(week) + "-" + str(imp_voyage_iteration)
-
-                if call['load_20'] + call['load_40'] + call['load_45'] > 0:
-                    calls[i]['voyage_number_import'] = imp_vo_no
-
-                if call['discharge_20'] + call['discharge_40'] + call['discharge_45'] > 0:
-                    if exp_prev_week == True:
-                        calls[i]['voyage_number_export'] = exp_prev_week_no
-                    else:
-                        calls[i]['voyage_number_export'] = exp_vo_no
-                    exp_vo_no = "EXP" + "-" + call["barge_call_sign"] + "-" + str(year) + str(week) + "-" + str(exp_voyage_iteration)
-
-            else:
-                if call['discharge_20'] + call['discharge_40'] + call['discharge_45'] > 0:
-                        calls[i]['voyage_number_import'] = imp_vo_no
-
-                if call['load_20'] + call['load_40'] + call['load_45'] > 0:
-                    calls[i]['voyage_number_export'] = exp_vo_no
-
-            prev_week = week
-            prev_b_id = b_id
-            exp_prev_week = False
+        hub_terminals = HUB_TERMINALS if hub_terminals is None else hub_terminals
+        calls = self.dataframe_calls if self.dataframe_calls is not None else pd.DataFrame(self.calls)
+        if calls.empty:
+            return
+
+        start = pd.to_datetime(calls['start_date_time'], format="%Y-%m-%dT%H:%M:%S")
+        week = start.dt.isocalendar()['week'].to_numpy(dtype=int)
+        year = start.dt.year.to_numpy()
+        barge_id = calls['barge_id'].to_numpy()
+        hub = calls['terminal_id'].isin(hub_terminals).to_numpy()
+        loads = (calls['load_20'] + calls['load_40'] + calls['load_45'] > 0).to_numpy()
+        discharges = (calls['discharge_20'] + calls['discharge_40'] + calls['discharge_45'] > 0).to_numpy()
+
+        # How the counters change at a hub visit, compared with the previous call
+        new_barge = np.r_[True, barge_id[1:] != barge_id[:-1]]
+        new_week = np.r_[True, week[1:] != week[:-1]]
+        reset_barge = hub & new_barge
+        reset_week = hub & ~new_barge & new_week
+
+        # Segments of hub visits that start with a reset, counted within the segment
+        hub_index = np.flatnonzero(hub)
+        reset = (reset_barge | reset_week)[hub_index]
+        segment_start = np.maximum.accumulate(np.where(reset, np.arange(len(hub_index)), 0))
+        increments = np.arange(len(hub_index)) - segment_start + np.where(reset[segment_start], 0, 1)
+        import_iteration = np.where(reset_week[hub_index][segment_start], 1, 0) + increments
+        export_iteration = 1 + increments
+
+        # Export counter before every call: the counter of the last hub visit before it, 1 before the first one
+        export_after = np.full(len(calls), np.nan)
+        export_after[hub_index] = export_iteration
+        export_before = pd.Series(export_after).ffill().shift(fill_value=1).fillna(1).astype(int).astype(str)
+
+        call_sign = calls['barge_call_sign'].astype(str).to_numpy()
+        year_week = pd.Series(year.astype(str)) + pd.Series(week.astype(str))
+        previous_week = pd.Series(year.astype(str)) + pd.Series(np.r_[-1, week[:-1]].astype(str))
+        export_number = "EXP-" + call_sign + "-" + year_week + "-" + export_before
+        export_number_previous_week = "EXP-" + call_sign + "-" + previous_week + "-" + export_before
+
+        # Import number of the last hub visit, no number before the first one. The numbers are taken at the position
+        # of the last hub visit, a forward fill of the object column would rely on the deprecated downcasting.
+        import_number = np.full(len(calls), None, dtype=object)
+        import_number[hub_index] = ("IMP-" + pd.Series(call_sign[hub_index]) + "-" + year_week[hub_index].values +
+                                    "-" + import_iteration.astype(str)).values
+        last_hub = np.maximum.accumulate(np.where(hub, np.arange(len(calls)), -1))
+        last_import_number = np.where(last_hub >= 0, import_number[np.maximum(last_hub, 0)], None)
+
+        voyage_number_import = np.where(hub & loads, import_number,
+                                        np.where(~hub & discharges, last_import_number, None))
+        voyage_number_export = np.where(hub & discharges,
+                                        np.where(reset_week, export_number_previous_week, export_number),
+                                        np.where(~hub & loads, export_number, None))
+
+        if self.dataframe_calls is not None:
+            self.dataframe_calls = self.dataframe_calls.assign(voyage_number_import=voyage_number_import,
+                                                               voyage_number_export=voyage_number_export)
+
+        # Calls that are already lists of dictionaries only get the numbers they have
+        if self._calls:
+            for column, numbers in [('voyage_number_import', voyage_number_import),
+                                    ('voyage_number_export', voyage_number_export)]:
+                for i in np.flatnonzero(pd.notna(numbers)):
+                    self._calls[i][column] = numbers[i]
 
     def calculate_occupancy_per_voyage(self):
         """
@@ -341,3 +446,39 @@ class ExtractPmaPlanning():
                 occupancy_per_voyage[call["voyage_number_export"]] += call["occupancy"]
 
         return occupancy_per_voyage
+
+    def calculate_kpis(self, terminal_positions=None):
+        """
+        Calculate the KPIs of the planning. The calls are extracted first when that hasn't been done yet.
+
+        :param terminal_positions: dictionary {terminalId: (latitude, longitude)}, e.g. from the terminals of the
+                                   payload. Without positions the distance isn't calculated.
+        :return: dictionary with fleet_utilisation (average occupancy of the barges after their calls),
+                 planned_containers, unplanned_containers, planned_share and distance_km (great circle distance
+                 between the consecutive stops of all routes)
+        """
+
+        if not self.calls:
+            self.extract_calls()
+
+        occupancy = [call["occupancy"] for call in self.calls]
+        total_containers = self.no_planned_cargo + self.no_unplanned_cargo
+
+        kpis = {"fleet_utilisation": sum(occupancy) / len(occupancy) if occupancy else 0.0,
+                "planned_containers": self.no_planned_cargo,
+                "unplanned_containers": self.no_unplanned_cargo,
+                "planned_share": self.no_planned_cargo / total_containers if total_containers else 0.0,
+                "distance_km": None}
+
+        if terminal_positions is not None:
+            distance = 0.0
+            for barge_plan in self.json["routes"]:
+                positions = [terminal_positions[stop["terminalId"]] for stop in barge_plan["stops"]
+                             if stop["terminalId"] in terminal_positions]
+                if len(positions) > 1:
+                    latitudes, longitudes = np.radians(np.array(positions, dtype=float)).T
+                    distance += haversine_km(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:]).sum()
+            kpis["distance_km"] = round(float(distance), 2)
+
+        return kpis
+
@@ -0,0 +1,150 @@
+""" Cache of Plotly figures, keyed by a fingerprint of the dataframes they are made of """
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+import plotly.io as pio
+from data.service_database import table_version
+
+
+FIGURE_CACHE_MAX_ENTRIES = 256
+FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def frame_fingerprint(dataframe):
+    """
+    Fingerprint of the content of a dataframe: the values, the index, the column names and the dtypes
+
+    :param dataframe: dataframe or None
+    :return: sha256 hex digest
+    """
+
+    fingerprint = hashlib.sha256()
+    if dataframe is None:
+        return fingerprint.hexdigest()
+
+    fingerprint.update(repr(list(zip(dataframe.columns, dataframe.dtypes.astype(str)))).encode())
+    fingerprint.update(pd.util.hash_pandas_object(dataframe.index).to_numpy().tobytes())
+    for column in dataframe.columns:
+        values = dataframe[column]
+        try:
+            hashes = pd.util.hash_pandas_object(values, index=False)
+        except TypeError:
+            # Columns with lists, like the orders of a call, are hashed by their text
+            hashes = pd.util.hash_pandas_object(values.map(repr), index=False)
+        fingerprint.update(hashes.to_numpy().tobytes())
+
+    return fingerprint.hexdigest()
+
+
+class FigureCache:
+    """
+    Least recently used cache of figures, stored as Plotly JSON. The cache is shared by all sessions of the
+    application. The figure is built from the JSON on the first hit and kept with it, because building a figure
+    validates its whole template. Every hit returns that same figure object, copy it with go.Figure(fig) before
+    changing it.
+
+    :param max_entries: maximum number of figures
+    :param max_bytes: maximum size of the JSON of all figures
+    """
+
+    def __init__(self, max_entries=FIGURE_CACHE_MAX_ENTRIES, max_bytes=FIGURE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.figures = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        """
+        :return: the cached figure, None when the figure isn't cached
+        """
+
+        with self.lock:
+            entry = self.figures.get(key)
+            if entry is None:
+                self.metrics['misses'] += 1
+                return None
+            self.figures.move_to_end(key)
+            self.metrics['hits'] += 1
+
+            if entry[1] is None:
+                entry[1] = pio.from_json(entry[0], skip_invalid=True)
+
+            return entry[1]
+
+    def put(self, key, fig):
+        """
+        Store the JSON of a figure, the least recently used figures are evicted when the cache is full
+        """
+
+        figure_json = pio.to_json(fig, validate=False)
+
+        with self.lock:
+            if key in self.figures:
+                self.size -= len(self.figures.pop(key)[0])
+            self.figures[key] = [figure_json, None]
+            self.size += len(figure_json)
+
+            while len(self.figures) > 1 and (len(self.figures) > self.max_entries or self.size > self.max_bytes):
+                _, evicted = self.figures.popitem(last=False)
+                self.size -= len(evicted[0])
+                self.metrics['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.figures.clear()
+            self.size = 0
+
+
+# Cache of the application
+figure_cache = FigureCache()
+
+
+def _object_fingerprint(obj, frame):
+    # The fingerprint of a dataframe attribute is computed once per object, unless it is replaced or changes shape
+    dataframe = getattr(obj, frame)
+    fingerprints = obj.__dict__.setdefault('_frame_fingerprints', {})
+    shape = None if dataframe is None else dataframe.shape
+
+    cached = fingerprints.get(frame)
+    if cached is None or cached[0] is not dataframe or cached[1] != shape:
+        cached = (dataframe, shape, frame_fingerprint(dataframe))
+        fingerprints[frame] = cached
+
+    return cached[2]
+
+
+def cached_figure(*frames, tables=()):
+    """
+    Decorator for the methods of a visualisation class that return a Plotly figure. The figure is cached by the class,
+    the method, the fingerprint of the given dataframe attributes of the object, the table_version of the given
+    database tables and the arguments of the method. The method must not change the dataframes of the object.
+
+    :param frames: names of the dataframe attributes the figure is made of
+    :param tables: names of the database tables the method reads, e.g. to enrich the dataframes
+    :return: decorator
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = hashlib.sha256(repr((type(self).__name__, method.__name__,
+                                       [_object_fingerprint(self, frame) for frame in frames],
+                                       [table_version(table) for table in tables],
+                                       args, sorted(kwargs.items()))).encode()).hexdigest()
+
+            fig = figure_cache.get(key)
+            if fig is not None:
+                return fig
+
+            fig = method(self, *args, **kwargs)
+            figure_cache.put(key, fig)
+
+            return fig
+
+        return wrapper
+
+    return decorator
@@ -5,6 +5,7 @@ import numpy as np
 from data.service_database import load_datatable_from_db
 from polyline import decode
 from services.backend.barge_route_graphs import RouteCalculator
+from services.backend.utils import HUB_TERMINALS
 
 
 class FinancialItemTypes(Enum):
@@ -90,7 +91,7 @@ class FinancialTransaction:
 
     def __init__(self, data):
         self.data = data
-        self.terminalOperators = ["VNVUTDGML"]
+        self.terminalOperators = list(HUB_TERMINALS)
         self.terminals = load_datatable_from_db("terminals")
         self.barges = load_datatable_from_db("barges")
         self.operators = load_datatable_from_db("operator")
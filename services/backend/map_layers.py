@@ -0,0 +1,177 @@
+""" Static geometry layers of the maps, decoded and simplified once per process and zoom level """
+import threading
+from collections import OrderedDict
+import numpy as np
+import plotly.graph_objects as go
+from polyline import decode
+from services.backend.figure_cache import frame_fingerprint
+
+
+# Encoded polylines of the corridors
+CORRIDORS = {
+    'HCMC CORRIDOR WEST': 'm~e_A_{clS??qi@j[{Fpz@Q|`Akm@nTeoAqUal@nJ????aN`WyIfHsOtEeXTu_@cLeLkDiSyCuGjAiEjKcAjO}BzOwCjHmPdN}PfM}GrLcFbKuBfNkFdIiEzKaDpYwClPqEdTwC`RbA~TcAxGoCzGkFjD??k@rEQ`DyBxDk@pB??sUfo@gV~TuLb^rJpl@}iBpu@ch@rt@aIdPuVpG_Rd_@o[bHuVvPQ~\\vCxY~[tHxDha@fMzKnRzKwJrc@wClb@jFf`@jPzRr^nFtUvX??gC|ZaEfY}GhNoHdMoMhNw[zVuQrIqNhFip@`NaTdIuKzK}QxYmJjUsQdVwV~[iO`]yXxw@??gy@d~@??m_@j`@ws@re@wt@fQag@`@ej@kDw`@cPqp@ka@e}@uu@??zCfw@pEtq@{Fre@??o[pGwf@mEst@gj@{v@nJig@t_AhIn\\b_@bH??rYjAnR`D??`OnGhGlLR|M??JrYQhT????aR~^uUz]e[lIc_@oBk\\kJoWkOkO}t@cOiO_WgM{TqC_X`Cud@lTeRfEcZoJsYw[sA}[~WiNxb@wUtDyVQgUiT}W??eQeC_YJ??}SH',
+    'HCMC CORRIDOR EAST': 'm~e_A_{clS??qi@j[{Fpz@Q|`Akm@nTeoAqUal@nJ????aN`WyIfHsOtEeXTu_@cLeLkDiSyCuGjAiEjKcAjO}BzOwCjHmPdN}PfM}GrLcFbKuBfNkFdIiEzKaDpYwClPqEdTwC`RbA~TcAxGoCzGkFjD??k@rEQ`DyBxDk@pB??sUfo@gV~TuLb^rJpl@}iBpu@ch@rt@aIdPuVpG_Rd_@o[bHuVvPQ~\\vCxY~[tHxDha@fMzKnRzKwJrc@wClb@jFf`@jPzRr^nFtUvX??gC|ZaEfY}GhNoHdMoMhNw[zVuQrIqNhFip@`NaTdIuKzK}QxYmJjUsQdVwV~[iO`]yXxw@??gy@d~@??m_@j`@ws@re@wt@fQag@`@ej@kDw`@cPqp@ka@e}@uu@??q]}i@wYar@qS_^??aUsY????m^ogA??xDqg@|PwZ??`A_o@??Wuf@??c~@mi@cUwn@hEgeAnf@qd@eMut@yu@sAag@p]{c@bA}m@_z@me@ae@i_AnFmbAlq@eaD|wButAnk@kw@lLgpBfJ_k@~J??qNf@??mGT',
+    'HCMC CORRIDOR SOUTH': 'm~e_A_{clS??qi@j[{Fpz@Q|`Akm@nTeoAqUal@nJ????aN`WyIfHsOtEeXTu_@cLeLkDiSyCuGjAiEjKcAjO}BzOwCjHmPdN}PfM}GrLcFbKuBfNkFdIiEzKaDpYwClPqEdTwC`RbA~TcAxGoCzGkFjD??k@rEQ`DyBxDk@pB??sUfo@gV~TuLb^rJpl@}iBpu@ch@rt@aIdPuVpG_Rd_@o[bHuVvPQ~\\vCxY~[tHxDha@fMzKnRzKwJrc@wClb@jFf`@jPzRr^nFtUvX??gC|ZaEfY}GhNoHdMoMhNw[zVuQrIqNhFip@`NaTdIuKzK}QxYmJjUsQdVwV~[iO`]yXxw@??gy@d~@??m_@j`@ws@re@wt@fQag@`@ej@kDw`@cPqp@ka@e}@uu@??q]}i@wYar@qS_^??aUsY'
+}
+
+CORRIDOR_COLORS = {'HCMC CORRIDOR WEST': 'green', 'HCMC CORRIDOR EAST': 'pink', 'HCMC CORRIDOR SOUTH': 'yellow'}
+
+# Geometry closer together than this number of pixels at the zoom level of the map is merged
+SIMPLIFY_PIXELS = 1
+MAX_ZOOM_LEVEL = 22
+
+MAP_LAYER_CACHE_SIZE = 64
+
+_layers = OrderedDict()
+_layers_lock = threading.Lock()
+
+
+def zoom_level(zoom):
+    """
+    :param zoom: zoom of the mapbox map
+    :return: whole zoom level between 0 and MAX_ZOOM_LEVEL, the geometry of a layer is simplified per level
+    """
+
+    return int(np.clip(np.floor(zoom if zoom is not None else MAX_ZOOM_LEVEL), 0, MAX_ZOOM_LEVEL))
+
+
+def map_tolerance(level, pixels=SIMPLIFY_PIXELS):
+    """
+    :return: size in degrees of a number of pixels at a zoom level (256 pixel tiles)
+    """
+
+    return pixels * 360 / (256 * 2 ** level)
+
+
+def simplify_line(points, tolerance):
+    """
+    Simplify a line with the Ramer-Douglas-Peucker algorithm
+
+    :param points: array with a row (latitude, longitude) per point
+    :param tolerance: maximum distance in degrees between the line and the points that are left out
+    :return: array with the points that are kept, the first and last point are always kept
+    """
+
+    if tolerance <= 0 or len(points) < 3:
+        return points
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    sections = [(0, len(points) - 1)]
+    while sections:
+        start, end = sections.pop()
+        if end - start < 2:
+            continue
+
+        chord = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(chord[0], chord[1])
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            farthest += start + 1
+            keep[farthest] = True
+            sections += [(start, farthest), (farthest, end)]
+
+    return points[keep]
+
+
+_corridor_points = {}
+
+
+def corridor_points(name):
+    """
+    :return: array with a row (latitude, longitude) per point of a corridor, decoded once per process
+    """
+
+    points = _corridor_points.get(name)
+    if points is None:
+        points = np.array(decode(CORRIDORS[name]), dtype=float).reshape(-1, 2)
+        _corridor_points[name] = points
+
+    return points
+
+
+def _cached_traces(key, build):
+    # Traces are shared by all sessions, add_traces copies them into a figure so the cached traces don't change
+    with _layers_lock:
+        traces = _layers.get(key)
+        if traces is not None:
+            _layers.move_to_end(key)
+            return traces
+
+    traces = tuple(build())
+
+    with _layers_lock:
+        _layers[key] = traces
+        while len(_layers) > MAP_LAYER_CACHE_SIZE:
+            _layers.popitem(last=False)
+
+    return traces
+
+
+def corridor_traces(zoom):
+    """
+    :param zoom: zoom of the map
+    :return: tuple with a line trace per corridor, simplified for the zoom level
+    """
+
+    level = zoom_level(zoom)
+
+    def build():
+        for name in CORRIDORS:
+            points = simplify_line(corridor_points(name), map_tolerance(level))
+            yield go.Scattermapbox(lat=points[:, 0], lon=points[:, 1], mode='lines',
+                                   line=dict(width=4, color=CORRIDOR_COLORS.get(name, 'yellow')), name=name)
+
+    return _cached_traces(('corridors', level), build)
+
+
+def terminal_traces(terminals, zoom):
+    """
+    :param terminals: dataframe with latitude, longitude and terminal_description
+    :param zoom: zoom of the map
+    :return: tuple with the marker trace of the terminals, terminals within a pixel of each other at the zoom level
+             share a marker that shows all their descriptions
+    """
+
+    level = zoom_level(zoom)
+
+    def build():
+        cell = map_tolerance(level)
+        located = terminals.dropna(subset=['latitude', 'longitude'])
+        markers = located.groupby([np.floor(located['latitude'] / cell), np.floor(located['longitude'] / cell)],
+                                  sort=False) \
+            .agg(latitude=('latitude', 'first'), longitude=('longitude', 'first'),
+                 text=('terminal_description', lambda descriptions: '<br>'.join(descriptions.astype(str))))
+        yield go.Scattermapbox(lat=markers['latitude'], lon=markers['longitude'], mode='markers',
+                               marker=go.scattermapbox.Marker(size=9, color='red'), text=markers['text'],
+                               name='Terminals')
+
+    return _cached_traces(('terminals', frame_fingerprint(terminals), level), build)
+
+
+def port_traces(ports):
+    """
+    :param ports: dataframe with Port, teu, port_latitude and port_longitude
+    :return: tuple with the marker trace of the ports, the size of a marker scales between 20 and 30 with the teu
+    """
+
+    def build():
+        # Scale the size of the markers between 20 and 30 based on min and max values
+        teus_sizes = (ports['teu'] - ports['teu'].min()) / (ports['teu'].max() - ports['teu'].min()) * 10 + 20
+        yield go.Scattermapbox(lat=ports['port_latitude'], lon=ports['port_longitude'], mode='markers',
+                               marker=go.scattermapbox.Marker(size=teus_sizes, color='red', opacity=0.7),
+                               text=ports['Port'] + ' ' + ports['teu'].astype(str) + ' TEU',
+                               name='Ports - TEU offered (size)')
+
+    return _cached_traces(('ports', frame_fingerprint(ports)), build)
+
+
+def clear_map_layers():
+    with _layers_lock:
+        _layers.clear()
@@ -0,0 +1,129 @@
+""" Descriptive profile of a set of container orders, shared by the order charts and the container file analyser """
+import numpy as np
+import pandas as pd
+
+
+# Columns of which the values are counted
+COUNT_COLUMNS = ['containerType', 'teu', 'reefer', 'dangerousGoods', 'loadTerminal', 'dischargeTerminal']
+
+# Time windows: name and the start and end column
+TIME_WINDOWS = {'load': ('loadTimeWindowStart', 'loadTimeWindowEnd'),
+                'discharge': ('dischargeTimeWindowStart', 'dischargeTimeWindowEnd')}
+
+# Columns of which the orders are counted per day
+DAILY_COLUMNS = ['bookingDateCreated', 'loadTimeWindowStart']
+
+WEIGHT_BINS = 10
+
+
+class OrderProfile:
+    """
+    Aggregates of a set of container orders, see profile_orders. Aggregates of columns that aren't in the orders are
+    None or left out of their dictionary.
+
+    :param rows: number of orders
+    :param columns: list with the column names
+    :param filled: series with the number of filled values per column
+    :param duplicates: number of duplicate rows
+    :param counts: dictionary {column: value_counts} of COUNT_COLUMNS
+    :param weight: describe of the weight
+    :param weight_histogram: tuple of the counts and the bin edges of the weight
+    :param window_hours: dictionary {window: series with the duration in hours per order} of TIME_WINDOWS
+    :param daily: dictionary {column: series with the number of orders per day} of DAILY_COLUMNS
+    :param daily_teu: dictionary with the TEU per day of the import (by load day) and export (by discharge day) orders
+    :param dates: sorted list of the days orders are loaded or discharged
+    :param terminal_goods: dataframe with the dangerous goods and reefer containers per load terminal
+    """
+
+    def __init__(self, rows, columns, filled, duplicates, counts, weight=None, weight_histogram=None,
+                 window_hours=None, daily=None, daily_teu=None, dates=None, terminal_goods=None):
+        self.rows = rows
+        self.columns = columns
+        self.filled = filled
+        self.duplicates = duplicates
+        self.counts = counts
+        self.weight = weight
+        self.weight_histogram = weight_histogram
+        self.window_hours = window_hours or {}
+        self.daily = daily or {}
+        self.daily_teu = daily_teu or {}
+        self.dates = dates
+        self.terminal_goods = terminal_goods
+
+    @property
+    def missing(self):
+        """
+        :return: series with the number of missing values per column
+        """
+
+        return self.rows - self.filled
+
+    def window_quantiles(self, window):
+        """
+        :return: describe of the duration in hours of a time window
+        """
+
+        return self.window_hours[window].describe()
+
+
+def profile_orders(dataframe, weight_bins=WEIGHT_BINS):
+    """
+    Compute the aggregates of OrderProfile in one pass over the columns of the orders. Every time column is parsed
+    once.
+
+    :param dataframe: dataframe with a row per container order
+    :param weight_bins: number of bins of the weight histogram
+    :return: OrderProfile object
+    """
+
+    columns = set(dataframe.columns)
+
+    counts = {column: dataframe[column].value_counts() for column in COUNT_COLUMNS if column in columns}
+
+    weight = weight_histogram = None
+    if 'weight' in columns:
+        weights = pd.to_numeric(dataframe['weight'], errors='coerce')
+        weight = weights.describe()
+        weights = weights.dropna().to_numpy()
+        if len(weights):
+            weight_histogram = np.histogram(weights, bins=weight_bins)
+
+    times = {column: pd.to_datetime(dataframe[column]) for column in
+             set(DAILY_COLUMNS + [column for window in TIME_WINDOWS.values() for column in window]) & columns}
+
+    window_hours = {window: ((times[end] - times[start]).dt.total_seconds() / 3600).rename(f'{window}_window_duration')
+                    for window, (start, end) in TIME_WINDOWS.items() if start in times and end in times}
+
+    daily = {column: times[column].dt.date.value_counts().sort_index() for column in DAILY_COLUMNS if column in times}
+
+    daily_teu = {}
+    dates = None
+    if {'loadTimeWindowStart', 'dischargeTimeWindowEnd'} <= set(times):
+        load_days = times['loadTimeWindowStart'].dt.date
+        discharge_days = times['dischargeTimeWindowEnd'].dt.date
+        dates = sorted(pd.concat([load_days, discharge_days]).unique())
+
+        if 'teu' in columns:
+            for direction, days, external_column in [('import', load_days.rename('loadDayStart'), 'loadExternalId'),
+                                                     ('export', discharge_days.rename('dischargeDayEnd'),
+                                                      'dischargeExternalId')]:
+                if external_column in columns:
+                    external = dataframe[external_column] == 1
+                    daily_teu[direction] = dataframe.loc[external, ['teu']].groupby(days[external]).agg({'teu': 'sum'})
+
+    terminal_goods = None
+    if {'loadTerminal', 'dangerousGoods', 'reefer'} <= columns:
+        terminal_goods = dataframe.groupby('loadTerminal')[['dangerousGoods', 'reefer']].sum()
+
+    return OrderProfile(rows=len(dataframe),
+                        columns=list(dataframe.columns),
+                        filled=dataframe.count(),
+                        duplicates=int(dataframe.duplicated().sum()),
+                        counts=counts,
+                        weight=weight,
+                        weight_histogram=weight_histogram,
+                        window_hours=window_hours,
+                        daily=daily,
+                        daily_teu=daily_teu,
+                        dates=dates,
+                        terminal_goods=terminal_goods)
@@ -0,0 +1,255 @@
+""" Change-sets between two PMA payloads, for replanning a session with changed inputs """
+import copy
+import hashlib
+import json
+import zlib
+import services.api_service.pma_poller as pma_poller
+
+
+# Sections of the payload that are lists of records, with the field that identifies a record
+RECORD_KEYS = {'orders': 'containerNumber', 'terminals': 'terminalId', 'vessels': 'id'}
+
+# Lists of records inside the records of a section, e.g. the stops of a vessel
+NESTED_RECORD_KEYS = {'vessels': {'stops': 'lineStopId'}}
+
+
+def full_hash(payload):
+    """
+    Hash of the complete payload, unlike pma_cache.payload_hash the volatile fields are included
+
+    :param payload: dictionary with the payload
+    :return: sha256 hex digest
+    """
+
+    data = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _index(records, key):
+    # None when the key doesn't identify the records, the section is then replaced as a whole
+    if not all(isinstance(record, dict) and key in record for record in records):
+        return None
+    indexed = {record[key]: record for record in records}
+
+    return indexed if len(indexed) == len(records) else None
+
+
+def _diff_records(previous, current, key, nested=None):
+    """
+    Change-set of two lists of records
+
+    :return: dictionary with added (records), removed (keys), changed (patches) and sequence (keys, only when the
+             order of the records isn't the order apply gives them). None when the key doesn't identify the records.
+    """
+
+    nested = nested or {}
+    previous_index = _index(previous, key)
+    current_index = _index(current, key)
+    if previous_index is None or current_index is None:
+        return None
+
+    added = [record for identifier, record in current_index.items() if identifier not in previous_index]
+    removed = [identifier for identifier in previous_index if identifier not in current_index]
+
+    changed = []
+    for identifier, record in current_index.items():
+        old = previous_index.get(identifier)
+        if old is None or old == record:
+            continue
+
+        patch = {'key': identifier, 'set': {}, 'unset': [field for field in old if field not in record]}
+        for field, value in record.items():
+            if field in old and old[field] == value:
+                continue
+            nested_delta = None
+            if field in nested and isinstance(value, list) and isinstance(old.get(field), list):
+                nested_delta = _diff_records(old[field], value, nested[field])
+            if nested_delta is not None:
+                patch.setdefault('records', {})[field] = nested_delta
+            else:
+                patch['set'][field] = value
+        changed.append(patch)
+
+    delta = {'added': added, 'removed': removed, 'changed': changed}
+
+    # apply keeps the order of the previous records and appends the added records
+    applied_order = [identifier for identifier in previous_index if identifier in current_index] + \
+                    [record[key] for record in added]
+    if applied_order != list(current_index):
+        delta['sequence'] = list(current_index)
+
+    return delta
+
+
+def _apply_records(previous, delta, key, nested=None):
+    nested = nested or {}
+    removed = set(delta['removed'])
+    records = {record[key]: copy.deepcopy(record) for record in previous if record[key] not in removed}
+
+    for patch in delta['changed']:
+        record = records[patch['key']]
+        for field in patch['unset']:
+            record.pop(field, None)
+        record.update(copy.deepcopy(patch['set']))
+        for field, nested_delta in patch.get('records', {}).items():
+            record[field] = _apply_records(record[field], nested_delta, nested[field])
+
+    for record in delta['added']:
+        records[record[key]] = copy.deepcopy(record)
+
+    if 'sequence' in delta:
+        return [records[identifier] for identifier in delta['sequence']]
+
+    return list(records.values())
+
+
+def diff_payload(previous, current):
+    """
+    Change-set that turns the previous payload into the current one. The record sections (see RECORD_KEYS) are
+    compared per record: added and removed records, and the changed fields of the other records. The stops of a
+    changed vessel are compared per stop. All other fields are only part of the change-set when they changed.
+
+    :param previous: dictionary with the last submitted payload
+    :param current: dictionary with the new payload
+    :return: dictionary with base_hash and hash (see full_hash), fields (changed fields), removed_fields and records
+             (change-set per record section)
+    """
+
+    delta = {'base_hash': full_hash(previous), 'hash': full_hash(current), 'fields': {},
+             'removed_fields': [field for field in previous if field not in current], 'records': {}}
+
+    for field, value in current.items():
+        if field in previous and previous[field] == value:
+            continue
+
+        records_delta = None
+        if field in RECORD_KEYS and isinstance(value, list) and isinstance(previous.get(field), list):
+            records_delta = _diff_records(previous[field], value, RECORD_KEYS[field], NESTED_RECORD_KEYS.get(field))
+        if records_delta is not None:
+            delta['records'][field] = records_delta
+        else:
+            delta['fields'][field] = value
+
+    return delta
+
+
+def apply_delta(previous, delta, verify=True):
+    """
+    Reconstruct the payload of a change-set of diff_payload
+
+    :param previous: dictionary with the payload the change-set was made against
+    :param delta: change-set of diff_payload
+    :param verify: check the hashes of the previous and the reconstructed payload
+    :return: dictionary with the reconstructed payload
+    """
+
+    if verify and full_hash(previous) != delta['base_hash']:
+        raise ValueError("The change-set wasn't made against this payload")
+
+    # The record sections of the change-set are copied per record by _apply_records
+    payload = {field: value if field in delta['records'] else copy.deepcopy(value)
+               for field, value in previous.items() if field not in delta['removed_fields']}
+    payload.update(copy.deepcopy(delta['fields']))
+    for field, records_delta in delta['records'].items():
+        payload[field] = _apply_records(payload[field], records_delta, RECORD_KEYS[field],
+                                        NESTED_RECORD_KEYS.get(field))
+
+    if verify and full_hash(payload) != delta['hash']:
+        raise ValueError("The reconstructed payload differs from the payload of the change-set")
+
+    return payload
+
+
+def stable_order_ids(container_numbers, booking_references):
+    """
+    Order ids that follow from the orders only: an order is identified by its container number and booking, like the
+    container_orders table, and its id is a checksum of them. The same orders get the same ids in every session, so
+    identical requests have the same payload_hash (see pma_cache), and an order keeps its id when other orders are
+    added or removed. When the same container is in the orders twice, the second one gets the id of its occurrence;
+    the rare checksums that collide are resolved in the sorted order of the orders, so the ids stay unique.
+
+    :param container_numbers: container numbers of the orders, in their order
+    :param booking_references: booking references of the orders, in the same order
+    :return: list with an order id per order, positive 31 bit integers
+    """
+
+    # The booking is compared as text, the payload holds it as text
+    keys = []
+    occurrences = {}
+    for container_number, booking_reference in zip(container_numbers, booking_references):
+        key = f"{container_number}|{booking_reference}"
+        occurrences[key] = occurrences.get(key, -1) + 1
+        keys.append(f"{key}|{occurrences[key]}" if occurrences[key] else key)
+
+    ids = {}
+    used_ids = set()
+    for key in sorted(keys):
+        order_id, attempt = None, 0
+        while order_id is None or order_id in used_ids:
+            order_id = zlib.crc32(f"{key}#{attempt}".encode() if attempt else key.encode()) % (2 ** 31 - 1) + 1
+            attempt += 1
+        used_ids.add(order_id)
+        ids[key] = order_id
+
+    return [ids[key] for key in keys]
+
+
+def summarise_delta(delta):
+    """
+    :return: dictionary with the number of added, removed and changed records per record section, the changed
+             fields and the size of the change-set in bytes
+    """
+
+    summary = {'fields': sorted(delta['fields']),
+               'bytes': len(json.dumps(delta, separators=(',', ':')).encode())}
+    for field, records_delta in delta['records'].items():
+        summary[field] = {'added': len(records_delta['added']), 'removed': len(records_delta['removed']),
+                          'changed': len(records_delta['changed'])}
+
+    return summary
+
+
+def _connect():
+    connection = pma_poller._connect()
+    connection.execute("CREATE TABLE IF NOT EXISTS pma_session_payloads ("
+                       "session_id TEXT PRIMARY KEY, payload BLOB, payload_hash TEXT, submitted_on TEXT)")
+
+    return connection
+
+
+def store_session_payload(session_id, payload):
+    """
+    Store the payload that was submitted last in a planning session, compressed in the pma_session_payloads table
+
+    :param session_id: id of the planning session
+    :param payload: dictionary with the payload
+    :return: None
+    """
+
+    compressed = zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), 6)
+
+    connection = _connect()
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO pma_session_payloads (session_id, payload, payload_hash, "
+                           "submitted_on) VALUES (?, ?, ?, datetime('now'))",
+                           (session_id, compressed, full_hash(payload)))
+    connection.close()
+
+
+def load_session_payload(session_id):
+    """
+    :param session_id: id of the planning session
+    :return: dictionary with the payload that was submitted last in the session, None when nothing was submitted
+    """
+
+    connection = _connect()
+    row = connection.execute("SELECT payload FROM pma_session_payloads WHERE session_id = ?",
+                             (session_id,)).fetchone()
+    connection.close()
+
+    if row is None:
+        return None
+
+    return json.loads(zlib.decompress(row[0]))
+
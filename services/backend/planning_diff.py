@@ -0,0 +1,163 @@
+""" Compare two PMA plannings, e.g. before and after changing the restrictions """
+import numpy as np
+import pandas as pd
+
+
+CONTAINER_COLUMNS = ['container_number', 'planned', 'barge_call_sign', 'load_terminal_id', 'load_date_time',
+                     'discharge_terminal_id', 'discharge_date_time']
+
+# Fields of a call that are compared when the same call is in both plannings
+CALL_FIELDS = ['start_date_time', 'end_date_time', 'teu_loaded', 'teu_discharged']
+
+
+def _calls(planning):
+    if planning.dataframe_calls is None:
+        planning.extract_calls()
+
+    calls = planning.dataframe_calls
+    calls = calls.assign(teu_loaded=calls['load_20'] + 2 * calls['load_40'] + 2.25 * calls['load_45'],
+                         teu_discharged=calls['discharge_20'] + 2 * calls['discharge_40'] + 2.25 * calls['discharge_45'])
+
+    return calls
+
+
+def container_assignments(planning):
+    """
+    The barge and the load and discharge call of every order of a planning
+
+    :param planning: ExtractPmaPlanning object
+    :return: dataframe with a row per container and the columns of CONTAINER_COLUMNS, containers that aren't loaded
+             by a call have planned False
+    """
+
+    calls = _calls(planning)
+    orders = pd.DataFrame(planning.json["orders"], columns=['orderId', 'containerNumber'])
+
+    moves = {}
+    for direction, column in [('load', 'load_orders'), ('discharge', 'discharge_orders')]:
+        move = calls[['barge_call_sign', 'terminal_id', 'start_date_time', column]].explode(column)
+        move = move.dropna(subset=[column]).rename(columns={column: 'orderId',
+                                                            'terminal_id': f'{direction}_terminal_id',
+                                                            'start_date_time': f'{direction}_date_time'})
+        move['orderId'] = move['orderId'].astype('int64')
+        moves[direction] = move.drop_duplicates('orderId')
+
+    containers = orders.astype({'orderId': 'int64'}) \
+        .merge(moves['load'], on='orderId', how='left') \
+        .merge(moves['discharge'].drop(columns='barge_call_sign'), on='orderId', how='left')
+    containers['planned'] = containers['barge_call_sign'].notna()
+
+    return containers.rename(columns={'containerNumber': 'container_number'})[CONTAINER_COLUMNS] \
+        .drop_duplicates('container_number')
+
+
+def diff_containers(before, after):
+    """
+    Align the containers of two plannings on their container number
+
+    :param before: dataframe of container_assignments of the first planning
+    :param after: dataframe of container_assignments of the second planning
+    :return: dataframe with the columns of both plannings (suffixes _before and _after) and change: added or removed
+             (the container is only in one planning), planned or unplanned (only one planning carries it),
+             reassigned (another barge), rescheduled (same barge, other calls) or unchanged
+    """
+
+    containers = before.merge(after, on='container_number', how='outer', suffixes=('_before', '_after'),
+                              indicator=True)
+    planned_before = containers['planned_before'].fillna(False).astype(bool)
+    planned_after = containers['planned_after'].fillna(False).astype(bool)
+
+    calls_changed = np.zeros(len(containers), dtype=bool)
+    for column in ['load_terminal_id', 'load_date_time', 'discharge_terminal_id', 'discharge_date_time']:
+        values_before = containers[f'{column}_before']
+        values_after = containers[f'{column}_after']
+        calls_changed |= ~((values_before == values_after) | (values_before.isna() & values_after.isna())).to_numpy()
+
+    containers['change'] = np.select(
+        [containers['_merge'] == 'left_only',
+         containers['_merge'] == 'right_only',
+         ~planned_before & planned_after,
+         planned_before & ~planned_after,
+         planned_before & planned_after & (containers['barge_call_sign_before'] != containers['barge_call_sign_after']),
+         planned_before & planned_after & calls_changed],
+        ['removed', 'added', 'planned', 'unplanned', 'reassigned', 'rescheduled'],
+        default='unchanged')
+
+    return containers.drop(columns='_merge')
+
+
+def diff_calls(before, after):
+    """
+    Align the calls of two plannings on barge, terminal and the number of the visit of the barge to the terminal
+
+    :param before: dataframe with the calls of the first planning
+    :param after: dataframe with the calls of the second planning
+    :return: dataframe with the fields of CALL_FIELDS of both plannings (suffixes _before and _after) and change:
+             added, removed, changed or unchanged
+    """
+
+    keys = ['barge_call_sign', 'terminal_id', 'visit']
+    aligned = []
+    for calls in [before, after]:
+        calls = calls[['barge_call_sign', 'terminal_id'] + CALL_FIELDS].copy()
+        calls['visit'] = calls.groupby(['barge_call_sign', 'terminal_id']).cumcount() + 1
+        aligned.append(calls)
+
+    calls = aligned[0].merge(aligned[1], on=keys, how='outer', suffixes=('_before', '_after'), indicator=True)
+
+    changed = np.zeros(len(calls), dtype=bool)
+    for field in CALL_FIELDS:
+        changed |= (calls[f'{field}_before'] != calls[f'{field}_after']).to_numpy()
+
+    calls['change'] = np.select([calls['_merge'] == 'left_only', calls['_merge'] == 'right_only', changed],
+                                ['removed', 'added', 'changed'], default='unchanged')
+
+    return calls.drop(columns='_merge')
+
+
+def diff_sequences(before, after):
+    """
+    Compare the order of the terminals every barge calls at
+
+    :return: dataframe with barge_call_sign, sequence_before, sequence_after and changed
+    """
+
+    sequences = [calls.groupby('barge_call_sign', sort=False)['terminal_id'].agg(' > '.join).rename(name)
+                 for calls, name in [(before, 'sequence_before'), (after, 'sequence_after')]]
+    sequences = pd.concat(sequences, axis=1).rename_axis('barge_call_sign').reset_index()
+    sequences['changed'] = sequences['sequence_before'].fillna('') != sequences['sequence_after'].fillna('')
+
+    return sequences
+
+
+def diff_kpis(before, after, terminal_positions=None):
+    """
+    :return: dataframe with the KPIs of ExtractPmaPlanning.calculate_kpis of both plannings and their difference
+    """
+
+    kpis = pd.DataFrame({'before': pd.Series(before.calculate_kpis(terminal_positions), dtype=float),
+                         'after': pd.Series(after.calculate_kpis(terminal_positions), dtype=float)})
+    kpis['delta'] = kpis['after'] - kpis['before']
+
+    return kpis.rename_axis('kpi').reset_index()
+
+
+def diff_plannings(before, after, terminal_positions=None):
+    """
+    Compare two plannings: the containers are aligned on their container number, the calls on barge and terminal.
+
+    :param before: ExtractPmaPlanning object of the first planning
+    :param after: ExtractPmaPlanning object of the second planning
+    :param terminal_positions: dictionary {terminalId: (latitude, longitude)} to compare the distance, see
+                               ExtractPmaPlanning.calculate_kpis
+    :return: dictionary with the dataframes of diff_containers (containers), diff_calls (calls), diff_sequences
+             (sequences) and diff_kpis (kpis)
+    """
+
+    calls_before = _calls(before)
+    calls_after = _calls(after)
+
+    return {'containers': diff_containers(container_assignments(before), container_assignments(after)),
+            'calls': diff_calls(calls_before, calls_after),
+            'sequences': diff_sequences(calls_before, calls_after),
+            'kpis': diff_kpis(before, after, terminal_positions)}
@@ -0,0 +1,112 @@
+""" Attach the barge names and terminal coordinates to the calls, transit and occupancy of a planning """
+import numpy as np
+import pandas as pd
+from data.service_database import load_query_from_db
+
+
+# The dimension tables are memoised by load_query_from_db until the barges or terminals are written
+BARGE_QUERY = "SELECT barge_id, call_sign, name FROM barges ORDER BY barge_id"
+TERMINAL_QUERY = "SELECT code, terminal_code, latitude, longitude FROM terminals ORDER BY code"
+
+SEGMENT_COLUMNS = ['barge_id', 'name', 'leg', 'origin_terminal_id', 'destination_terminal_id', 'departure',
+                   'arrival', 'teu_on_board', 'origin_latitude', 'origin_longitude', 'destination_latitude',
+                   'destination_longitude']
+
+
+def barge_dimension(database="data/demo.db"):
+    """
+    :return: dataframe with barge_id, call_sign and name of every barge
+    """
+
+    return load_query_from_db(BARGE_QUERY, database=database).drop_duplicates('barge_id')
+
+
+def terminal_dimension(database="data/demo.db"):
+    """
+    :return: dataframe with the code (unlocode and terminal code, the terminal id of PMA), terminal_code, latitude and
+             longitude of every terminal
+    """
+
+    return load_query_from_db(TERMINAL_QUERY, database=database).dropna(subset=['code']).drop_duplicates('code')
+
+
+def _positions(keys, dimension_keys):
+    # Position of every key in the dimension table, -1 for keys that aren't in it. The categories are the keys of the
+    # dimension table, so the codes of the categorical are the row numbers.
+    return pd.Categorical(keys, categories=dimension_keys).codes
+
+
+def _take(dimension, column, positions):
+    # Values of a column of the dimension table at the positions, NaN for the positions -1
+    return pd.api.extensions.take(dimension[column].to_numpy(), positions, allow_fill=True)
+
+
+def _attach(dataframe, dimension, key, dimension_key, columns):
+    if dataframe is None:
+        return None
+
+    dataframe = pd.DataFrame(dataframe)
+    if dataframe.empty or key not in dataframe.columns:
+        return dataframe.assign(**{column: pd.Series(dtype=dimension[column].dtype) for column in columns})
+
+    positions = _positions(dataframe[key], dimension[dimension_key])
+
+    return dataframe.assign(**{column: _take(dimension, column, positions) for column in columns})
+
+
+def route_segments(calls):
+    """
+    The legs of the barges between two consecutive calls, in the order of the calls of each barge
+
+    :param calls: dataframe with the calls of enrich_planning
+    :return: dataframe with the columns of SEGMENT_COLUMNS, the teu on board is the load of the barge during the leg
+    """
+
+    if calls is None or calls.empty:
+        return pd.DataFrame(columns=SEGMENT_COLUMNS)
+
+    barges = calls.groupby('barge_id', sort=False)
+    following = barges[['terminal_id', 'start_date_time', 'latitude', 'longitude']].shift(-1)
+
+    segments = pd.DataFrame({'barge_id': calls['barge_id'],
+                             'name': calls['name'],
+                             'leg': barges.cumcount() + 1,
+                             'origin_terminal_id': calls['terminal_id'],
+                             'destination_terminal_id': following['terminal_id'],
+                             'departure': calls['end_date_time'],
+                             'arrival': following['start_date_time'],
+                             'teu_on_board': calls['teu_on_board'] if 'teu_on_board' in calls.columns else np.nan,
+                             'origin_latitude': calls['latitude'],
+                             'origin_longitude': calls['longitude'],
+                             'destination_latitude': following['latitude'],
+                             'destination_longitude': following['longitude']})
+
+    # The last call of a barge doesn't start a leg
+    return segments[following['terminal_id'].notna()].reset_index(drop=True)
+
+
+def enrich_planning(calls, transit, occupancy, database="data/demo.db"):
+    """
+    Add the barge names and the terminal coordinates to the dataframes of a planning in one pass. The keys are joined
+    as categoricals on the dimension tables of barge_dimension and terminal_dimension, so the dataframes keep their
+    rows and order and the columns are replaced when a dataframe is enriched again. The given dataframes aren't changed.
+
+    :param calls: dataframe with the calls of ExtractPmaPlanning, name, latitude and longitude are added
+    :param transit: dataframe with the transit events, name, terminal_code, latitude and longitude are added
+    :param occupancy: dataframe with the occupancy timeline, name is added
+    :param database: path of the database
+    :return: dictionary with the enriched calls, transit and occupancy and the route_segments of the calls
+    """
+
+    barges = barge_dimension(database)
+    terminals = terminal_dimension(database)
+
+    calls = _attach(calls, barges, 'barge_id', 'barge_id', ['name'])
+    calls = _attach(calls, terminals, 'terminal_id', 'code', ['latitude', 'longitude'])
+
+    transit = _attach(transit, barges, 'barge_id', 'barge_id', ['name'])
+    transit = _attach(transit, terminals, 'transit_location_id', 'code', ['terminal_code', 'latitude', 'longitude'])
+
+    occupancy = _attach(occupancy, barges, 'barge_id', 'barge_id', ['name'])
+
+    return {'calls': calls, 'transit': transit, 'occupancy': occupancy, 'route_segments': route_segments(calls)}
@@ -0,0 +1,327 @@
+""" Background jobs for creating and analysing PMA plannings """
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import pandas as pd
+from data.service_database import connect_database
+from services.api_service.api_pma import get_pma_result
+from services.api_service.pma_cache import cached_push_pma_request
+from services.api_service.pma_poller import pma_poller, load_pma_result, store_pma_result
+from services.backend.extract_planning import ExtractPmaPlanning
+from services.backend.payload_delta import store_session_payload, summarise_delta
+from services.backend.planning_sweep import run_planning_sweep
+from services.backend.transform_orders import TransformToPMA
+
+
+# Final stage of a planning job that reused the planning of an identical request, no email is sent for it
+REUSED_STAGE = "Completed with the planning of an identical request"
+
+# Jobs run in threads, the work is mostly waiting on the PMA API
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='planning_job')
+
+# Analysed plannings of completed jobs, least recently used first
+_results = OrderedDict()
+_results_lock = threading.Lock()
+MAX_CACHED_RESULTS = 8
+
+_table_lock = threading.Lock()
+_table_ready = False
+
+
+def _connect():
+    global _table_ready
+
+    connection = connect_database()
+
+    with _table_lock:
+        if not _table_ready:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS planning_jobs ("
+                                   "job_id TEXT PRIMARY KEY, job_type TEXT, status TEXT, stage TEXT, progress REAL, "
+                                   "pma_key TEXT, error TEXT, created_on TEXT, updated_on TEXT)")
+                # Jobs of a previous server process won't finish anymore
+                connection.execute("UPDATE planning_jobs SET status = 'failed', error = 'Interrupted by a restart', "
+                                   "updated_on = datetime('now') WHERE status IN ('queued', 'running')")
+            _table_ready = True
+
+    return connection
+
+
+def _update_job(job_id, **fields):
+    columns = ', '.join(f'{column} = ?' for column in fields)
+
+    connection = _connect()
+    with connection:
+        connection.execute(f"UPDATE planning_jobs SET {columns}, updated_on = datetime('now') WHERE job_id = ?",
+                           (*fields.values(), job_id))
+    connection.close()
+
+
+def _create_job(job_type):
+    job_id = uuid.uuid4().hex
+
+    connection = _connect()
+    with connection:
+        connection.execute("INSERT INTO planning_jobs (job_id, job_type, status, stage, progress, created_on, updated_on) "
+                           "VALUES (?, ?, 'queued', 'Waiting for a worker', 0, datetime('now'), datetime('now'))",
+                           (job_id, job_type))
+    connection.close()
+
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Retrieve the state of a job
+
+    :param job_id: id returned by one of the submit functions
+    :return: dictionary with job_id, job_type, status (queued, running, completed or failed), stage, progress (0 - 1),
+             pma_key, error, created_on and updated_on. None when the job doesn't exist.
+    """
+
+    connection = _connect()
+    row = connection.execute("SELECT job_id, job_type, status, stage, progress, pma_key, error, created_on, updated_on "
+                             "FROM planning_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    connection.close()
+
+    if row is None:
+        return None
+
+    return dict(zip(['job_id', 'job_type', 'status', 'stage', 'progress', 'pma_key', 'error', 'created_on',
+                     'updated_on'], row))
+
+
+def analyse_planning(planning_json):
+    """
+    Analyse a planning of the PMA API like the Planning page shows it
+
+    :param planning_json: output of the PMA API
+    :return: dictionary with the ExtractPmaPlanning object (planning) and the calls and transit dataframes
+    """
+
+    planning = ExtractPmaPlanning(json=planning_json)
+    planning.extract_calls()
+    planning.extract_containers()
+
+    calls = planning.dataframe_calls.copy()
+    calls['teu_loaded'] = calls['load_20'] + 2 * calls['load_40'] + 2.25 * calls['load_45']
+    calls['teu_discharged'] = calls['discharge_20'] + 2 * calls['discharge_40'] + 2.25 * calls['discharge_45']
+
+    transit = planning.dataframe_transit.copy()
+
+    return {'planning': planning, 'calls': calls, 'transit': transit}
+
+
+def _cache_result(job_id, result):
+    with _results_lock:
+        _results[job_id] = result
+        _results.move_to_end(job_id)
+        while len(_results) > MAX_CACHED_RESULTS:
+            _results.popitem(last=False)
+
+
+def _download_planning(pma_key):
+    # The output of a finished planning, None when the PMA API doesn't answer with it
+    try:
+        response = get_pma_result(pma_key)
+        output = response.json() if response is not None and response.status_code == 200 else None
+    except Exception as e:
+        print(f"The planning {pma_key} could not be downloaded again: {e}")
+        return None
+
+    return output if isinstance(output, dict) and "routes" in output else None
+
+
+def get_job_result(job_id):
+    """
+    Retrieve the analysed planning of a completed job. Results are kept in memory per job id, after a restart they
+    are analysed again from the planning in the local result store. A planning that the PMA cache evicted from the
+    store is downloaded again, but not stored, so the store stays within the bound of the cache.
+
+    :return: dictionary of analyse_planning, for sweep jobs the dataframe of run_planning_sweep. None when the job
+             hasn't completed.
+    """
+
+    with _results_lock:
+        if job_id in _results:
+            _results.move_to_end(job_id)
+            return _results[job_id]
+
+    job = get_job(job_id)
+    if job is None or job['status'] != 'completed':
+        return None
+
+    planning_json = load_pma_result(job['pma_key'] or job_id)
+    if planning_json is None and job['pma_key'] is not None:
+        planning_json = _download_planning(job['pma_key'])
+    if planning_json is None:
+        return None
+
+    if job['job_type'] == 'sweep':
+        result = pd.DataFrame.from_records(planning_json['scenarios'])
+    else:
+        result = analyse_planning(planning_json)
+    _cache_result(job_id, result)
+
+    return result
+
+
+def _wait_for_planning(job_id, pma_key, poll_interval, timeout):
+    """
+    Wait for the poller to retrieve the output of the planning.
+    """
+
+    future = pma_poller.track(pma_key)
+
+    started = time.monotonic()
+    while True:
+        try:
+            return future.result(poll_interval)
+        except FutureTimeoutError:
+            pass
+
+        waited = time.monotonic() - started
+        if waited > timeout:
+            raise TimeoutError(f"The planning {pma_key} wasn't finished after {round(timeout / 60)} minutes")
+
+        _update_job(job_id, stage=f"Waiting for the planning ({round(waited / 60)} min)",
+                    progress=0.3 + 0.5 * waited / timeout)
+
+
+def _finish_job(job_id, planning_json, pma_key=None, stage="Completed"):
+    _update_job(job_id, stage="Analysing the planning", progress=0.9)
+    result = analyse_planning(planning_json)
+    _cache_result(job_id, result)
+
+    # Plannings of the PMA API are stored by the poller, uploaded plannings are stored under the job id
+    if pma_key is None:
+        store_pma_result(job_id, planning_json)
+    _update_job(job_id, status='completed', stage=stage, progress=1)
+
+
+def _describe_delta(delta):
+    if delta is None:
+        return "Sharing the planning request"
+
+    summary = summarise_delta(delta)
+    changes = [f"{summary[section][change]} {section} {change}" for section in ('orders', 'vessels', 'terminals')
+               if section in summary for change in ('added', 'removed', 'changed') if summary[section][change]]
+
+    return f"Sharing the planning request ({', '.join(changes) or 'no changed orders, vessels or terminals'})"
+
+
+def _run_planning_job(job_id, transform_arguments, poll_interval, timeout, use_cache, session_id):
+    try:
+        _update_job(job_id, status='running', stage="Creating the payload", progress=0.1)
+        pln_trnsfrm = TransformToPMA(**transform_arguments)
+
+        # Replanning: describe the changes since the last request of the session
+        delta = None
+        if session_id is not None:
+            delta = pln_trnsfrm.execute_create_delta(session_id)
+            if delta is not None:
+                print(f"Changes since the last planning request: {summarise_delta(delta)}")
+        else:
+            pln_trnsfrm.execute_create_json()
+
+        _update_job(job_id, stage=_describe_delta(delta), progress=0.2)
+        payload = json.loads(pln_trnsfrm.json)
+        pma_key, cached = cached_push_pma_request(payload, bypass=not use_cache)
+        if type(pma_key) == int:
+            raise RuntimeError("The algorithm service needs to start up. Please try again after 5 minutes")
+        if session_id is not None:
+            store_session_payload(session_id, payload)
+        _update_job(job_id, pma_key=pma_key, progress=0.3,
+                    stage="Reusing the planning of an identical request" if cached else "Waiting for the planning")
+
+        _finish_job(job_id, _wait_for_planning(job_id, pma_key, poll_interval, timeout), pma_key,
+                    stage=REUSED_STAGE if cached else "Completed")
+    except Exception as e:
+        _update_job(job_id, status='failed', stage="Failed", error=str(e))
+
+
+def _run_analysis_job(job_id, planning_json, pma_key, poll_interval, timeout):
+    try:
+        _update_job(job_id, status='running', stage="Retrieving the planning", progress=0.1)
+        if planning_json is None:
+            _update_job(job_id, pma_key=pma_key)
+            planning_json = _wait_for_planning(job_id, pma_key, poll_interval, timeout)
+
+        _finish_job(job_id, planning_json, pma_key)
+    except Exception as e:
+        _update_job(job_id, status='failed', stage="Failed", error=str(e))
+
+
+def _run_sweep_job(job_id, transform_arguments, scenarios, max_workers, timeout, use_cache):
+    try:
+        _update_job(job_id, status='running', stage=f"Planning {len(scenarios)} scenarios", progress=0.1)
+        ranking = run_planning_sweep(transform_arguments, scenarios, max_workers=max_workers, timeout=timeout,
+                                     use_cache=use_cache,
+                                     progress=lambda finished: _update_job(job_id, progress=0.1 + 0.9 * finished))
+
+        _cache_result(job_id, ranking)
+        # The ranking is stored under the job id, the plannings of the scenarios under their PMA key
+        store_pma_result(job_id, {"scenarios": json.loads(ranking.to_json(orient='records'))})
+        _update_job(job_id, status='completed', stage="Completed", progress=1)
+    except Exception as e:
+        _update_job(job_id, status='failed', stage="Failed", error=str(e))
+
+
+def submit_planning_job(transform_arguments, poll_interval=2, timeout=30 * 60, use_cache=True, session_id=None):
+    """
+    Create the PMA payload, share it with the PMA API, wait for the planning and analyse it in the background
+
+    :param transform_arguments: dictionary with the keyword arguments of TransformToPMA
+    :param poll_interval: seconds between updates of the job progress while waiting for the planning
+    :param timeout: seconds to wait for the planning
+    :param use_cache: reuse the planning of an identical earlier request, see pma_cache
+    :param session_id: id of the planning session, the changes since its last request are reported (see
+                       payload_delta)
+    :return: job id
+    """
+
+    job_id = _create_job('planning')
+    _executor.submit(_run_planning_job, job_id, transform_arguments, poll_interval, timeout, use_cache, session_id)
+
+    return job_id
+
+
+def submit_analysis_job(planning_json=None, pma_key=None, poll_interval=2, timeout=30 * 60):
+    """
+    Analyse a planning in the background, either an uploaded planning or the planning of a PMA key
+
+    :param planning_json: output of the PMA API
+    :param pma_key: key of the planning, used when no planning_json is given
+    :return: job id
+    """
+
+    if planning_json is None and pma_key is None:
+        raise ValueError("Provide a planning or the key of a planning")
+
+    job_id = _create_job('analysis')
+    _executor.submit(_run_analysis_job, job_id, planning_json, pma_key, poll_interval, timeout)
+
+    return job_id
+
+
+def submit_sweep_job(transform_arguments, scenarios, max_workers=4, timeout=30 * 60, use_cache=True):
+    """
+    Plan every scenario of restrictions with the PMA API and rank them in the background, see run_planning_sweep
+
+    :param transform_arguments: dictionary with the keyword arguments of TransformToPMA, without restrictions
+    :param scenarios: list of restriction dictionaries, see sweep_scenarios
+    :param max_workers: maximum number of plannings that run at the same time
+    :param use_cache: reuse the plannings of identical earlier requests, see pma_cache
+    :return: job id
+    """
+
+    if not scenarios:
+        raise ValueError("Provide at least one scenario")
+
+    job_id = _create_job('sweep')
+    _executor.submit(_run_sweep_job, job_id, transform_arguments, scenarios, max_workers, timeout, use_cache)
+
+    return job_id
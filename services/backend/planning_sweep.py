@@ -0,0 +1,125 @@
+""" Parameter sweep over the restrictions of a PMA planning """
+import itertools
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from services.api_service.pma_cache import cached_push_pma_request, payload_hash
+from services.api_service.pma_poller import pma_poller
+from services.backend.extract_planning import ExtractPmaPlanning
+from services.backend.transform_orders import TransformToPMA
+
+
+# KPIs of the Pareto ranking, True when higher is better
+PARETO_OBJECTIVES = {"fleet_utilisation": True, "unplanned_containers": False, "distance_km": False}
+
+
+def sweep_scenarios(penalize_distance=(1,), penalize_unplanned=(1,), number_of_iterations=(10,)):
+    """
+    Every combination of the given restriction values
+
+    :return: list of restriction dictionaries like the Planning page creates them
+    """
+
+    return [{"penalize_distance": distance, "penalize_unplanned": unplanned, "number_of_iterations": iterations}
+            for distance, unplanned, iterations in itertools.product(penalize_distance, penalize_unplanned,
+                                                                     number_of_iterations)]
+
+
+def pareto_ranks(kpis, objectives=None):
+    """
+    Rank the scenarios by non-dominated sorting: rank 1 are the scenarios no other scenario beats on every objective,
+    rank 2 the scenarios that are only beaten by rank 1, and so on.
+
+    :param kpis: dataframe with a column per objective
+    :param objectives: dictionary {column: higher_is_better}, by default PARETO_OBJECTIVES
+    :return: series with the rank per scenario
+    """
+
+    objectives = PARETO_OBJECTIVES if objectives is None else objectives
+
+    # Minimise every objective, missing values count as the worst value
+    values = np.column_stack([(-1 if higher else 1) * kpis[column].astype(float).fillna(-np.inf if higher else np.inf)
+                              for column, higher in objectives.items()])
+
+    # dominates[i, j]: scenario i is at least as good on every objective and better on one
+    at_least_as_good = (values[:, None, :] <= values[None, :, :]).all(axis=2)
+    better = (values[:, None, :] < values[None, :, :]).any(axis=2)
+    dominates = at_least_as_good & better
+
+    ranks = np.zeros(len(kpis), dtype=int)
+    remaining = np.ones(len(kpis), dtype=bool)
+    rank = 1
+    while remaining.any():
+        # A scenario is in the front when no remaining scenario dominates it
+        front = remaining.copy()
+        front[remaining] = ~dominates[np.ix_(remaining, remaining)].any(axis=0)
+        ranks[front] = rank
+        remaining &= ~front
+        rank += 1
+
+    return pd.Series(ranks, index=kpis.index, name='pareto_rank')
+
+
+def run_planning_sweep(transform_arguments, scenarios, max_workers=4, timeout=30 * 60, progress=None,
+                       use_cache=True):
+    """
+    Plan every scenario with the PMA API. The payload is created once, the scenarios only change its restriction
+    fields. Scenarios with the same payload_hash (e.g. only penalize_distance differs, which has no field in the
+    payload) are submitted once. At most max_workers plannings are submitted and awaited at the same time.
+
+    :param transform_arguments: dictionary with the keyword arguments of TransformToPMA, without restrictions
+    :param scenarios: list of restriction dictionaries, see sweep_scenarios
+    :param progress: optional function that is called with the fraction of finished plannings
+    :param use_cache: reuse the plannings of identical earlier requests, see pma_cache
+    :return: dataframe with a row per scenario: the restrictions, pma_key, error, the KPIs of
+             ExtractPmaPlanning.calculate_kpis and the pareto_rank, sorted on the ranking
+    """
+
+    pln_trnsfrm = TransformToPMA(**transform_arguments, restrictions=scenarios[0])
+    pln_trnsfrm.execute_create_json()
+    payload = json.loads(pln_trnsfrm.json)
+
+    terminal_positions = {terminal["terminalId"]: (terminal["position"]["latitude"], terminal["position"]["longitude"])
+                          for terminal in payload["terminals"]}
+
+    payload_scenarios = {}
+    for scenario in scenarios:
+        scenario_payload = {**payload, **pln_trnsfrm.transform_restrictions_to_pma(scenario)}
+        payload_scenarios.setdefault(payload_hash(scenario_payload), (scenario_payload, []))[1].append(scenario)
+
+    def plan(scenario_payload):
+        pma_key, _ = cached_push_pma_request(scenario_payload, bypass=not use_cache)
+        if type(pma_key) == int:
+            raise RuntimeError(f"The PMA API answered with status {pma_key}")
+        output = pma_poller.track(pma_key).result(timeout)
+
+        return pma_key, ExtractPmaPlanning(json=output).calculate_kpis(terminal_positions)
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='planning_sweep') as pool:
+        futures = {pool.submit(plan, scenario_payload): grouped
+                   for scenario_payload, grouped in payload_scenarios.values()}
+        for finished, future in enumerate(as_completed(futures), start=1):
+            try:
+                pma_key, kpis = future.result()
+                error = None
+            except Exception as e:
+                pma_key, kpis, error = None, {}, str(e)
+
+            for scenario in futures[future]:
+                rows.append({**scenario, "pma_key": pma_key, "error": error, **kpis})
+
+            if progress is not None:
+                progress(finished / len(futures))
+
+    results = pd.DataFrame(rows)
+    for column in ["fleet_utilisation", "planned_containers", "unplanned_containers", "planned_share", "distance_km"]:
+        if column not in results.columns:
+            results[column] = np.nan
+
+    results['pareto_rank'] = pareto_ranks(results)
+    results.loc[results['error'].notna(), 'pareto_rank'] = np.nan
+
+    return results.sort_values(['pareto_rank', 'unplanned_containers', 'distance_km'],
+                               ascending=True, na_position='last').reset_index(drop=True)
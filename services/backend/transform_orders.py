@@ -3,9 +3,11 @@ import pandas as pd
 import numpy as np
 import json
 import datetime as dt
+import zlib
 
-from data.service_database import load_datatable_from_db, load_query_from_db, store_dataframe_to_db, \
-    empty_database_table, retrieve_container_type
+from data.service_database import load_datatable_from_db, load_query_from_db, upsert_dataframe_to_db, \
+    retrieve_container_type
+from services.backend.payload_delta import diff_payload, apply_delta, load_session_payload, stable_order_ids
 from services.backend.utils import *
 
 
@@ -68,9 +70,9 @@ class DataTypeConverter:
     def __init__(self, data, data_category='container'):
         self.data = data
         self.data_category = data_category
-        self.meta_data_types = load_query_from_db(f"SELECT column_name, column_type "
-                                                  f"FROM meta_data "
-                                                  f"WHERE table_category = {data_category}")
+        self.meta_data_types = load_query_from_db("SELECT column_name, column_type "
+                                                  "FROM meta_data "
+                                                  "WHERE table_category = ?", params=(data_category,))
 
     def retrieve_difference(self):
         """
@@ -229,8 +231,8 @@ class TransformContainers:
         :return: dictionary containing the column names and their data types
         """
 
-        query_column_references = f"SELECT * FROM column_references WHERE col_ref_source = '{self.source}'"
-        column_references = load_query_from_db(query_column_references)
+        query_column_references = "SELECT * FROM column_references WHERE col_ref_source = ?"
+        column_references = load_query_from_db(query_column_references, params=(self.source,))
 
         # Merge  and create a dictionary with {column_references.col_ref_name : meta_data.column_name}
         merge_cols = pd.merge(self.meta_data, column_references, left_on="column_id", right_on="meta_data_id")
@@ -340,11 +342,9 @@ class TransformContainers:
                             if col != 'orderId']
 
         if all(column in self.container_input.columns for column in required_columns) is True:
-            # retrieve the contrainer_orders table
-
-            empty_database_table('container_orders')
-            container_orders = load_datatable_from_db(table='container_orders')
-            container_orders_columns = container_orders.columns.drop(['orderId'])
+            # retrieve the columns of the contrainer_orders table, the rows are synchronised on storing
+            container_orders = load_query_from_db("SELECT * FROM container_orders LIMIT 0")
+            container_orders_columns = container_orders.columns.drop(['orderId'], errors='ignore')
 
             nan_value_col = [column for column in container_orders_columns
                              if column not in self.container_input.columns]
@@ -372,11 +372,12 @@ class TransformContainers:
 
     def store_transformed_container(self):
         """
-        Store the transformed container to the database
-        :return: None
+        Store the transformed container to the database. Only new and changed orders are written, orders that are no
+        longer in the file are removed.
+        :return: number of changed rows
         """
 
-        store_dataframe_to_db(self.container_input, 'container_orders')
+        return upsert_dataframe_to_db(self.container_input, 'container_orders', delete_missing=True)
 
     def transform_container_orders(self):
         """
@@ -422,8 +423,9 @@ class TransformToPMA:
         self.restrictions = restrictions
 
         self.container_orders = container_orders
-        # create column orderId iteration 1, length of container_orders
-        self.container_orders['orderId'] = range(1, len(self.container_orders) + 1)
+        # The order ids follow from the container number and booking, the same orders have the same ids in every payload
+        self.container_orders['orderId'] = stable_order_ids(self.container_orders['containerNumber'],
+                                                            self.container_orders['bookingReference'])
         self.planning_date = planning_date[0]
         self.planning_after = planning_date[1]
         self.forbidden_routes = forbidden_routes
@@ -488,7 +490,11 @@ class TransformToPMA:
         vessels_dict = self.barges.to_dict(orient='records')
         active_times_dict = self.operating_times.to_dict(orient='records')
 
-        line_stops_dict = pma_random_linestops(self.barges, self.planning_date, self.calls, self.container_orders)
+        # Seeded by the request, so the same request gives the same payload (see pma_cache)
+        seed = zlib.crc32(json.dumps([str(self.planning_date), sorted(self.barges['barge_id'].astype(str)),
+                                      sorted(self.container_orders['loadTerminal'].astype(str).unique()),
+                                      sorted(self.container_orders['dischargeTerminal'].astype(str).unique())]).encode())
+        line_stops_dict = pma_random_linestops(self.barges, self.planning_date, self.calls, self.container_orders, seed)
         vessels_dict = pma_fill_json_vessels(vessels_dict, active_times_dict, line_stops_dict,
                                              self.forbidden_terminals, self.barge_speeds,
                                              self.barge_minimum_call_sizes, self.home_terminals)
@@ -519,8 +525,23 @@ class TransformToPMA:
 
         return formatted_string
 
+    def transform_restrictions_to_pma(self, restrictions=None):
+        """
+        The fields of the payload that follow from the restrictions of the planner (penalize_distance has no field
+        in the payload)
+
+        :param restrictions: dictionary like self.restrictions, by default self.restrictions
+        :return: dictionary with the payload fields
+        """
+
+        restrictions = self.restrictions if restrictions is None else restrictions
+
+        return {"penalizeUnplanned": 1.25 * restrictions["penalize_unplanned"],
+                "numberOfIterations": restrictions["number_of_iterations"]}
+
     def execute_create_json(self):
 
+        restriction_fields = self.transform_restrictions_to_pma()
         self.json = json.dumps(
             {"webhook": self.transform_webhooks_to_pma(),
              "mailhook": self.transform_mailhook_to_pma(),
@@ -528,31 +549,120 @@ class TransformToPMA:
              "appointments": self.transform_appointments_to_pma(),
              "intervalHours": 24,
              "firstHoursFixed": self.planning_after,
-             "penalizeUnplanned": 1.25 * self.restrictions["penalize_unplanned"],
+             "penalizeUnplanned": restriction_fields["penalizeUnplanned"],
              "minProfitPerTEU": 0,
-             "numberOfIterations": self.restrictions["number_of_iterations"],
+             "numberOfIterations": restriction_fields["numberOfIterations"],
              "orders": self.transform_container_orders_to_pma(),
              "terminals": self.transform_terminals_to_pma(),
              "hubs": self.transform_hubs_to_pma(),
              "vessels": self.transform_vessels_to_pma()
              }, indent=4)
 
+    def execute_create_delta(self, session_id):
+        """
+        Replanning mode: create the payload and the change-set against the payload that was submitted last in the
+        planning session (see payload_delta). Orders have the same id in both payloads, see stable_order_ids. The
+        change-set is checked by reconstructing the payload from it.
+
+        :param session_id: id of the planning session
+        :return: change-set of diff_payload, None when nothing was submitted in the session yet
+        """
+
+        previous = load_session_payload(session_id)
+        if self.json is None:
+            self.execute_create_json()
+
+        if previous is None:
+            return None
+
+        current = json.loads(self.json)
+        delta = diff_payload(previous, current)
+        if apply_delta(previous, delta) != current:
+            raise ValueError("The change-set doesn't reconstruct the payload")
+
+        return delta
+
+
+# Timestamp formats of PMA, tried in this order, and the timestamp format of Dave
+PMA_TIMESTAMP_FORMATS = ('%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S')
+DAVE_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def parse_timestamps(timestamps, formats=PMA_TIMESTAMP_FORMATS):
+    """
+    Parse a column of timestamps. The column is parsed with the first format, the rows that failed are parsed with
+    the next format, and so on.
+
+    :param timestamps: series or list of timestamp strings
+    :param formats: formats of the timestamps, tried in this order
+    :return: series of datetimes, NaT when no format matches
+    """
+
+    timestamps = pd.Series(timestamps, dtype=object)
+    parsed = pd.Series(pd.NaT, index=timestamps.index, dtype='datetime64[ns]')
+
+    for fmt in formats:
+        failed = parsed.isna() & timestamps.notna()
+        if not failed.any():
+            break
+        parsed[failed] = pd.to_datetime(timestamps[failed], format=fmt, errors='coerce')
+
+    return parsed
+
+
+def normalise_timestamps(timestamps, formats=PMA_TIMESTAMP_FORMATS, output_format=DAVE_TIMESTAMP_FORMAT):
+    """
+    Convert a column of timestamps to another format, see parse_timestamps
+
+    :param timestamps: series or list of timestamp strings
+    :param formats: formats of the timestamps, tried in this order
+    :param output_format: format of the converted timestamps
+    :return: tuple of a series with the converted timestamps (None when no format matches) and a list with the index
+             of the rows that could not be parsed
+    """
+
+    timestamps = pd.Series(timestamps, dtype=object)
+    parsed = parse_timestamps(timestamps, formats)
+
+    converted = parsed.dt.strftime(output_format).astype(object)
+    converted = converted.where(parsed.notna(), None)
+
+    return converted, list(timestamps.index[parsed.isna()])
+
 
 class TransformToDave:
     """This class will convert the template data to the dave format"""
 
-    def __init__(self, pma_planning, pma_calls=None):
+    def __init__(self, pma_planning, pma_calls=None, seed=None, time_shift=None):
+        """
+        :param pma_planning: dictionary with the output of the PMA API
+        :param pma_calls: dataframe with the calls of the planning, see ExtractPmaPlanning.extract_calls
+        :param seed: seed of the generated container ids and references, the same seed gives the same records, so an
+                     interrupted export can be resumed (see dave_export)
+        :param time_shift: timedelta that the calls are moved to the future, by default the calls that are in the past
+                           are moved to now when the voyages are generated (see dave_call_voyages)
+        """
 
         self.pmaPlanning = pma_planning
         self.pmaCalls = pma_calls
         self.timestampNow = dt.datetime.now().strftime('%Y-%m-%d %H:%M')
+        self.seed = seed
+        self.time_shift = time_shift
+        self.random_state = np.random.RandomState(seed)
+        self.random = random.Random(seed)
 
         self.map_coi_orderid = dict()
 
         self.terminals = self.retrieve_terminal_ref()
+        # Terminal references by code, the first reference of a code is used
+        self.terminal_index = self.terminals.drop_duplicates('code').set_index('code')[
+            ['source_id', 'source_code', 'source_name']].to_dict(orient='index')
+        self.barge_index = self.retrieve_barge_ref()
 
         self.daveContainerDictionary = []
         self.daveVoyageDictionary = []
+        # Timestamps that could not be converted to the Dave format: (field, row, value)
+        self.timestampErrors = []
 
     def retrieve_terminal_ref(self):
         """
@@ -568,6 +678,51 @@ class TransformToDave:
 
         return terminal_dataframe
 
+    def retrieve_barge_ref(self):
+        """
+        Load the master data of the barges once, with their unit id in Dave from the barge_references table
+
+        :return: dictionary {call_sign: {name, mmsi, eni, dave_unit_id}}
+        """
+
+        barge_query = """SELECT b.call_sign, b.name, b.mmsi, b.eni, br.source_id AS dave_unit_id
+                             FROM barges b
+                                 LEFT JOIN barge_references br
+                                 ON br.call_sign = b.call_sign AND br.source = 'DAVE'"""
+        barges = load_query_from_db(barge_query)
+
+        # Integers without float conversion because of missing values, e.g. mmsi 123456789 and not 123456789.0
+        for column in ['mmsi', 'eni', 'dave_unit_id']:
+            barges[column] = barges[column].astype('Int64').astype(object).where(barges[column].notna(), None)
+
+        return barges.drop_duplicates('call_sign').set_index('call_sign').to_dict(orient='index')
+
+    def dave_barge(self, barge_call_sign):
+        """
+        :return: dictionary with the master data of a barge, see retrieve_barge_ref
+        """
+
+        barge = self.barge_index.get(barge_call_sign)
+        if barge is None:
+            raise ValueError(f"The barge {barge_call_sign} is not in the barges table")
+        if barge['dave_unit_id'] is None:
+            raise ValueError(f"The barge {barge_call_sign} has no Dave unit id in the barge_references table")
+
+        return barge
+
+    def dave_terminal_stop(self, terminal_id, pta):
+        """
+        :param pta: planned arrival in the Dave format, see dave_timestamps
+        :return: dictionary with the terminal fields and the planned arrival of a stop in Dave
+        """
+
+        terminal = self.terminal_index[terminal_id]
+
+        return {"tui": int(terminal['source_id']),
+                "ti": str(terminal['source_code']),
+                "tnm": str(terminal['source_name']),
+                "pta": pta}
+
     def retrieve_call_containers(self, order_id):
         """
 
@@ -576,20 +731,24 @@ class TransformToDave:
 
         return [str(self.map_coi_orderid[order]) for order in order_id]
 
-    def pma_timestamp_dave_format(self, timestamp):
+    def dave_timestamps(self, timestamps, field):
         """
-        Convert the timestamp from PMA format to Dave format
-        :param timestamp:
-        :return: str timestamp '%Y-%m-%d %H:%M'
+        Convert a column of PMA timestamps to the Dave format, see normalise_timestamps. The timestamps that could not
+        be converted are None and are added to timestampErrors, instead of stopping the conversion.
+
+        :param timestamps: list of timestamps in a PMA format
+        :param field: name of the field for the report of the timestamps that could not be converted
+        :return: list of timestamps in the Dave format
         """
 
-        for fmt in ('%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S'):
-            try:
-                return dt.datetime.strptime(timestamp, fmt).strftime('%Y-%m-%d %H:%M')
-            except ValueError:
-                pass
+        timestamps = list(timestamps)
+        converted, failed = normalise_timestamps(timestamps)
+        if failed:
+            self.timestampErrors.extend((field, row, timestamps[row]) for row in failed)
+            print(f"{len(failed)} of {len(timestamps)} timestamps of {field} have no valid date format, e.g. row "
+                  f"{failed[0]}: {timestamps[failed[0]]}")
 
-        raise ValueError(f'no valid date format found for {timestamp}')
+        return converted.tolist()
 
     def create_dave_container_dictionary(self):
         """
@@ -598,13 +757,28 @@ class TransformToDave:
         :return:
         """
 
+        self.daveContainerDictionary.extend(self.dave_containers())
+
+    def dave_containers(self):
+        """
+        Generate the containers of the planning in the Dave format one by one, the ids of the containers are added to
+        map_coi_orderid when they are generated.
+
+        :return: generator of container dictionaries
+        """
+
         list_all_orders = self.pmaPlanning['orders']
 
-        id_list = list(np.random.choice(range(1, 100000), len(list_all_orders), replace=False))
+        id_list = list(self.random_state.choice(range(1, 100000), len(list_all_orders), replace=False))
         ref_numbers = ["RIVA-" + str(no) for no in
-                       list(np.random.choice(range(1, 100000), len(list_all_orders), replace=False))]
+                       list(self.random_state.choice(range(1, 100000), len(list_all_orders), replace=False))]
 
-        for order in list_all_orders:
+        etao_list = self.dave_timestamps([order['loadTimeWindow']['startDateTime'] for order in list_all_orders],
+                                         'loadTimeWindow.startDateTime')
+        etad_list = self.dave_timestamps([order['dischargeTimeWindow']['startDateTime'] for order in list_all_orders],
+                                         'dischargeTimeWindow.startDateTime')
+
+        for order, etao, etad in zip(list_all_orders, etao_list, etad_list):
             ref_no = ref_numbers.pop()
             id_no = id_list.pop()
 
@@ -634,11 +808,11 @@ class TransformToDave:
                 "cse": "",
                 "cwgh": int(order['weight'] * 1000),
                 "twgh": int(twgh_filler),
-                "etao": str(self.pma_timestamp_dave_format(order['loadTimeWindow']['startDateTime'])),
+                "etao": etao,
                 "oti": str(self.terminals[self.terminals['code'] == order['loadTerminal']]['source_code'].values[0]),
                 "otd": str(self.terminals[self.terminals['code'] == order['loadTerminal']]['source_name'].values[0]),
                 "otui": int(self.terminals[self.terminals['code'] == order['loadTerminal']]['source_id'].values[0]),
-                "etad": str(self.pma_timestamp_dave_format(order['dischargeTimeWindow']['startDateTime'])),
+                "etad": etad,
                 "dti": str(
                     self.terminals[self.terminals['code'] == order['dischargeTerminal']]['source_name'].values[0]),
                 "dtd": str(
@@ -647,41 +821,60 @@ class TransformToDave:
             }
 
             self.map_coi_orderid[order["orderId"]] = id_no
-            self.daveContainerDictionary.append(container)
+            yield container
 
     def create_dave_call_dictionary(self):
-        """ Uses calls from PMA to create dictionary for Dave """
-
-        imp_voyage_numbers = list(
-            self.pmaCalls['voyage_number_import'].unique()) if 'voyage_number_import' in self.pmaCalls.columns else []
-        exp_voyage_numbers = list(
-            self.pmaCalls['voyage_number_export'].unique()) if 'voyage_number_export' in self.pmaCalls.columns else []
-        voyage_numbers = imp_voyage_numbers + exp_voyage_numbers
-        # Drop NaN values
-        voyage_numbers = [voy for voy in voyage_numbers if str(voy) != 'nan']
-
-        # Check if the start_date_time is in the past, if so move to the future
-        start_date_time_list = pd.to_datetime(self.pmaCalls['start_date_time'])  # Convert to datetime
-        max_diff = (dt.datetime.now() - start_date_time_list.min())
-        if max_diff.days > 0:
-            start_date_time_list = start_date_time_list + max_diff
-            # Change timestamp to string
-            self.pmaCalls['start_date_time'] = start_date_time_list.dt.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-        direction = None
-        for voyage in voyage_numbers:
-            if len(imp_voyage_numbers) == 0:
-                voy_calls = self.pmaCalls[self.pmaCalls['voyage_number_export'] == voyage]
-            elif len(exp_voyage_numbers) == 0:
-                voy_calls = self.pmaCalls[self.pmaCalls['voyage_number_import'] == voyage]
-            else:
-                voy_calls = self.pmaCalls[(self.pmaCalls['voyage_number_import'] == voyage) |
-                                          (self.pmaCalls['voyage_number_export'] == voyage)]
+        """ Uses calls from PMA to create dictionary for Dave, with a voyage per import and export voyage number """
+
+        self.daveVoyageDictionary.extend(self.dave_call_voyages())
+
+    def call_time_shift(self):
+        """
+        The time that the calls are moved to the future, so that the first call starts now when the calls are in the
+        past. The shift is determined once and kept, so the voyages are the same when they are generated again.
 
-            barge = voy_calls['barge_call_sign'].values[0]
-            barge_map = {"TN10": 61, "SW17": 59, "SP07": 58}
-            query = f"""SELECT name, mmsi, eni  FROM barges WHERE call_sign = '{barge}'"""
-            barge_data = load_query_from_db(query)
+        :return: timedelta in whole seconds
+        """
+
+        if self.time_shift is None:
+            max_diff = (dt.datetime.now() - parse_timestamps(self.pmaCalls['start_date_time']).min())
+            self.time_shift = dt.timedelta(seconds=int(max_diff.total_seconds())) if max_diff.days > 0 \
+                else dt.timedelta(0)
+
+        return self.time_shift
+
+    def dave_call_voyages(self):
+        """
+        Generate the voyages of the calls in the Dave format one by one, the containers have to be generated first
+        (see dave_containers)
+
+        :return: generator of voyage dictionaries
+        """
+
+        # Move the calls to the future when they are in the past
+        calls = self.pmaCalls.reset_index(drop=True)
+        if self.call_time_shift():
+            start_date_time_list = parse_timestamps(calls['start_date_time']) + self.time_shift
+            # Change timestamp to string, timestamps that could not be parsed are reported by dave_timestamps
+            calls['start_date_time'] = start_date_time_list.dt.strftime('%Y-%m-%dT%H:%M:%SZ').where(
+                start_date_time_list.notna(), calls['start_date_time'])
+
+        calls_list = calls.to_dict(orient='records')
+        pta_list = self.dave_timestamps(calls['start_date_time'], 'start_date_time')
+
+        # The calls of a voyage, import voyages first and in order of their first call
+        voyage_columns = [column for column in ['voyage_number_import', 'voyage_number_export']
+                          if column in calls.columns]
+        if not voyage_columns:
+            return
+        voyages = pd.concat([calls[column].dropna() for column in voyage_columns])
+        voyage_calls = voyages.groupby(voyages, sort=False).groups
+
+        for voyage, call_index in voyage_calls.items():
+            call_index = np.sort(call_index)
+            voy_calls = [calls_list[i] for i in call_index]
+            barge = voy_calls[0]['barge_call_sign']
+            barge_data = self.dave_barge(barge)
 
             # Check if prefix voyage number is IMP or EXP
             if voyage[:3] == 'IMP':
@@ -693,71 +886,72 @@ class TransformToDave:
 
             barge_voy = {
                 "ts": str(self.timestampNow),
-                "vui": barge_map[barge],
+                "vui": int(barge_data['dave_unit_id']),
                 "voi": voyage,
-                "vnm": str(barge_data["name"].values[0]),
-                "vei": str(barge_data["eni"].values[0]),
-                "mmsi": str(barge_data["mmsi"].values[0]),
+                "vnm": str(barge_data["name"]),
+                "vei": str(barge_data["eni"]),
+                "mmsi": str(barge_data["mmsi"]),
                 "sid": 1,
                 "stops": []
             }
 
-            for index, row in voy_calls.iterrows():
-                terminal_data = self.terminals[self.terminals['code'] == row['terminal_id']]
-                calls_record = {
-                    "tui": int(terminal_data['source_id'].values[0]),
-                    "ti": str(terminal_data['source_code'].values[0]),
-                    "tnm": str(terminal_data['source_name'].values[0]),
-                    "pta": str(self.pma_timestamp_dave_format(row['start_date_time']))
-                }
-
-                # VNUTDGML only has load_orders when direction is import
-                if len(row["load_orders"]) > 0 and ((direction == 'import' and row['terminal_id'] == 'VNVUTDGML') or
-                                                    (direction == 'export' and row['terminal_id'] != 'VNVUTDGML')):
+            for i, row in zip(call_index, voy_calls):
+                calls_record = self.dave_terminal_stop(row['terminal_id'], pta_list[i])
+
+                # Hubs only have load_orders when direction is import
+                hub = row['terminal_id'] in HUB_TERMINALS
+                if len(row["load_orders"]) > 0 and ((direction == 'import' and hub) or
+                                                    (direction == 'export' and not hub)):
                     calls_record["lol"] = list(self.retrieve_call_containers(row["load_orders"]))
                     calls_record["loc"] = len(calls_record["lol"])
 
-                # VNUTDGML only has discharge_orders when direction is export
+                # Hubs only have discharge_orders when direction is export
                 if len(row["discharge_orders"]) > 0 and (
-                        (direction == 'import' and row['terminal_id'] != 'VNVUTDGML') or
-                        (direction == 'export' and row['terminal_id'] == 'VNVUTDGML')):
+                        (direction == 'import' and not hub) or
+                        (direction == 'export' and hub)):
                     calls_record["unl"] = list(self.retrieve_call_containers(row["discharge_orders"]))
                     calls_record["unc"] = len(calls_record["unl"])
 
                 barge_voy["stops"].append(calls_record)
 
-            self.daveVoyageDictionary.append(barge_voy)
+            yield barge_voy
 
     def create_dave_voyage_dictionary(self):
         """ For out put of voyage format"""
 
-        barge_voy_record = []
+        self.daveVoyageDictionary.extend(self.dave_route_voyages())
+
+        return self.daveVoyageDictionary
+
+    def dave_route_voyages(self):
+        """
+        Generate a voyage in the Dave format per route of the planning, the containers have to be generated first
+        (see dave_containers)
+
+        :return: generator of voyage dictionaries
+        """
+
+        # The planned arrivals of the stops of all routes, in the order of the routes and their stops
+        pta_list = iter(self.dave_timestamps([stop["startTime"] for route in self.pmaPlanning["routes"]
+                                              for stop in route["stops"]], 'startTime'))
 
         for route in self.pmaPlanning["routes"]:
             barge = route["vessel"]
-            barge_map = {"TN10": 61, "SW17": 59, "SP07": 58}
-            query = f"""SELECT name, mmsi, eni  FROM barges WHERE call_sign = '{barge}'"""
-            barge_data = load_query_from_db(query)
+            barge_data = self.dave_barge(barge)
 
             barge_voy = {
                 "ts": str(self.timestampNow),
-                "vui": barge_map[barge],
-                "voi": "V-" + str(random.randint(1, 99999)),  # TODO: Should be based on import/export voy
-                "vnm": str(barge_data["name"].values[0]),
-                "vei": str(barge_data["eni"].values[0]),
-                "mmsi": str(barge_data["mmsi"].values[0]),
+                "vui": int(barge_data['dave_unit_id']),
+                "voi": "V-" + str(self.random.randint(1, 99999)),  # TODO: Should be based on import/export voy
+                "vnm": str(barge_data["name"]),
+                "vei": str(barge_data["eni"]),
+                "mmsi": str(barge_data["mmsi"]),
                 "sid": 1
             }
 
             calls = []
             for stop in route["stops"]:
-                terminal_data = self.terminals[self.terminals['code'] == stop['terminalId']]
-                calls_record = {
-                    "tui": int(terminal_data['source_id'].values[0]),
-                    "ti": str(terminal_data['source_code'].values[0]),
-                    "tnm": str(terminal_data['source_name'].values[0]),
-                    "pta": str(self.pma_timestamp_dave_format(stop["startTime"]))
-                }
+                calls_record = self.dave_terminal_stop(stop['terminalId'], next(pta_list))
 
                 if len(stop["loadOrders"]) > 0:
                     calls_record["lol"] = list(self.retrieve_call_containers(stop["loadOrders"]))
@@ -770,6 +964,4 @@ class TransformToDave:
                 calls.append(calls_record)
 
             barge_voy["stops"] = calls
-            self.daveVoyageDictionary.append(barge_voy)
-
-        return self.daveVoyageDictionary
+            yield barge_voy
@@ -1,7 +1,7 @@
 import datetime as dt
 import numpy as np
 import pandas as pd
-from data.service_database import store_dataframe_to_db, load_datatable_from_db
+from data.service_database import store_dataframe_to_db, load_datatable_from_db, load_demo_terminals
 import random
 
 
@@ -9,7 +9,7 @@ import random
 ################### 1. PMA JSON        #####################################
 ############################################################################
 
-def pma_random_linestops(barges, time_of_planning, calls, cargos):
+def pma_random_linestops(barges, time_of_planning, calls, cargos, seed=None):
     """
         Generate random line stops for barges when their locations are unknown.
 
@@ -17,18 +17,21 @@ def pma_random_linestops(barges, time_of_planning, calls, cargos):
         :param time_of_planning: String representing the time of planning.
         :param calls: DataFrame containing call information.
         :param cargos: DataFrame containing cargo information.
+        :param seed: Seed of the random line stops, the same seed gives the same line stops.
         :return: List of dictionaries representing line stops.
         """
     # Get a unique list of load an
     terminals = list(cargos["loadTerminal"].unique()) + list(cargos["dischargeTerminal"].unique())
-    terminals = list(set(terminals))  # Remove duplicates
+    terminals = sorted(set(terminals))  # Remove duplicates, sorted so the seed gives the same line stops
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
 
     # cargos["loadTimeWindowStart"] = pd.to_datetime(cargos["loadTimeWindowStart"]) previous took the loadTimeWindowStart
     # check for time of planning which is strftime ('%Y-%m-%dT%H:%M:%SZ') Change that to datetime
     planning_date = pd.to_datetime(time_of_planning)
     earliest_load_time = planning_date.tz_localize('UTC')
     # create random ofset between 6 and 12 hours to determine starttime of first visit
-    random_offset = dt.timedelta(hours=random.randint(6, 12))
+    random_offset = dt.timedelta(hours=rng.randint(6, 12))
 
     # If barges are known to have locations, we should add those locations to the linestops
     barge_w_calls = [barge_id for barge_id in calls['barge_id'].to_list() if barge_id in barges['barge_id'].to_list()]
@@ -47,11 +50,11 @@ def pma_random_linestops(barges, time_of_planning, calls, cargos):
     for barge_wo_call in barge_wo_calls:
         # Assign a start and end time of the first call as location for the barge
         start_date_time = earliest_load_time - random_offset
-        end_date_time = start_date_time + dt.timedelta(hours=random.randint(1, 4))
+        end_date_time = start_date_time + dt.timedelta(hours=rng.randint(1, 4))
 
         # TODO: The first stop is a terminal, but could be a river location. Should retrieve position add it as temp_t
-        linestop = {"terminal_id": np.random.choice(terminals),
-                    "linestop_id": np.random.randint(1000000, 9999999),
+        linestop = {"terminal_id": terminals[np_rng.integers(len(terminals))],
+                    "linestop_id": int(np_rng.integers(1000000, 9999999)),
                     "barge_id": barge_wo_call,
                     "fixed_stop": True,
                     "on_board_after_stop": 0,
@@ -598,27 +601,26 @@ def source_adjustment_cma_cgm(dataframe):
 
     return dataframe
 
-def get_demo_terminals(terminals_df):
-    terminals_df = terminals_df[(terminals_df['town'] == 'Rotterdam') | (terminals_df['town'] == 'Antwerpen')]
+# Demo terminals by (alternative) description
+SEA_TERMINALS = ['ECTDDE', 'K1700', 'K869', 'K913', 'K1718', 'K1742', 'Rhenus Deepsea Terminal - Maasvlakte',
+                 'APM Terminals', 'APM1 /HUTCHISON PORTS DELTA 2', 'APM Terminals - Maasvlakte 2',
+                 'RWG - Rotterdam World Gateway', 'RCT Hartelhaven', 'Euromax']
+INLAND_TERMINALS = ['UCT', 'Waalhaven Terminal', 'Kramer Depot Maasvlakte', 'K730', 'K1610', 'K1207', 'K420']
 
-    # Step 2: Group by 'code' and apply the function
-    result = terminals_df.groupby('code', group_keys=False).apply(keep_longest_description)
-    result = result.reset_index(drop=True)
-    result.drop(
-        columns=['id', 'externalId', 'displayCode', 'abbreviation', 'eanNumber', 'imported', 'overridden', 'movability',
-                 'type', 'encodedPolyline', 'street', 'name1', 'name2', 'zipCode'],
-        inplace=True)
+# Hub terminals of the voyages: import voyages load at a hub, export voyages discharge at a hub
+HUB_TERMINALS = ['VNVUTDGML']
 
-    town_index = result.columns.get_loc("town")
 
-    columns_to_keep = result.columns[:town_index + 1].tolist() + ['minCallSize']
-    result_trimmed = result[columns_to_keep]
-    result_trimmed['minCallSize'] = result_trimmed['minCallSize'].fillna(0)
-    result_trimmed.rename(columns={'minCallSize': 'minimum call size'}, inplace=True)
-    terminals_df_filtered = result_trimmed[(result_trimmed['latitude'] != 0) & (result_trimmed['longitude'] != 0)]
+def get_demo_terminals():
+    """
+    Retrieve the Rotterdam and Antwerp terminals of the terminal positions database. The longest description per
+    code, the alternative description (see create_new_column) and the sea / inland category are materialised in the
+    demo_terminals table, which is only rebuilt when the terminal positions change.
+
+    :return: dataframe with the demo terminals, list with the default selection, list with the sea terminals
+    """
 
-    # Create the new column
-    terminals_df_filtered['alternative description'] = terminals_df_filtered.apply(create_new_column, axis=1)
+    terminals_df_filtered = load_demo_terminals(SEA_TERMINALS, INLAND_TERMINALS)
 
     # default_values = {
     #     'call_cost': 50,
@@ -644,14 +646,9 @@ def get_demo_terminals(terminals_df):
     #
     # store_dataframe_to_db(df_transformed, 'terminals')
 
-    sea_terminals = ['ECTDDE', 'K1700', 'K869', 'K913', 'K1718', 'K1742', 'Rhenus Deepsea Terminal - Maasvlakte',
-                     'APM Terminals', 'APM1 /HUTCHISON PORTS DELTA 2', 'APM Terminals - Maasvlakte 2',
-                     'RWG - Rotterdam World Gateway', 'RCT Hartelhaven', 'Euromax']
-    inland_terminals = ['UCT', 'Waalhaven Terminal', 'Kramer Depot Maasvlakte', 'K730', 'K1610', 'K1207',
-                        'K420']
-    selected_terminals = sea_terminals[:3] + inland_terminals
+    selected_terminals = SEA_TERMINALS[:3] + INLAND_TERMINALS
 
-    return terminals_df_filtered, selected_terminals, sea_terminals
+    return terminals_df_filtered, selected_terminals, list(SEA_TERMINALS)
 
 def keep_longest_description(group):
     return group.loc[group['description'].str.len().idxmax()]
@@ -2,7 +2,6 @@
 # import plotly.express as px
 import plotly.express as px
 import plotly.graph_objects as go
-from polyline import decode
 import pytz
 import datetime as dt
 import pandas as pd
@@ -10,6 +9,10 @@ import numpy as np
 import streamlit as st
 
 from data.service_database import load_query_from_db, load_datatable_from_db
+from services.backend.figure_cache import cached_figure
+from services.backend.map_layers import corridor_traces, port_traces, terminal_traces
+from services.backend.order_profile import profile_orders
+from services.backend.planning_enrichment import enrich_planning
 
 """ Functions for retrieving data from the database."""
 
@@ -22,6 +25,21 @@ class VisualizationContainerOrders():
 
     def __init__(self, dataframe_containers):
         self.df = dataframe_containers
+        self._profile = None
+
+    @property
+    def profile(self):
+        """
+        The aggregates the charts are made of, computed on first use. Charts that come from the figure cache don't need
+        it.
+
+        :return: OrderProfile object, see profile_orders
+        """
+
+        if self._profile is None:
+            self._profile = profile_orders(self.df)
+
+        return self._profile
 
     def data_completeness_overview(self):
         """
@@ -37,11 +55,12 @@ class VisualizationContainerOrders():
         """
 
         # Dataframe with the headers and the amount of filled values in percentage
-        filled_values_prct = (self.df.count() / len(self.df))
+        filled_values_prct = (self.profile.filled / self.profile.rows)
         df_filled_values_prct = pd.DataFrame(filled_values_prct, columns=['Percentage_filled'])
 
         return df_filled_values_prct.T
 
+    @cached_figure('df')
     def container_weight_distribution(self):
         """
         Description: This visualization shows the distribution of container weights.
@@ -54,19 +73,17 @@ class VisualizationContainerOrders():
         :return: Weigth distribution of containers in streamlit app
         """
 
-        # Create currect bins by taking the min, max and 25 bins equally spaced, rounded numbers
-        bins = np.linspace(self.df['weight'].min(), self.df['weight'].max(), 25)
-
-        # Create a histogram of the container weights
-        fig = px.histogram(self.df, x='weight',
-                           nbins=10,
-                           labels={'x': 'Container weights in tonnage', 'y': 'Count of containers'},
-                           title='Container Weight in tonnage Distribution')
+        # Create a histogram of the container weights from the equally spaced bins of the profile
+        counts, edges = self.profile.weight_histogram
+        fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges), name='weight'))
+        fig.update_layout(title='Container Weight in tonnage Distribution', bargap=0)
         fig.update_xaxes(title_text="Weight in ton")
+        fig.update_yaxes(title_text="count")
         fig.update_traces(marker_line_width=1, marker_line_color="black", opacity=0.8)  # Adjustments to show edges
 
         return fig
 
+    @cached_figure('df')
     def container_type_distribution(self):
         """
         Description: This visualization shows the distribution of container types.
@@ -80,7 +97,7 @@ class VisualizationContainerOrders():
         """
 
         # Count the number of containers of each type
-        container_type_counts = self.df['containerType'].value_counts()
+        container_type_counts = self.profile.counts['containerType']
 
         # Create a pie chart of the container types
         fig = px.pie(container_type_counts,
@@ -90,6 +107,7 @@ class VisualizationContainerOrders():
                      title='Container Type Distribution')
         return fig
 
+    @cached_figure('df')
     def container_teu_distribution(self):
         """
         Description: This visualization shows the distribution of container TEUs.
@@ -102,7 +120,7 @@ class VisualizationContainerOrders():
         :return: Container TEU distribution in streamlit app
         """
         # Count the number of containers of each TEU
-        container_teu_counts = self.df['teu'].value_counts()
+        container_teu_counts = self.profile.counts['teu']
 
         # Create a pie chart of the container TEUs
         fig = px.pie(container_teu_counts,
@@ -112,6 +130,7 @@ class VisualizationContainerOrders():
                      title='Container TEU Distribution')
         return fig
 
+    @cached_figure('df')
     def container_reefer_counts(self):
         """
         Description: This visualization shows the distribution of reefer and non-reefer containers.
@@ -124,7 +143,7 @@ class VisualizationContainerOrders():
         :return: Reefer container distribution in streamlit app
         """
         # Count the number of reefer and non-reefer containers
-        reefer_counts = self.df['reefer'].value_counts()
+        reefer_counts = self.profile.counts['reefer']
 
         # Create a pie chart of the reefer and non-reefer containers
         fig = px.pie(reefer_counts,
@@ -134,6 +153,7 @@ class VisualizationContainerOrders():
                      title='Reefer Container Distribution')
         return fig
 
+    @cached_figure('df')
     def container_dangerousGoods_counts(self):
         """
         Description: This visualization shows the distribution of dangerous and non-dangerous goods containers.
@@ -146,7 +166,7 @@ class VisualizationContainerOrders():
         :return: Dangerous goods container distribution in streamlit app
         """
         # Count the number of dangerous and non-dangerous goods containers
-        dangerous_goods_counts = self.df['dangerousGoods'].value_counts()
+        dangerous_goods_counts = self.profile.counts['dangerousGoods']
 
         # Create a pie chart of the dangerous and non-dangerous goods containers
         fig = px.pie(dangerous_goods_counts,
@@ -156,6 +176,7 @@ class VisualizationContainerOrders():
                      title='Dangerous Goods Container Distribution')
         return fig
 
+    @cached_figure('df')
     def load_location_distribution(self):
         """
         Description: This visualization shows the distribution of load locations.
@@ -168,7 +189,7 @@ class VisualizationContainerOrders():
         :return: Load location distribution in streamlit app
         """
         # Count the number of containers at each load location
-        load_location_counts = self.df['loadTerminal'].value_counts().reset_index()
+        load_location_counts = self.profile.counts['loadTerminal'].reset_index()
         load_location_counts.columns = ['Load locations', 'Count of containers']
 
         # Create a bar chart of the load locations
@@ -179,6 +200,7 @@ class VisualizationContainerOrders():
                      title='Load Location Distribution')
         return fig
 
+    @cached_figure('df')
     def discharge_location_distribution(self):
         """
         Description: This visualization shows the distribution of discharge locations.
@@ -191,7 +213,7 @@ class VisualizationContainerOrders():
         :return: Discharge location distribution in streamlit app
         """
         # Count the number of containers at each discharge location
-        discharge_location_counts = self.df['dischargeTerminal'].value_counts()
+        discharge_location_counts = self.profile.counts['dischargeTerminal']
 
         # Create a bar chart of the discharge locations
         fig = px.bar(discharge_location_counts,
@@ -201,6 +223,7 @@ class VisualizationContainerOrders():
                      title='Discharge Location Distribution')
         return fig
 
+    @cached_figure('df')
     def load_window_duration(self):
         """
         Description: This visualization shows the distribution of load window durations.
@@ -213,19 +236,14 @@ class VisualizationContainerOrders():
         :return: Load window duration distribution in streamlit app
         """
 
-        # Convert the loadTimeWindowStart and loadTimeWindowEnd columns to datetime objects
-        self.df['loadTimeWindowStart'] = pd.to_datetime(self.df['loadTimeWindowStart'])
-        self.df['loadTimeWindowEnd'] = pd.to_datetime(self.df['loadTimeWindowEnd'])
-
         # Calculate the load window durations in hours by subtracting the loadTimeWindowStart from the LoadTimeWindowEnd
-        self.df['load_window_duration'] = (self.df['loadTimeWindowEnd'] - self.df[
-            'loadTimeWindowStart']).dt.total_seconds() / 3600
+        durations = self.profile.window_hours['load'].to_frame()
 
         # Create analytical description of the load window durations
-        load_window_duration_description = self.df['load_window_duration'].describe()
+        load_window_duration_description = self.profile.window_quantiles('load')
 
         # Create a box plot of the load window durations
-        fig = px.box(self.df, y='load_window_duration',
+        fig = px.box(durations, y='load_window_duration',
                      labels={'y': 'Load window durations'},
                      title='Load Window Duration Distribution')
 
@@ -241,6 +259,7 @@ class VisualizationContainerOrders():
 
         return fig
 
+    @cached_figure('df')
     def discharge_window_duration(self):
         """
         Description: This visualization shows the distribution of discharge window durations.
@@ -253,19 +272,14 @@ class VisualizationContainerOrders():
         :return: Discharge window duration distribution in streamlit app
         """
 
-        # Convert the dischargeTimeWindowStart and dischargeTimeWindowEnd columns to datetime objects
-        self.df['dischargeTimeWindowStart'] = pd.to_datetime(self.df['dischargeTimeWindowStart'])
-        self.df['dischargeTimeWindowEnd'] = pd.to_datetime(self.df['dischargeTimeWindowEnd'])
-
         # Calculate the discharge window durations in hours by subtracting the dischargeTimeWindowStart from the dischargeTimeWindowEnd
-        self.df['discharge_window_duration'] = (self.df['dischargeTimeWindowEnd'] - self.df[
-            'dischargeTimeWindowStart']).dt.total_seconds() / 3600
+        durations = self.profile.window_hours['discharge'].to_frame()
 
         # Create analytical description of the discharge window durations
-        discharge_window_duration_description = self.df['discharge_window_duration'].describe()
+        discharge_window_duration_description = self.profile.window_quantiles('discharge')
 
         # Create a box plot of the discharge window durations
-        fig = px.box(self.df, y='discharge_window_duration',
+        fig = px.box(durations, y='discharge_window_duration',
                      labels={'y': 'Discharge window durations'},
                      title='Discharge Window Duration Distribution',
                      )
@@ -282,26 +296,17 @@ class VisualizationContainerOrders():
 
         return fig
 
+    @cached_figure('df')
     def window_duration_distribution(self):
-        # Convert the loadTimeWindowStart and loadTimeWindowEnd columns to datetime objects
-        time_series = ['loadTimeWindowStart', 'loadTimeWindowEnd', 'dischargeTimeWindowStart', 'dischargeTimeWindowEnd']
-        for time in time_series:
-            self.df[time] = pd.to_datetime(self.df[time])
-
-        data_record_load = {
-            "duration": (self.df['loadTimeWindowEnd'] - self.df['loadTimeWindowStart']).dt.total_seconds()}
-        data_record_load["type"] = data_record_load["duration"].apply(lambda x: "load")
-
-        data_record_discharge = {
-            "duration": (self.df['dischargeTimeWindowEnd'] - self.df['dischargeTimeWindowStart']).dt.total_seconds()}
-        data_record_discharge["type"] = data_record_discharge["duration"].apply(lambda x: "discharge")
-
-        window_duration = pd.concat([data_record_load, data_record_discharge])
+        # Durations in seconds per window type
+        window_duration = pd.concat([pd.DataFrame({"window_duration": self.profile.window_hours[window] * 3600,
+                                                   "type": window}) for window in ['load', 'discharge']])
 
         fig = px.box(window_duration, x="type", y="window_duration", points="all")
 
         return fig
 
+    @cached_figure('df')
     def order_creation_trend(self):
         """
         Description: This visualization shows the trend of order creation over time.
@@ -314,11 +319,8 @@ class VisualizationContainerOrders():
         :return: Order creation trend in streamlit app
         """
 
-        # Convert the bookingDateCreated column to a datetime object
-        self.df['bookingDateCreated'] = pd.to_datetime(self.df['bookingDateCreated'])
-
         # Count the number of orders created on each day
-        order_creation_trend = self.df['bookingDateCreated'].dt.date.value_counts().sort_index()
+        order_creation_trend = self.profile.daily['bookingDateCreated']
 
         # Create a line chart of the order creation trend
         fig = px.line(order_creation_trend,
@@ -330,6 +332,7 @@ class VisualizationContainerOrders():
 
         return fig
 
+    @cached_figure('df')
     def order_load_date_trend(self):
         """
         Description: This visualization shows the trend of order creation over time.
@@ -342,11 +345,8 @@ class VisualizationContainerOrders():
         :return: Order creation trend in streamlit app
         """
 
-        # Convert the bookingDateCreated column to a datetime object
-        self.df['loadTimeWindowStart'] = pd.to_datetime(self.df['loadTimeWindowStart'])
-
         # Count the number of orders created on each day
-        order_creation_trend = self.df['loadTimeWindowStart'].dt.date.value_counts().sort_index()
+        order_creation_trend = self.profile.daily['loadTimeWindowStart']
 
         # Create a line chart of the order creation trend
         fig = px.line(order_creation_trend,
@@ -358,6 +358,7 @@ class VisualizationContainerOrders():
 
         return fig
 
+    @cached_figure('df')
     def order_import_export_date_trend(self):
         """
         Description: This visualization shows the trend of order creation over time.
@@ -370,18 +371,9 @@ class VisualizationContainerOrders():
         :return: Order creation trend in streamlit app
         """
 
-        # Convert the bookingDateCreated column to a datetime object
-        self.df['loadTimeWindowStart'] = pd.to_datetime(self.df['loadTimeWindowStart'])
-        self.df['dischargeTimeWindowEnd'] = pd.to_datetime(self.df['dischargeTimeWindowEnd'])
-
-        temp_df = self.df.copy()
-
-        # Sum the TEU per day based in the load and discharge external id
-        temp_df['loadDayStart'] = temp_df['loadTimeWindowStart'].dt.date
-        temp_df['dischargeDayEnd'] = temp_df['dischargeTimeWindowEnd'].dt.date
-
-        order_import_trend = temp_df[temp_df['loadExternalId'] == 1].groupby('loadDayStart').agg({'teu': 'sum'})
-        order_export_trend = temp_df[temp_df['dischargeExternalId'] == 1].groupby('dischargeDayEnd').agg({'teu': 'sum'})
+        # The TEU per day based in the load and discharge external id
+        order_import_trend = self.profile.daily_teu['import']
+        order_export_trend = self.profile.daily_teu['export']
 
         # Create a line chart of the order creation trend
         fig = px.line(order_import_trend,
@@ -405,8 +397,7 @@ class VisualizationContainerOrders():
         """
 
         # get all the dates of self.df['loadTimeWindowStart'] and self.df['dischargeTimeWindowEnd']
-        dates = pd.concat([self.df['loadTimeWindowStart'].dt.date, self.df['dischargeTimeWindowEnd'].dt.date]).unique()
-        dates = sorted(dates)
+        dates = self.profile.dates
         # divide len dates by 3
         onethirddates = len(dates) // 3
 
@@ -433,6 +424,7 @@ class VisualizationContainerOrders():
 
         return fig
 
+    @cached_figure('df')
     def order_creation_by_location(self):
         """
         Description: This visualization shows the distribution of order creation by location.
@@ -446,8 +438,8 @@ class VisualizationContainerOrders():
         """
 
         # Count the number of orders created at each location
-        load_location_counts = self.df['loadTerminal'].value_counts()
-        discharge_location_counts = self.df['dischargeTerminal'].value_counts()
+        load_location_counts = self.profile.counts['loadTerminal']
+        discharge_location_counts = self.profile.counts['dischargeTerminal']
 
         # Create a bar chart of the order creation by location
         fig = go.Figure(data=[
@@ -460,6 +452,7 @@ class VisualizationContainerOrders():
 
         return fig
 
+    @cached_figure('df')
     def dangerous_goods_and_reefer_per_location(self):
         """
         Description: This visualization shows the distribution of dangerous goods and reefer containers per location.
@@ -473,8 +466,8 @@ class VisualizationContainerOrders():
         """
 
         # Count the number of dangerous goods and reefer containers at each location
-        dangerous_goods_per_location = self.df.groupby('loadTerminal')['dangerousGoods'].sum()
-        reefer_per_location = self.df.groupby('loadTerminal')['reefer'].sum()
+        dangerous_goods_per_location = self.profile.terminal_goods['dangerousGoods']
+        reefer_per_location = self.profile.terminal_goods['reefer']
 
         # Create a bar chart of the dangerous goods and reefer containers per location
         fig = go.Figure(data=[
@@ -500,31 +493,70 @@ class VisualizationContainerOrders():
         pass
 
 
+def lttb(x, y, threshold):
+    """
+    Downsample a line with the largest-triangle-three-buckets algorithm: the first and last point are kept, the other
+    points are divided in threshold - 2 buckets and of every bucket the point is kept that forms the largest triangle
+    with the kept point of the previous bucket and the average of the next bucket.
+
+    :param x: array with the x values, sorted
+    :param y: array with the y values
+    :param threshold: number of points to keep
+    :return: array with the indices of the kept points
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket boundaries of the points between the first and the last point
+    every = (n - 2) / (threshold - 2)
+    edges = np.minimum(np.floor(np.arange(threshold - 1) * every).astype(int) + 1, n - 1)
+
+    kept = np.empty(threshold, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+
+        # Twice the area of the triangles with the previous kept point and the average of the next bucket
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.nanargmax(areas)) if not np.isnan(areas).all() else start
+        kept[bucket + 1] = previous
+
+    return kept
+
+
 class VisualizationPlanning():
 
     def __init__(self, calls, transit, occupancy):
         self.dataframe_calls = calls
         self.dataframe_transit = transit
         self.dataframe_occupancy = occupancy
+        self.route_segments = None
 
     def add_barge_names(self):
         """
-        For every barge id in the dataframe, add the barge name to the dataframe.
+        Add the barge names to the calls, transit and occupancy and the terminal coordinates to the calls and transit,
+        see enrich_planning. The legs between the calls are stored in route_segments.
 
         :return:
         """
-        barge_ids = (self.dataframe_calls['barge_id'].unique())
-
-        query = f"SELECT barge_id, name " \
-                f"FROM barges " \
-                f"WHERE barge_id IN ({', '.join(map(str, barge_ids))})"
 
-        retrieve_barge_names = load_query_from_db(query)
+        enriched = enrich_planning(self.dataframe_calls, self.dataframe_transit, self.dataframe_occupancy)
 
-        self.dataframe_calls = self.dataframe_calls.merge(retrieve_barge_names, on='barge_id', how='left')
-        self.dataframe_transit = self.dataframe_transit.merge(retrieve_barge_names, on='barge_id', how='left')
-        self.dataframe_occupancy = self.dataframe_occupancy.merge(retrieve_barge_names, on='barge_id', how='left')
+        self.dataframe_calls = enriched['calls']
+        self.dataframe_transit = enriched['transit']
+        self.dataframe_occupancy = enriched['occupancy']
+        self.route_segments = enriched['route_segments']
 
+    @cached_figure('dataframe_calls')
     def calls_gantt_chart(self):
         """
         Description: This visualization shows the calls in a Gantt chart.
@@ -565,25 +597,54 @@ class VisualizationPlanning():
 
         return fig
 
-    def occupancy_timeline_chart(self):
+    @cached_figure('dataframe_occupancy')
+    def occupancy_timeline_chart(self, width=1200, stacked=True):
         """
+        The occupancy of the barges over time, normalised by their capacity. The lines are drawn with WebGL and every
+        barge gets at most about a point per three pixels of the chart width, whatever the planning horizon.
 
-        :return:
+        Scattergl has no stackgroup, so the stacked chart is stacked here: the time is divided in buckets that are
+        shared by all barges, a barge gets its highest occupancy of a bucket, and every trace is filled to the trace
+        below it. The lines of the unstacked chart are downsampled per barge with lttb.
+
+        :param width: width of the chart in pixels
+        :param stacked: stack the occupancy of the barges
+        :return: plotly figure
         """
 
         # Create a Plotly figure
         fig = go.Figure()
 
-        # Iterate over unique barge IDs
-        unique_names = self.dataframe_occupancy['name'].unique()
-
-        for name in unique_names:
-            # Add traces for occupied, available, and capacity TEU for each barge
-            barge_data = self.dataframe_occupancy[self.dataframe_occupancy['name'] == name]
-            barge_data['norm_occupancy_teu'] = barge_data['occupancy_teu'] / barge_data['capacity_teu']
-
-            fig.add_trace(go.Scatter(x=barge_data['date_time'], y=barge_data['norm_occupancy_teu'],
-                                     mode='lines', name=f'Barge {name} - Occupied TEU', stackgroup='one'))
+        max_points = max(3, width // 3)
+        occupancy = self.dataframe_occupancy.assign(
+            norm_occupancy_teu=self.dataframe_occupancy['occupancy_teu'] / self.dataframe_occupancy['capacity_teu'])
+        date_times = pd.to_datetime(occupancy['date_time'])
+
+        if stacked and len(occupancy) > 0:
+            times = date_times.to_numpy(dtype='datetime64[ns]').astype('int64')
+            edges = np.linspace(times.min(), times.max(), max_points + 1)
+            buckets = np.clip(np.searchsorted(edges, times, side='right') - 1, 0, max_points - 1)
+
+            # Highest occupancy per barge and bucket, empty buckets between two points of a barge get the occupancy
+            # of the next point (the occupancy of an hour is the occupancy of the later departure), buckets before the
+            # first and after the last point of the barge are 0
+            grid = occupancy.assign(bucket=buckets).groupby(['name', 'bucket'], sort=False)['norm_occupancy_teu'] \
+                .max().unstack().reindex(index=occupancy['name'].unique(), columns=range(max_points))
+            grid = grid.bfill(axis=1).mask(grid.ffill(axis=1).isna()).fillna(0)
+            stacked_grid = grid.cumsum(axis=0)
+            bucket_times = pd.to_datetime(edges[:-1].astype('int64'))
+
+            for i, name in enumerate(grid.index):
+                fig.add_trace(go.Scattergl(x=bucket_times, y=stacked_grid.iloc[i], customdata=grid.iloc[i],
+                                           mode='lines', fill='tozeroy' if i == 0 else 'tonexty',
+                                           hovertemplate='%{customdata:.0%}', name=f'Barge {name} - Occupied TEU'))
+        else:
+            for name, barge_data in occupancy.assign(date_time=date_times).groupby('name', sort=False):
+                kept = lttb(barge_data['date_time'].to_numpy(dtype='datetime64[ns]').astype('int64'),
+                            barge_data['norm_occupancy_teu'].to_numpy(), max_points)
+                fig.add_trace(go.Scattergl(x=barge_data['date_time'].iloc[kept],
+                                           y=barge_data['norm_occupancy_teu'].iloc[kept],
+                                           mode='lines', name=f'Barge {name} - Occupied TEU'))
 
         fig.update_layout(title='TEU allocation per barge, over time, normalized by capacity',
                           yaxis=dict(tickformat=".0%", title='Percentage'),
@@ -592,6 +653,7 @@ class VisualizationPlanning():
         # Show plot
         return fig
 
+    @cached_figure('dataframe_transit')
     def stack_teu_occupancy(self):
         """
         The transit shows the TEU capacity of the barges per transit.
@@ -614,6 +676,7 @@ class VisualizationPlanning():
 
         return fig
 
+    @cached_figure('dataframe_transit', tables=('terminals',))
     def map_transit(self):
         """
         Description: This visualization shows the transit on a map.
@@ -624,25 +687,17 @@ class VisualizationPlanning():
         :return: Transit map in streamlit app
         """
 
-        self.dataframe_transit['terminal_code'] = [terminal_id[5:] for terminal_id in
-                                                   self.dataframe_transit['transit_location_id']]
-        terminal_codes = list(self.dataframe_transit['terminal_code'].unique())
-        terminal_codes_str = ', '.join(f"'{code}'" for code in terminal_codes)
-
-        t_query = f"""SELECT terminal_code, latitude, longitude FROM terminals WHERE terminal_code IN ({terminal_codes_str})"""
-        retrieve_terminal_coordinates = load_query_from_db(t_query)
-
-        self.dataframe_transit = self.dataframe_transit.merge(retrieve_terminal_coordinates,
-                                                              on='terminal_code',
-                                                              how='left')
+        transit = self.dataframe_transit
+        if 'latitude' not in transit.columns:
+            transit = enrich_planning(None, transit, None)['transit']
 
         fig = go.Figure()
 
         fig.add_trace(go.Scattergeo(
-            lon=self.dataframe_transit['longitude'],
-            lat=self.dataframe_transit['latitude'],
+            lon=transit['longitude'],
+            lat=transit['latitude'],
             hoverinfo='text',
-            text=self.dataframe_transit['terminal_code'],
+            text=transit['terminal_code'],
             mode='markers',
             marker=dict(
                 size=2,
@@ -655,6 +710,46 @@ class VisualizationPlanning():
 
         return fig
 
+    @cached_figure('dataframe_calls', tables=('barges', 'terminals'))
+    def map_routes(self):
+        """
+        Description: This visualization shows the legs the barges sail between their calls on a map.
+        Purpose: Understand the routes of the barges.
+        Type: Map
+        Values used: Latitude and longitude of the origin and destination of every leg
+        Title: Route Map
+        :return: Route map in streamlit app
+        """
+
+        segments = self.route_segments
+        if segments is None:
+            segments = enrich_planning(self.dataframe_calls, None, None)['route_segments']
+
+        segments = segments.dropna(subset=['origin_latitude', 'origin_longitude', 'destination_latitude',
+                                                      'destination_longitude'])
+
+        fig = go.Figure()
+
+        # One trace per barge, the legs are separated by NaN so a barge is drawn as a single line
+        for name, barge_segments in segments.groupby(segments['name'].fillna('Unknown barge'), sort=True):
+            gap = np.full(len(barge_segments), np.nan)
+            text = barge_segments['origin_terminal_id'] + ' > ' + barge_segments['destination_terminal_id']
+            fig.add_trace(go.Scattergeo(
+                lon=np.column_stack([barge_segments['origin_longitude'], barge_segments['destination_longitude'],
+                                     gap]).ravel(),
+                lat=np.column_stack([barge_segments['origin_latitude'], barge_segments['destination_latitude'],
+                                     gap]).ravel(),
+                text=np.repeat(text.to_numpy(), 3),
+                hoverinfo='text',
+                mode='lines+markers',
+                name=name,
+                line=dict(width=2),
+                marker=dict(size=4)))
+
+        fig.update_layout(title='Route Map', geo=dict(fitbounds='locations', resolution=50))
+
+        return fig
+
 
 class VisualizationWeatherData():
     pass
@@ -731,7 +826,23 @@ class MapDesign:
 
 
 def closest_teu(color_chart, teu):
-    return min(color_chart.keys(), key=lambda x: abs(x - teu))
+    """
+    The TEU capacity of the color chart that is closest to the capacity of every barge, ties go to the smaller one
+
+    :param color_chart: dictionary with the TEU capacities as keys
+    :param teu: series or array with the TEU capacity of the barges, missing capacities get the smallest capacity
+    :return: array with a capacity of the color chart per barge
+    """
+
+    buckets = np.sort(np.array(list(color_chart.keys()), dtype=float))
+    teu = pd.to_numeric(pd.Series(teu, dtype=object), errors='coerce').to_numpy(dtype=float)
+
+    upper = np.clip(np.searchsorted(buckets, teu), 1, len(buckets) - 1) if len(buckets) > 1 else np.zeros(len(teu), int)
+    lower = np.maximum(upper - 1, 0)
+    closest = np.where(np.abs(teu - buckets[lower]) <= np.abs(buckets[upper] - teu), lower, upper)
+    closest[np.isnan(teu)] = 0
+
+    return buckets[closest].astype(int)
 
 class VisualizationMapData(MapDesign):
     def __init__(self, size, zoom, locations=None, barges=None, corridors=None, quays=None, vessels=None,
@@ -746,16 +857,7 @@ class VisualizationMapData(MapDesign):
         self.terminals = terminals
 
     def add_terminal_layer(self):
-        self.fig.add_trace(
-            go.Scattermapbox(
-                lat=self.terminals['latitude'],
-                lon=self.terminals['longitude'],
-                mode='markers',
-                marker=go.scattermapbox.Marker(size=9, color='red'),
-                text= self.terminals['terminal_description'],
-                name='Terminals'
-            )
-        )
+        self.fig.add_traces(terminal_traces(self.terminals, self.zoom))
         return self.fig
 
     def add_vessel_layer(self):
@@ -782,10 +884,9 @@ class VisualizationMapData(MapDesign):
         color_chart = {98: ['lightblue', '98 TEU'], 128: ['royalblue', '128 TEU'], 198: ['darkblue', '198 TEU']}
 
         # Apply the closest TEU function to the 'teu' column
-        #self.barges['teu'] = self.barges['teu'].apply(closest_teu, color_chart=color_chart)
-        self.barges['teu'] = self.barges['teu'].apply(lambda x: closest_teu(color_chart, x) if x is not None else 98)
+        self.barges['teu'] = closest_teu(color_chart, self.barges['teu'])
 
-        self.barges['color'] = self.barges['teu'].apply(lambda x: color_chart[x][0])
+        self.barges['color'] = self.barges['teu'].map({teu: color[0] for teu, color in color_chart.items()})
 
         self.fig.add_trace(
             go.Scattermapbox(
@@ -803,46 +904,32 @@ class VisualizationMapData(MapDesign):
             )
         )
 
-        # Add direction lines
-        for _, barge in self.barges.iterrows():
-            lat = barge['latitude']
-            lon = barge['longitude']
-            course = barge['course']
-            length = 0.001  # Length of the direction line
-
-            # Calculate the end coordinates of the line
-            end_lat = lat + length * np.cos(np.radians(course))
-            end_lon = lon + length * np.sin(np.radians(course))
-
-            self.fig.add_trace(
-                go.Scattermapbox(
-                    lat=[lat, end_lat],
-                    lon=[lon, end_lon],
-                    mode='lines',
-                    line=dict(width=2, color='blue'),
-                    showlegend=False
-                )
+        # Add direction lines, one trace with the lines of all barges separated by a gap
+        lat = self.barges['latitude'].to_numpy(dtype=float)
+        lon = self.barges['longitude'].to_numpy(dtype=float)
+        course = np.radians(self.barges['course'].to_numpy(dtype=float))
+        length = 0.001  # Length of the direction line
+
+        # Calculate the end coordinates of the lines
+        end_lat = lat + length * np.cos(course)
+        end_lon = lon + length * np.sin(course)
+        gap = np.full(len(lat), np.nan)
+
+        self.fig.add_trace(
+            go.Scattermapbox(
+                lat=np.column_stack([lat, end_lat, gap]).ravel(),
+                lon=np.column_stack([lon, end_lon, gap]).ravel(),
+                mode='lines',
+                line=dict(width=2, color='blue'),
+                hoverinfo='skip',
+                showlegend=False
             )
+        )
         return self.fig
 
     def add_corridor_layer(self):
-        corridors = {
-            'HCMC CORRIDOR WEST': 'm~e_A_{clS??qi@j[{Fpz@Q|`Akm@nTeoAqUal@nJ????aN`WyIfHsOtEeXTu_@cLeLkDiSyCuGjAiEjKcAjO}BzOwCjHmPdN}PfM}GrLcFbKuBfNkFdIiEzKaDpYwClPqEdTwC`RbA~TcAxGoCzGkFjD??k@rEQ`DyBxDk@pB??sUfo@gV~TuLb^rJpl@}iBpu@ch@rt@aIdPuVpG_Rd_@o[bHuVvPQ~\\vCxY~[tHxDha@fMzKnRzKwJrc@wClb@jFf`@jPzRr^nFtUvX??gC|ZaEfY}GhNoHdMoMhNw[zVuQrIqNhFip@`NaTdIuKzK}QxYmJjUsQdVwV~[iO`]yXxw@??gy@d~@??m_@j`@ws@re@wt@fQag@`@ej@kDw`@cPqp@ka@e}@uu@??zCfw@pEtq@{Fre@??o[pGwf@mEst@gj@{v@nJig@t_AhIn\\b_@bH??rYjAnR`D??`OnGhGlLR|M??JrYQhT????aR~^uUz]e[lIc_@oBk\\kJoWkOkO}t@cOiO_WgM{TqC_X`Cud@lTeRfEcZoJsYw[sA}[~WiNxb@wUtDyVQgUiT}W??eQeC_YJ??}SH',
-            'HCMC CORRIDOR EAST': 'm~e_A_{clS??qi@j[{Fpz@Q|`Akm@nTeoAqUal@nJ????aN`WyIfHsOtEeXTu_@cLeLkDiSyCuGjAiEjKcAjO}BzOwCjHmPdN}PfM}GrLcFbKuBfNkFdIiEzKaDpYwClPqEdTwC`RbA~TcAxGoCzGkFjD??k@rEQ`DyBxDk@pB??sUfo@gV~TuLb^rJpl@}iBpu@ch@rt@aIdPuVpG_Rd_@o[bHuVvPQ~\\vCxY~[tHxDha@fMzKnRzKwJrc@wClb@jFf`@jPzRr^nFtUvX??gC|ZaEfY}GhNoHdMoMhNw[zVuQrIqNhFip@`NaTdIuKzK}QxYmJjUsQdVwV~[iO`]yXxw@??gy@d~@??m_@j`@ws@re@wt@fQag@`@ej@kDw`@cPqp@ka@e}@uu@??q]}i@wYar@qS_^??aUsY????m^ogA??xDqg@|PwZ??`A_o@??Wuf@??c~@mi@cUwn@hEgeAnf@qd@eMut@yu@sAag@p]{c@bA}m@_z@me@ae@i_AnFmbAlq@eaD|wButAnk@kw@lLgpBfJ_k@~J??qNf@??mGT',
-            'HCMC CORRIDOR SOUTH': 'm~e_A_{clS??qi@j[{Fpz@Q|`Akm@nTeoAqUal@nJ????aN`WyIfHsOtEeXTu_@cLeLkDiSyCuGjAiEjKcAjO}BzOwCjHmPdN}PfM}GrLcFbKuBfNkFdIiEzKaDpYwClPqEdTwC`RbA~TcAxGoCzGkFjD??k@rEQ`DyBxDk@pB??sUfo@gV~TuLb^rJpl@}iBpu@ch@rt@aIdPuVpG_Rd_@o[bHuVvPQ~\\vCxY~[tHxDha@fMzKnRzKwJrc@wClb@jFf`@jPzRr^nFtUvX??gC|ZaEfY}GhNoHdMoMhNw[zVuQrIqNhFip@`NaTdIuKzK}QxYmJjUsQdVwV~[iO`]yXxw@??gy@d~@??m_@j`@ws@re@wt@fQag@`@ej@kDw`@cPqp@ka@e}@uu@??q]}i@wYar@qS_^??aUsY'
-        }
-
-        for name, polyline in corridors.items():
-            decoded = decode(polyline)
-            self.fig.add_trace(
-                go.Scattermapbox(
-                    lat=[p[0] for p in decoded],
-                    lon=[p[1] for p in decoded],
-                    mode='lines',
-                    line=dict(width=4, color='pink' if name == 'HCMC CORRIDOR EAST' else 'green' if name == 'HCMC CORRIDOR WEST' else 'yellow'),
-                    name=name
-                )
-            )
+        # The corridors are decoded once per process and simplified once per zoom level, see map_layers
+        self.fig.add_traces(corridor_traces(self.zoom))
         return self.fig
 
     def add_port_layer(self, ports: pd.DataFrame) -> go.Figure:
@@ -852,20 +939,7 @@ class VisualizationMapData(MapDesign):
         :return: (go.Figure) with the port layer added
         """
 
-        # Add locations, scale the size of the markers between 10 and 20 based on min and max values
-        teus_sizes = (ports['teu'] - ports['teu'].min()) / (ports['teu'].max() - ports['teu'].min()) * 10 + 20
-
-        self.fig.add_trace(
-            go.Scattermapbox(
-                lat=ports['port_latitude'],
-                lon=ports['port_longitude'],
-                mode='markers',
-                marker=go.scattermapbox.Marker(size=teus_sizes, color='red', opacity=0.7),
-                # add the port name and the teu capacity to the text
-                text=ports['Port'] + ' ' + ports['teu'].astype(str) + ' TEU',
-                name='Ports - TEU offered (size)'
-            )
-        )
+        self.fig.add_traces(port_traces(ports))
         return self.fig
 
 
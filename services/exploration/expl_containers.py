@@ -14,7 +14,7 @@ import sqlite3
 from itertools import groupby
 # from services.backend.transform_orders import TransformContainers
 from data.service_database import load_datatable_from_db
-from services.backend.visualisation_creation import VizualisationContainerOrders
+from services.backend.order_profile import profile_orders
 
 def most_common_string(strings):
     # Sort the strings to group identical strings together
@@ -47,6 +47,7 @@ class ContainerFileAnalyser:
             self.df = self.load_data(file_path)
 
         if self.df is not None:
+            self.profile = profile_orders(self.df)
             self.missing_values = self.check_for_missing_values()
             self.duplicates = self.check_for_duplicates()
             self.column_references = self.check_for_column_references()
@@ -86,7 +87,7 @@ class ContainerFileAnalyser:
         :return: Series containing the count of missing values for each column
         """
         if self.df is not None:
-            return self.df.isnull().sum()
+            return self.profile.missing
         else:
             return None
 
@@ -97,7 +98,7 @@ class ContainerFileAnalyser:
         :return: number of duplicate rows
         """
         if self.df is not None:
-            return self.df.duplicated().sum()
+            return self.profile.duplicates
         else:
             return None
 
@@ -111,7 +112,7 @@ class ContainerFileAnalyser:
         if not 'weight' in self.df.columns:
             return "Weight column not found in the dataframe."
         else:
-            return self.df['weight'].describe()
+            return self.profile.weight
 
     def analyse_window_times(self):
         # create a list of differences between the start and end time windows and and the loadTimeWindowEnd and dischargeTimeWindowStart
@@ -120,17 +121,13 @@ class ContainerFileAnalyser:
                    ['loadTimeWindowStart', 'loadTimeWindowEnd', 'dischargeTimeWindowStart', 'dischargeTimeWindowEnd']):
             return "Time window columns not found in the dataframe."
 
-        time_windows = self.df[['loadTimeWindowStart', 'loadTimeWindowEnd',
-                                'dischargeTimeWindowStart', 'dischargeTimeWindowEnd']].copy()
-
-        # Time windows are strings '%Y-%m-%dT%H:%M:%SZ' so we need to convert them to datetime
-        time_windows = time_windows.map(lambda x: datetime.strptime(x, '%Y-%m-%dT%H:%M:%SZ'))
-
-        time_windows["loadTimeWindow"] = time_windows["loadTimeWindowEnd"] - time_windows["loadTimeWindowStart"]
-        time_windows["dischargeTimeWindow"] = time_windows["dischargeTimeWindowEnd"] - time_windows["dischargeTimeWindowStart"]
+        # The durations of the time windows in hours of the profile
+        time_windows = pd.DataFrame({"loadTimeWindow": pd.to_timedelta(self.profile.window_hours['load'], unit='h'),
+                                     "dischargeTimeWindow": pd.to_timedelta(self.profile.window_hours['discharge'],
+                                                                            unit='h')})
 
         # get the mean, max and min of the time differences
-        time_diff = time_windows[["loadTimeWindow", "dischargeTimeWindow"]].describe()
+        time_diff = time_windows.describe()
 
 
         return time_diff
@@ -141,8 +138,8 @@ class ContainerFileAnalyser:
         :return:
         """
 
-        # Create a groupby object to group the data by bookingCreateDate
-        booking_dates = self.df.groupby("bookingDateCreated")['bookingDateCreated'].count()
+        # The number of bookings per creation day
+        booking_dates = self.profile.daily['bookingDateCreated']
 
         return booking_dates
 
@@ -214,8 +211,8 @@ class ContainerFileAnalyser:
 
         strg_output += string_divider
 
-        strg_output += f"The dataframe counts {self.df.shape[0]} rows and {self.df.shape[1]} columns\n"
-        strg_output += f"The column names are:\n{self.df.columns}\n"
+        strg_output += f"The dataframe counts {self.profile.rows} rows and {len(self.profile.columns)} columns\n"
+        strg_output += f"The column names are:\n{self.profile.columns}\n"
 
         strg_output += string_divider
 
@@ -231,8 +228,13 @@ class ContainerFileAnalyser:
 
         strg_output += string_divider
 
+        if self.profile.weight is not None:
+            strg_output += f"Container weights:\n{self.profile.weight}\n"
+
         strg_output += string_divider
 
+        for window in self.profile.window_hours:
+            strg_output += f"Duration of the {window} time windows in hours:\n{self.profile.window_quantiles(window)}\n"
 
         strg_output += string_divider
 
@@ -0,0 +1,17 @@
+""" Run the tests in a temporary project directory with dummy secrets, the API modules read them when imported """
+import os
+import sys
+import tempfile
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+_project_directory = tempfile.TemporaryDirectory()
+os.makedirs(os.path.join(_project_directory.name, '.streamlit'))
+os.makedirs(os.path.join(_project_directory.name, 'data'))
+with open(os.path.join(_project_directory.name, '.streamlit', 'secrets.toml'), 'w') as f:
+    f.write('PMA_USER_NAME = "user"\n'
+            'PMA_PASSWORD = "password"\n'
+            'BOS_URL = "http://127.0.0.1/"\n'
+            'BOS_AUTH = ["user", "password"]\n')
+os.chdir(_project_directory.name)
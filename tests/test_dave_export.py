@@ -0,0 +1,174 @@
+""" DaveExporter against a local mock of Dave that records the decompressed batches """
+import datetime as dt
+import gzip
+import json
+import random
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import services.api_service.dave_export as dave_export
+
+
+class PlanningRecords:
+    """
+    Stand-in for TransformToDave with the attributes export_planning uses. The records follow from the seed and the
+    time shift of the calls, the default time shift differs per object like the shift to now of TransformToDave.
+    """
+
+    def __init__(self, seed, default_shift_days, containers=45, voyages=25):
+        self.seed = seed
+        self.pmaCalls = [dt.datetime(2024, 12, 1) + dt.timedelta(hours=i) for i in range(voyages)]
+        self.time_shift = None
+        self.timestampErrors = []
+        self.default_shift = dt.timedelta(days=default_shift_days)
+        self.containers = containers
+
+    def call_time_shift(self):
+        if self.time_shift is None:
+            self.time_shift = self.default_shift
+        return self.time_shift
+
+    def dave_containers(self):
+        ids = random.Random(self.seed).sample(range(1, 100000), self.containers)
+        for i, id_no in enumerate(ids):
+            yield {"ts": time.strftime('%Y-%m-%d %H:%M:%S'), "con": f"CONU{i:07d}", "coi": str(id_no), "cui": 33}
+
+    def dave_call_voyages(self):
+        for i, start in enumerate(self.pmaCalls):
+            pta = (start + self.call_time_shift()).strftime('%Y-%m-%dT%H:%M:%SZ')
+            yield {"ts": time.strftime('%Y-%m-%d %H:%M:%S'), "voi": f"IMP{i}", "stops": [{"pta": pta}]}
+
+
+@pytest.fixture
+def export_database(tmp_path, monkeypatch):
+    database = str(tmp_path / 'dave_export.db')
+    monkeypatch.setattr(dave_export, 'EXPORT_DATABASE', database)
+
+    return database
+
+
+@pytest.fixture
+def mock_dave():
+    """
+    Mock of Dave: records the path and the decompressed records of every request. Requests with a record in 'failing'
+    are answered with 'failing_status'. The highest number of requests at the same time is kept in 'max_in_flight'.
+    """
+
+    state = {'received': [], 'refused': [], 'failing': set(), 'failing_status': 500, 'in_flight': 0,
+             'max_in_flight': 0}
+    lock = threading.Lock()
+
+    class MockDave(BaseHTTPRequestHandler):
+        def do_POST(self):
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            try:
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                assert self.headers['Content-Encoding'] == 'gzip'
+                records = json.loads(gzip.decompress(body))
+                # Some time in flight, so the exporter has several requests open
+                time.sleep(0.02)
+
+                if any(record.get('voi', record.get('con')) in state['failing'] for record in records):
+                    with lock:
+                        state['refused'].append((self.path, records))
+                    self.send_response(state['failing_status'])
+                    self.end_headers()
+                    return
+
+                with lock:
+                    state['received'].append((self.path, records))
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b'{}')
+            finally:
+                with lock:
+                    state['in_flight'] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockDave)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    exporter = dave_export.DaveExporter(base_url=f"http://127.0.0.1:{server.server_port}/", auth=('user', 'password'),
+                                        batch_size=10, max_in_flight=2, retries=2, retry_delay=0.01)
+
+    yield exporter, state
+
+    server.shutdown()
+    server.server_close()
+
+
+def _records(state, endpoint):
+    return [record for path, records in state['received'] if path.endswith(endpoint) for record in records]
+
+
+def test_export_resumes_with_the_missing_batches(export_database, mock_dave):
+    exporter, state = mock_dave
+
+    # The second voyage batch is refused until the export is started again
+    state['failing'] = {'IMP15'}
+    first = exporter.export_planning('export-1', PlanningRecords(seed=7, default_shift_days=10))
+
+    assert first[dave_export.CARGO_ENDPOINT]['sent'] == 5
+    assert len(first[dave_export.VOYAGE_ENDPOINT]['errors']) == 1
+    # The refused batch was retried
+    assert [records[0]['voi'] for _, records in state['refused']] == ['IMP10'] * 3
+    assert state['max_in_flight'] <= 2
+
+    acknowledged = dave_export.acknowledged_batches('export-1', dave_export.VOYAGE_ENDPOINT)
+    assert 1 not in acknowledged
+    containers = _records(state, dave_export.CARGO_ENDPOINT)
+    first_voyages = _records(state, dave_export.VOYAGE_ENDPOINT)
+
+    # The same seed, another default time shift: the stored time shift is used, so the records are the same
+    state['failing'] = set()
+    state['received'] = []
+    second = exporter.export_planning('export-1', PlanningRecords(seed=7, default_shift_days=11))
+
+    assert second[dave_export.CARGO_ENDPOINT]['skipped'] == 5
+    assert second[dave_export.CARGO_ENDPOINT]['sent'] == 0
+    assert second[dave_export.VOYAGE_ENDPOINT]['skipped'] == len(acknowledged)
+    assert second[dave_export.VOYAGE_ENDPOINT]['sent'] == 3 - len(acknowledged)
+    assert _records(state, dave_export.CARGO_ENDPOINT) == []
+
+    resent = [records for path, records in state['received'] if path.endswith(dave_export.VOYAGE_ENDPOINT)]
+    assert sorted(int(records[0]['voi'][3:]) // 10 for records in resent) == \
+        sorted(set(range(3)) - set(acknowledged))
+
+    voyages = sorted(first_voyages + _records(state, dave_export.VOYAGE_ENDPOINT),
+                     key=lambda record: int(record['voi'][3:]))
+    assert [record['voi'] for record in voyages] == [f"IMP{i}" for i in range(25)]
+    assert voyages[0]['stops'][0]['pta'] == '2024-12-11T00:00:00Z'
+    assert len({record['con'] for record in containers}) == 45
+
+    connection = sqlite3.connect(export_database)
+    assert connection.execute("SELECT seed, time_shift FROM dave_exports WHERE export_id = 'export-1'").fetchone() == \
+        (7, 10 * 24 * 3600)
+    connection.close()
+
+
+def test_export_needs_the_seed_it_was_started_with(export_database, mock_dave):
+    exporter, state = mock_dave
+    exporter.export_planning('export-2', PlanningRecords(seed=1, default_shift_days=0, containers=3, voyages=2))
+
+    with pytest.raises(ValueError, match='seed 1'):
+        exporter.export_planning('export-2', PlanningRecords(seed=2, default_shift_days=0))
+    with pytest.raises(ValueError, match='needs a TransformToDave with a seed'):
+        exporter.export_planning('export-3', PlanningRecords(seed=None, default_shift_days=0))
+
+
+def test_refused_batch_is_not_retried(export_database, mock_dave):
+    exporter, state = mock_dave
+    state['failing'] = {'CONU0000000'}
+    state['failing_status'] = 400
+
+    summary = exporter.export('export-4', dave_export.CARGO_ENDPOINT,
+                              PlanningRecords(seed=3, default_shift_days=0).dave_containers())
+
+    assert len(state['refused']) == 1
+    assert 'status 400' in summary['errors'][0]
+    assert 0 not in dave_export.acknowledged_batches('export-4', dave_export.CARGO_ENDPOINT)
@@ -0,0 +1,116 @@
+""" PmaPoller against a local stub of the PMA API that finishes a planning after a number of 500 responses """
+import json
+import sqlite3
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import services.api_service.pma_poller as pma_poller
+
+
+OUTPUT = {"routes": [{"vessel": "Albatross", "stops": []}], "orders": [{"orderId": 1}], "unplannedOrders": []}
+
+
+@pytest.fixture
+def results_database(tmp_path, monkeypatch):
+    database = str(tmp_path / 'pma_results.db')
+    monkeypatch.setattr(pma_poller, 'RESULTS_DATABASE', database)
+
+    return database
+
+
+@pytest.fixture
+def stub_pma():
+    """
+    Stub of the PMA API: a planning answers 'status' (500 by default) to the first 'failures' requests and then 200
+    with OUTPUT. The requests per planning are counted.
+    """
+
+    plannings = {}
+    requests_per_planning = {}
+    lock = threading.Lock()
+
+    class StubPma(BaseHTTPRequestHandler):
+        def do_GET(self):
+            planning_id = self.path.split('/')[3]
+            with lock:
+                requests_per_planning[planning_id] = requests_per_planning.get(planning_id, 0) + 1
+                count = requests_per_planning[planning_id]
+            failures, status = plannings[planning_id]
+
+            if count <= failures:
+                self.send_response(status)
+                self.end_headers()
+                self.wfile.write(b'not finished')
+                return
+
+            body = json.dumps(OUTPUT).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubPma)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    poller = pma_poller.PmaPoller(base_url=f"http://127.0.0.1:{server.server_port}", initial_delay=0.01,
+                                  max_delay=0.05, timeout=10, request_timeout=5)
+
+    yield poller, plannings, requests_per_planning
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_retries_server_errors_and_stores_the_output(results_database, stub_pma):
+    poller, plannings, requests_per_planning = stub_pma
+    plannings['planning-1'] = (3, 500)
+
+    assert poller.track('planning-1').result(10) == OUTPUT
+
+    assert requests_per_planning['planning-1'] == 4
+    assert poller.status('planning-1') == {'status': 'completed', 'attempts': 4, 'server_errors': 3, 'error': None}
+
+    connection = sqlite3.connect(results_database)
+    output, size, compressed_size = connection.execute(
+        "SELECT output, size, compressed_size FROM pma_results WHERE planning_id = 'planning-1'").fetchone()
+    connection.close()
+    data = json.dumps(OUTPUT, separators=(',', ':')).encode()
+    assert zlib.decompress(output) == data
+    assert (size, compressed_size) == (len(data), len(output))
+    assert pma_poller.load_pma_result('planning-1') == OUTPUT
+
+    # A stored planning isn't requested again
+    assert pma_poller.PmaPoller(base_url=poller.base_url).track('planning-1').result(1) == OUTPUT
+    assert requests_per_planning['planning-1'] == 4
+
+
+def test_client_error_fails_the_planning_at_once(results_database, stub_pma):
+    poller, plannings, requests_per_planning = stub_pma
+    plannings['planning-2'] = (100, 404)
+
+    with pytest.raises(RuntimeError, match='status 404'):
+        poller.track('planning-2').result(10)
+
+    assert requests_per_planning['planning-2'] == 1
+    assert poller.status('planning-2')['status'] == 'failed'
+    assert pma_poller.load_pma_result('planning-2') is None
+
+
+def test_rate_limit_is_retried(results_database, stub_pma):
+    poller, plannings, requests_per_planning = stub_pma
+    plannings['planning-3'] = (2, 429)
+
+    assert poller.track('planning-3').result(10) == OUTPUT
+    assert requests_per_planning['planning-3'] == 3
+    assert poller.status('planning-3')['server_errors'] == 0
+
+
+def test_delay_doubles_with_jitter_up_to_the_maximum():
+    poller = pma_poller.PmaPoller(base_url='http://127.0.0.1', initial_delay=1, max_delay=8)
+
+    for attempt, delay in enumerate([1, 2, 4, 8, 8]):
+        delays = [poller.delay(attempt) for _ in range(50)]
+        assert all(delay / 2 <= value <= delay for value in delays)